@@ -0,0 +1,175 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from file_utils import read_ply  # noqa: E402
+from model_roof_planes import detect_plane_ransac, model_roof_planes  # noqa: E402
+from planar_regression import planar_regression_lstsq  # noqa: E402
+from point_cloud_utils import assign_points_to_faces, lasso_points  # noqa: E402
+from synthetic import complex_roof, gable_roof, hip_roof, sample_roof_points, write_synthetic_building  # noqa: E402
+
+
+##############################
+# Reproducible benchmarks of the roof modeling stages on synthetic roofs. Results are written as JSON so that runs
+# on different commits can be compared with --compare.
+#
+#   python benchmarks/bench_roof_planes.py --quick
+#   python benchmarks/bench_roof_planes.py --compare benchmarks/results/<a>.json benchmarks/results/<b>.json
+##############################
+
+
+QUICK_POINTS = [10_000, 100_000]
+QUICK_FACES = [4, 20]
+FULL_POINTS = [10_000, 100_000, 1_000_000, 10_000_000]
+FULL_FACES = [4, 20, 60, 200]
+
+
+def make_roof(n_faces: int, seed: int):
+    """
+    Gable (2 faces) and hip (4 faces) roofs for small face counts, complex roofs otherwise
+    """
+    if n_faces <= 2:
+        return "gable", gable_roof()
+    if n_faces <= 4:
+        return "hip", hip_roof()
+    return "complex", complex_roof(n_faces, seed=seed)
+
+
+def best_time(func, repeat: int) -> float:
+    """
+    Best wall time in seconds over repeat calls
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_case(n_points: int, n_faces: int, noise: float, outlier_rate: float, repeat: int, seed: int) -> list[dict]:
+    """
+    Time every stage on one synthetic roof
+    """
+    roof_type, roof = make_roof(n_faces, seed)
+    point_cloud = sample_roof_points(roof, n_points, noise=noise, outlier_rate=outlier_rate, seed=seed)
+    face_polygons = [roof.vertices[face, :] for face in roof.faces]
+    _, face_indices = assign_points_to_faces(point_cloud, face_polygons)
+    face_points = [point_cloud[face_idx, :3] for face_idx in face_indices]
+
+    with tempfile.TemporaryDirectory() as data_path:
+        write_synthetic_building(data_path, "bench", roof, point_cloud)
+        stages = {
+            "read_ply": lambda: read_ply(data_path, "bench"),
+            "lasso_points": lambda: [lasso_points(polygon, point_cloud) for polygon in face_polygons],
+            "assign_points_to_faces": lambda: assign_points_to_faces(point_cloud, face_polygons),
+            "planar_regression_lstsq": lambda: [planar_regression_lstsq(points) for points in face_points],
+            "detect_plane_ransac": lambda: [detect_plane_ransac(points) for points in face_points],
+            "model_roof_planes_ransac": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="ransac"),
+            "model_roof_planes_ransac_threaded": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="ransac", workers=4),
+            "model_roof_planes_normal_ransac": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="normal_ransac"),
+            "model_roof_planes_irls": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="irls"),
+            "model_roof_planes_auto": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="auto"),
+            "model_roof_planes_least_squares": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="least_squares"),
+            "model_roof_planes_joint": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="joint"),
+            "model_roof_planes_ransac_downsampled": lambda: model_roof_planes(
+                point_cloud, roof.vertices, roof.faces, algorithm="ransac", max_points_per_face=2000),
+        }
+
+        results = []
+        for stage, func in stages.items():
+            seconds = best_time(func, repeat)
+            results.append({
+                "roof": roof_type,
+                "n_points": n_points,
+                "n_faces": len(roof.faces),
+                "stage": stage,
+                "seconds": seconds,
+            })
+            print(f"{roof_type:8s} {n_points:>10d} points {len(roof.faces):>4d} faces  {stage:32s} {seconds:10.4f} s")
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=Path(__file__).parent).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(base_path: Path, new_path: Path):
+    """
+    Print the time ratio new / base of every case and stage found in both result files
+    """
+    def load(path: Path) -> dict:
+        with open(path) as fp:
+            report = json.load(fp)
+        return report["commit"], {(r["roof"], r["n_points"], r["n_faces"], r["stage"]): r["seconds"]
+                                  for r in report["results"]}
+
+    base_commit, base = load(base_path)
+    new_commit, new = load(new_path)
+    print(f"{'case':60s} {base_commit:>10s} {new_commit:>10s}  ratio")
+    for key in sorted(base.keys() & new.keys()):
+        case = "{} {} points {} faces {}".format(*key)
+        print(f"{case:60s} {base[key]:10.4f} {new[key]:10.4f}  {new[key] / base[key]:5.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark roof modeling stages on synthetic roofs")
+    parser.add_argument("--quick", action="store_true", help="small sweep for a fast check")
+    parser.add_argument("--points", type=int, nargs="+", default=None, help="point counts to sweep")
+    parser.add_argument("--faces", type=int, nargs="+", default=None, help="face counts to sweep")
+    parser.add_argument("--noise", type=float, default=0.02, help="z noise standard deviation in meters")
+    parser.add_argument("--outlier-rate", type=float, default=0.05, help="fraction of roof points that are outliers")
+    parser.add_argument("--repeat", type=int, default=3, help="best of repeat timings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="results JSON (default: results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    args_ = parser.parse_args()
+
+    if args_.compare:
+        compare(*args_.compare)
+        sys.exit(0)
+
+    points_ = args_.points or (QUICK_POINTS if args_.quick else FULL_POINTS)
+    faces_ = args_.faces or (QUICK_FACES if args_.quick else FULL_FACES)
+    commit_ = git_commit()
+
+    results_ = []
+    for n_points_ in points_:
+        for n_faces_ in faces_:
+            results_ += run_case(n_points_, n_faces_, args_.noise, args_.outlier_rate, args_.repeat, args_.seed)
+
+    output_ = args_.output or Path(__file__).parent / "results" / f"{commit_}.json"
+    output_.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_, "w") as fp_:
+        json.dump({
+            "commit": commit_,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "settings": {"noise": args_.noise, "outlier_rate": args_.outlier_rate, "repeat": args_.repeat,
+                         "seed": args_.seed},
+            "results": results_,
+        }, fp_, indent=2)
+    print(f"results written to {output_}")
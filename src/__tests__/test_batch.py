@@ -0,0 +1,138 @@
+import json
+import numpy as np
+from PIL import Image
+from plyfile import PlyData, PlyElement
+
+import batch
+from batch import discover_uids, process_building, run_batch
+from result_cache import ResultCache
+
+
+def write_building(building_path, write_dsm=True):
+    """
+    Write a flat 20 x 10 meter roof with 2 faces and 10 pixels-per-meter centered in a 301 x 301 ortho
+    """
+    building_path.mkdir(parents=True)
+    Image.fromarray(np.zeros((301, 301, 3), dtype=np.uint8)).save(building_path / "ortho.png")
+    metadata = {
+        "pixels_per_meter": 10.0,
+        "vertices": [[50, 100], [150, 100], [250, 100], [250, 200], [150, 200], [50, 200]],
+        "edges": [[0, 1], [1, 2], [2, 3], [3, 4], [4, 5], [5, 0], [1, 4]],
+        "faces": [[0, 1, 4, 5], [1, 2, 3, 4]],
+    }
+    with open(building_path / "metadata.json", "w") as fp:
+        json.dump(metadata, fp)
+
+    if write_dsm:
+        rng = np.random.default_rng(0)
+        n = 2000
+        dtype = [(name, "f4") for name in ("x", "y", "z", "nx", "ny", "nz")] + \
+                [(name, "u1") for name in ("red", "green", "blue")]
+        vertex = np.zeros(n, dtype=dtype)
+        vertex["x"] = rng.uniform(-10.0, 10.0, size=n)
+        vertex["y"] = rng.uniform(-5.0, 5.0, size=n)
+        vertex["z"] = 3.0
+        vertex["nz"] = 1.0
+        PlyData([PlyElement.describe(vertex, "vertex")]).write(str(building_path / "dsm.ply"))
+
+
+def test_discover_uids(tmp_path):
+    write_building(tmp_path / "b")
+    write_building(tmp_path / "a")
+    write_building(tmp_path / "no_dsm", write_dsm=False)
+    assert discover_uids(tmp_path) == ["a", "b"]
+
+
+def test_process_building(tmp_path):
+    write_building(tmp_path / "a")
+    result = process_building(tmp_path, "a", algorithm="least_squares")
+    assert result["error"] is None
+    assert len(result["planes"]) == 2
+    np.testing.assert_almost_equal(result["planes"][0], [0.0, 0.0, 1.0, -3.0], decimal=5)
+
+    result_cached = process_building(tmp_path, "a", algorithm="least_squares", cache=True)
+    assert (tmp_path / "a" / ".cache" / "manifest.json").is_file()
+    np.testing.assert_almost_equal(result_cached["planes"], result["planes"])
+
+    for _ in range(2):
+        result_reused = process_building(tmp_path, "a", algorithm="least_squares", result_cache=tmp_path / "results")
+        assert result_reused["planes"] == result["planes"]
+    assert len(list((tmp_path / "results").glob("*.json"))) == 1
+
+    result_instrumented = process_building(tmp_path, "a", algorithm="least_squares", instrument=True)
+    report = result_instrumented["instrumentation"]
+    assert report["context"] == {"uid": "a"}
+    assert set(report["stages"]) == {"read", "assign", "fit"}
+    assert report["counters"]["points"] == 2000
+    assert "instrumentation" not in result
+
+    result = process_building(tmp_path, "missing")
+    assert result["planes"] is None
+    assert result["error"] is not None
+
+
+def test_run_batch(tmp_path):
+    data_path = tmp_path / "data"
+    write_building(data_path / "a")
+    write_building(data_path / "b")
+    write_building(data_path / "no_dsm", write_dsm=False)
+    results_path = tmp_path / "results.jsonl"
+
+    summary = run_batch(data_path, results_path, uids=["a", "no_dsm", "b"], algorithm="least_squares",
+                        workers=2, max_in_flight=2)
+
+    assert summary["succeeded"] == 2
+    assert summary["failed"] == 1  # a failed building does not stop the batch
+    with open(results_path) as fp:
+        results = {result["uid"]: result for result in map(json.loads, fp)}
+    assert set(results) == {"a", "b", "no_dsm"}
+    assert results["no_dsm"]["error"] is not None
+    assert len(results["a"]["planes"]) == 2
+    assert results["a"]["seconds"] > 0
+
+
+def test_run_batch_mesh(tmp_path):
+    data_path = tmp_path / "data"
+    write_building(data_path / "a")
+    write_building(data_path / "b")
+    results_path, mesh_path = tmp_path / "results.jsonl", tmp_path / "roofs.ply"
+
+    summary = run_batch(data_path, results_path, algorithm="least_squares", workers=2, mesh_path=mesh_path)
+    assert summary["succeeded"] == 2
+    with open(results_path) as fp:
+        results = list(map(json.loads, fp))
+    assert sorted(result["mesh_index"] for result in results) == [0, 1]
+
+    # 2 rectangular faces of 2 triangles each per building, at the roof height
+    mesh = PlyData.read(str(mesh_path))
+    assert mesh["vertex"].count == 16
+    assert mesh["face"].count == 8
+    np.testing.assert_almost_equal(mesh["vertex"]["z"], 3.0, decimal=4)
+
+
+def test_process_building_mesh_error(tmp_path, monkeypatch):
+    write_building(tmp_path / "a")
+
+    def roof_mesh(vertices, faces, planes):
+        raise ValueError("cannot triangulate")
+
+    # a building whose mesh fails keeps its planes
+    monkeypatch.setattr(batch, "roof_mesh", roof_mesh)
+    result = process_building(tmp_path, "a", algorithm="least_squares", mesh=True)
+    assert result["error"] is None
+    assert len(result["planes"]) == 2
+    assert result["mesh_error"] == "ValueError: cannot triangulate"
+    assert "mesh" not in result
+
+
+def test_process_building_result_cache_scans(tmp_path, monkeypatch):
+    write_building(tmp_path / "a")
+
+    # the fits of a process share its cache, which lists the directory once rather than on every put
+    scans = []
+    evict = ResultCache.evict
+    monkeypatch.setattr(ResultCache, "evict", lambda self: scans.append(1) or evict(self))
+    for algorithm in ("least_squares", "irls", "joint", "ransac"):
+        assert process_building(tmp_path, "a", algorithm=algorithm, result_cache=tmp_path / "results")["planes"]
+    assert len(list((tmp_path / "results").glob("*.json"))) == 4
+    assert len(scans) == 1
@@ -1,6 +1,11 @@
 import numpy as np
+import numpy.testing as npt
 from pathlib import Path
-from src.file_utils import read_image, read_ply, read_metadata
+from plyfile import PlyData, PlyElement
+import os
+from src.file_utils import read_image, read_ply, read_metadata, read_ply_header, read_ply_mmap, read_ply_cached, \
+    read_cached_bounds, assign_points_to_faces_cached, read_image_lazy, iter_ply_chunks
+from PIL import Image
 from visualize import visualize_image, visualize_point_cloud, visualize_2d_features_image_overlay
 
 VISUALIZE = False
@@ -46,3 +51,134 @@ def test_read_metadata():
 
     if VISUALIZE:
         visualize_2d_features_image_overlay(img, vertices, edges, faces)
+
+
+def write_dsm(data_path, uid, n=100, text=False):
+    """
+    Write a dsm.ply with float32 coordinates and normals and uint8 colors
+    """
+    rng = np.random.default_rng(0)
+    dtype = [(name, "f4") for name in ("x", "y", "z", "nx", "ny", "nz")] + \
+            [(name, "u1") for name in ("red", "green", "blue")]
+    vertex = np.zeros(n, dtype=dtype)
+    for name in ("x", "y", "z", "nx", "ny", "nz"):
+        vertex[name] = rng.normal(size=n)
+    for name in ("red", "green", "blue"):
+        vertex[name] = rng.integers(0, 256, size=n)
+
+    (Path(data_path) / uid).mkdir(parents=True, exist_ok=True)
+    PlyData([PlyElement.describe(vertex, "vertex")], text=text).write(str(Path(data_path) / uid / "dsm.ply"))
+    return vertex
+
+
+def test_read_ply_header(tmp_path):
+    write_dsm(tmp_path, "a", n=100)
+    ply_format, n_vertices, vertex_dtype, data_offset = read_ply_header(tmp_path / "a" / "dsm.ply")
+
+    assert ply_format == "binary_little_endian"
+    assert n_vertices == 100
+    assert vertex_dtype.names == ("x", "y", "z", "nx", "ny", "nz", "red", "green", "blue")
+    assert vertex_dtype.itemsize == 27
+    assert data_offset + 100 * 27 == (tmp_path / "a" / "dsm.ply").stat().st_size
+
+
+def test_read_ply_mmap(tmp_path):
+    for uid, text in (("binary", False), ("ascii", True)):
+        vertex = write_dsm(tmp_path, uid, text=text)
+        point_cloud = read_ply_mmap(tmp_path, uid)
+
+        assert len(point_cloud) == 100
+        assert point_cloud.xyz.dtype == np.float32  # native dtypes
+        assert point_cloud.colors.dtype == np.uint8
+        npt.assert_array_equal(point_cloud.xyz[:, 0], vertex["x"])
+        npt.assert_array_equal(point_cloud.normals[:, 2], vertex["nz"])
+        npt.assert_array_equal(point_cloud.colors[:, 1], vertex["green"])
+
+        # read_ply keeps its (N, 9) float64 layout
+        point_cloud_array = read_ply(tmp_path, uid)
+        assert point_cloud_array.shape == (100, 9)
+        assert point_cloud_array.dtype == np.float64
+        npt.assert_array_equal(point_cloud_array, point_cloud.to_array())
+
+
+def test_read_ply_other_elements(tmp_path):
+    vertex = write_dsm(tmp_path, "a")
+    face = np.empty(2, dtype=[("vertex_indices", "O")])
+    face["vertex_indices"] = [np.array([0, 1, 2], dtype=np.int32), np.array([2, 3, 4], dtype=np.int32)]
+    faces = PlyElement.describe(face, "face")
+    ply_vertex = PlyElement.describe(vertex, "vertex")
+    expected = read_ply(tmp_path, "a")
+
+    # faces after the vertices are ignored; faces before them are read by plyfile
+    for uid, elements, text in (("binary", [ply_vertex, faces], False), ("ascii", [ply_vertex, faces], True),
+                                ("faces_first", [faces, ply_vertex], False)):
+        (tmp_path / uid).mkdir()
+        PlyData(elements, text=text).write(str(tmp_path / uid / "dsm.ply"))
+        npt.assert_array_equal(read_ply(tmp_path, uid), expected)
+    assert read_ply_header(tmp_path / "binary" / "dsm.ply")[1] == 100
+    chunks = list(iter_ply_chunks(tmp_path, "binary", chunk_size=30))
+    npt.assert_array_equal(np.concatenate([chunk.to_array() for chunk in chunks]), expected)
+
+
+def test_read_ply_cached(tmp_path):
+    vertex = write_dsm(tmp_path, "a")
+    cache_path = tmp_path / "a" / ".cache"
+
+    # first read writes the cache
+    point_cloud = read_ply_cached(tmp_path, "a")
+    assert (cache_path / "manifest.json").is_file()
+    assert isinstance(point_cloud.xyz, np.memmap)
+    npt.assert_array_equal(point_cloud.xyz[:, 0], vertex["x"])
+    npt.assert_array_equal(point_cloud.colors[:, 2], vertex["blue"])
+    bounds = read_cached_bounds(tmp_path, "a")
+    npt.assert_array_equal(bounds[0], point_cloud.xyz.min(axis=0))
+    npt.assert_array_equal(bounds[1], point_cloud.xyz.max(axis=0))
+
+    # a touched dsm keeps its cache
+    mtime = (cache_path / "xyz.npy").stat().st_mtime_ns
+    os.utime(tmp_path / "a" / "dsm.ply", ns=(1, 1))
+    read_ply_cached(tmp_path, "a")
+    assert (cache_path / "xyz.npy").stat().st_mtime_ns == mtime
+
+    # a changed dsm rebuilds the cache
+    vertex = write_dsm(tmp_path, "a", n=50)
+    point_cloud = read_ply_cached(tmp_path, "a")
+    assert len(point_cloud) == 50
+    npt.assert_array_equal(point_cloud.xyz[:, 1], vertex["y"])
+
+
+def test_assign_points_to_faces_cached(tmp_path):
+    write_dsm(tmp_path, "a")
+    point_cloud = read_ply_cached(tmp_path, "a")
+    face_polygons = [np.array([[0.0, 0.0], [5.0, 0.0], [5.0, 5.0], [0.0, 5.0]])]
+
+    labels = assign_points_to_faces_cached(tmp_path, "a", point_cloud, face_polygons)
+    assert len(list((tmp_path / "a" / ".cache").glob("labels_*.npy"))) == 1
+    labels_cached = assign_points_to_faces_cached(tmp_path, "a", point_cloud, face_polygons)
+    assert isinstance(labels_cached, np.memmap)
+    npt.assert_array_equal(labels_cached, labels)
+    npt.assert_array_equal(labels == 0, np.all(point_cloud.xyz[:, :2] > 0, axis=1))
+
+
+def test_read_image_lazy(tmp_path):
+    img = np.arange(20 * 30 * 3, dtype=np.uint8).reshape((20, 30, 3))
+    (tmp_path / "a").mkdir()
+    Image.fromarray(img).save(tmp_path / "a" / "ortho.png")
+
+    lazy_img = read_image_lazy(tmp_path, "a")
+    assert lazy_img.shape == (20, 30, 3)
+    assert lazy_img.size == (30, 20)
+    npt.assert_array_equal(lazy_img.to_array(), img)
+    npt.assert_array_equal(lazy_img.crop((5, 2, 15, 12)), img[2:12, 5:15])
+
+    assert read_image_lazy(tmp_path, "missing") is None
+
+
+def test_iter_ply_chunks(tmp_path):
+    for uid, text in (("binary", False), ("ascii", True)):
+        vertex = write_dsm(tmp_path, uid, n=100, text=text)
+        chunks = list(iter_ply_chunks(tmp_path, uid, chunk_size=30))
+
+        assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+        npt.assert_array_equal(np.concatenate([chunk.xyz[:, 2] for chunk in chunks]), vertex["z"])
+        npt.assert_array_equal(np.concatenate([chunk.colors[:, 0] for chunk in chunks]), vertex["red"])
@@ -0,0 +1,49 @@
+import json
+import logging
+
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation, JsonLinesSink, LoggingSink, MemorySink
+
+
+def test_instrumentation():
+    instrumentation = Instrumentation(MemorySink(), uid="a")
+    for _ in range(2):
+        with instrumentation.stage("fit"):
+            sum(range(1000))
+    instrumentation.count("points", 10)
+    instrumentation.count("points", 5)
+    instrumentation.record("points_per_face", [1, 2])
+    instrumentation.record("points_per_face", [3])
+
+    report = instrumentation.emit()
+    assert report["context"] == {"uid": "a"}
+    assert report["stages"]["fit"]["calls"] == 2
+    assert report["stages"]["fit"]["wall_seconds"] > 0
+    assert report["counters"] == {"points": 15}
+    assert report["records"] == {"points_per_face": [1, 2, 3]}
+    assert instrumentation.sink.reports == [report]
+
+
+def test_null_instrumentation():
+    with NULL_INSTRUMENTATION.stage("fit"):
+        pass
+    NULL_INSTRUMENTATION.count("points", 10)
+    NULL_INSTRUMENTATION.record("points_per_face", [1])
+
+    assert not NULL_INSTRUMENTATION.enabled
+    assert NULL_INSTRUMENTATION.emit() == {"context": {}, "stages": {}, "counters": {}, "records": {}}
+
+
+def test_json_lines_sink(tmp_path):
+    sink = JsonLinesSink(tmp_path / "reports.jsonl")
+    Instrumentation(sink, uid="a").emit()
+    Instrumentation(sink, uid="b").emit()
+
+    with open(tmp_path / "reports.jsonl") as fp:
+        reports = [json.loads(line) for line in fp]
+    assert [report["context"]["uid"] for report in reports] == ["a", "b"]
+
+
+def test_logging_sink(caplog):
+    with caplog.at_level(logging.INFO):
+        Instrumentation(LoggingSink(), uid="a").emit()
+    assert '"uid": "a"' in caplog.text
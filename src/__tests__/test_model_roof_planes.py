@@ -1,6 +1,15 @@
 import numpy as np
+import pytest
+import subprocess
+import sys
+from pathlib import Path
 
-from model_roof_planes import detect_plane_ransac
+from file_utils import iter_ply_chunks, read_ply
+from instrumentation import Instrumentation, MemorySink
+from model_roof_planes import detect_plane_ransac, model_roof_planes, model_roof_planes_streaming
+from plyfile import PlyData, PlyElement
+from point_cloud_utils import assign_points_to_faces
+from synthetic import complex_roof, hip_roof, sample_roof_points
 
 
 def test_detect_plane_ransac():
@@ -14,3 +23,159 @@ def test_detect_plane_ransac():
     ])
     plane = detect_plane_ransac(points)
     assert plane == (0.0, 0.0, 1.0, 0.0)  # ground plane or z=0
+
+
+def test_model_roof_planes():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01)
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="least_squares")
+    assert len(planes) == 4
+    np.testing.assert_almost_equal(planes, roof.planes, decimal=2)
+
+    # RANSAC separates outliers
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01, outlier_rate=0.1)
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="ransac")
+    assert len(planes) == 4
+    np.testing.assert_almost_equal(planes, roof.planes, decimal=1)
+
+
+def test_model_roof_planes_instrumentation():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01, outlier_rate=0.05)
+    sink = MemorySink()
+    instrumentation = Instrumentation(sink, uid="hip")
+
+    model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="ransac", instrumentation=instrumentation)
+    report = instrumentation.emit()
+
+    assert sink.reports == [report]
+    assert report["context"] == {"uid": "hip"}
+    assert set(report["stages"]) == {"assign", "fit"}
+    assert report["counters"] == {"points": 20000, "faces": 4}
+    assert len(report["records"]["points_per_face"]) == 4
+    assert all(iterations < 500 for iterations in report["records"]["ransac_iterations"])
+    assert all(0 < inliers <= points for inliers, points in
+               zip(report["records"]["inliers_per_face"], report["records"]["points_per_face"]))
+
+
+def test_model_roof_planes_downsample():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 50000, noise=0.02)
+    instrumentation = Instrumentation()
+
+    planes, diagnostics = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="least_squares",
+                                            instrumentation=instrumentation, max_points_per_face=500,
+                                            return_diagnostics=True)
+    np.testing.assert_allclose(planes, roof.planes, atol=0.01)
+    report = instrumentation.emit()
+    assert "downsample" in report["stages"]
+    assert all(n <= 500 for n in report["records"]["downsampled_points_per_face"])
+    assert report["counters"]["downsampled_points"] == sum(report["records"]["downsampled_points_per_face"])
+    # diagnostics are of all the face points
+    np.testing.assert_array_equal(diagnostics.counts, report["records"]["points_per_face"])
+
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="ransac", voxel_size=0.5)
+    np.testing.assert_allclose(planes, roof.planes, atol=0.02)
+
+    # algorithm "auto" escalates on the diagnostics of all the points, whose outliers voxel means average away
+    point_cloud = sample_roof_points(roof, 50000, noise=0.02, outlier_rate=0.1)
+    instrumentation = Instrumentation()
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="auto", max_points_per_face=1000,
+                               instrumentation=instrumentation)
+    assert instrumentation.emit()["counters"]["escalated_faces"] == len(roof.faces)
+    np.testing.assert_allclose(planes, roof.planes, atol=0.05)
+
+    # faces without points are reported as such, not as a downsampling failure
+    point_cloud[:, :2] += 1000.0
+    with pytest.raises(ValueError, match="Unable to determine best fit plane"):
+        model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="least_squares", max_points_per_face=1000)
+
+
+def test_model_roof_planes_normal_ransac():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01, outlier_rate=0.4)
+    instrumentation = Instrumentation()
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="normal_ransac",
+                               instrumentation=instrumentation)
+    np.testing.assert_almost_equal(planes, roof.planes, decimal=2)
+    assert all(iterations <= 8 for iterations in instrumentation.records["ransac_iterations"])
+
+    # without normals it is plain RANSAC
+    planes = model_roof_planes(point_cloud[:, :3], roof.vertices, roof.faces, algorithm="normal_ransac")
+    np.testing.assert_almost_equal(planes, roof.planes, decimal=1)
+
+
+def test_model_roof_planes_irls():
+    roof = complex_roof(n_faces=12)
+    point_cloud = sample_roof_points(roof, 30000, noise=0.01, outlier_rate=0.3)
+    instrumentation = Instrumentation()
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="irls",
+                               instrumentation=instrumentation)
+    np.testing.assert_almost_equal(planes, roof.planes, decimal=2)
+    assert 0 < instrumentation.counters["irls_iterations"] <= 20
+
+
+def test_model_roof_planes_auto():
+    # outliers only on the last face
+    roof = complex_roof(n_faces=12)
+    point_cloud = sample_roof_points(roof, 30000, noise=0.01)
+    point_cloud_outliers = sample_roof_points(roof, 30000, noise=0.01, outlier_rate=0.2, seed=1)
+    face_polygons = [roof.vertices[face, :] for face in roof.faces]
+    labels, _ = assign_points_to_faces(point_cloud_outliers, face_polygons)
+    point_cloud = np.vstack((point_cloud, point_cloud_outliers[labels == 11]))
+
+    instrumentation = Instrumentation()
+    planes, diagnostics = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="auto",
+                                            instrumentation=instrumentation, return_diagnostics=True)
+    np.testing.assert_almost_equal(planes, roof.planes, decimal=2)
+    assert instrumentation.counters["escalated_faces"] == 1
+    assert len(instrumentation.records["ransac_iterations"]) == 1
+    assert np.all(diagnostics.rmse[:11] < 0.02)
+    assert diagnostics.inlier_fraction[11] < 0.95
+    assert diagnostics.counts.sum() <= len(point_cloud)
+
+
+def test_model_roof_planes_workers():
+    roof = complex_roof(n_faces=12)
+    point_cloud = sample_roof_points(roof, 30000, noise=0.01, outlier_rate=0.1)
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="ransac", seed=3)
+    planes_threaded = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="ransac", seed=3, workers=4)
+    assert planes_threaded == planes
+
+
+def test_import_model_roof_planes_is_light():
+    # a fresh interpreter (e.g. a spawned worker) imports the modeling path without visualization or open3d
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import model_roof_planes\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(sorted({name.split('.')[0] for name in sys.modules})))\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=Path(__file__).parents[1], text=True)
+    seconds, modules = output.splitlines()
+    modules = set(modules.split(","))
+
+    assert "matplotlib" not in modules
+    assert "open3d" not in modules
+    assert "visualize" not in modules
+    assert float(seconds) < 1.0  # import-time budget
+
+
+def test_model_roof_planes_streaming(tmp_path):
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01, outlier_rate=0.05)
+    point_cloud[:, :3] += [5000.0, -3000.0, 200.0]  # far from the origin
+    vertices = roof.vertices + [5000.0, -3000.0]
+    (tmp_path / "a").mkdir()
+    vertex = np.empty(len(point_cloud), dtype=[(name, "f4") for name in ("x", "y", "z")])
+    for i, name in enumerate(("x", "y", "z")):
+        vertex[name] = point_cloud[:, i]
+    PlyData([PlyElement.describe(vertex, "vertex")]).write(str(tmp_path / "a" / "dsm.ply"))
+
+    chunks = iter_ply_chunks(tmp_path, "a", chunk_size=777)
+    planes = model_roof_planes_streaming(chunks, vertices, roof.faces)
+
+    point_cloud_f32 = read_ply(tmp_path, "a")  # the same float32 coordinates as the chunks
+    np.testing.assert_allclose(
+        planes, model_roof_planes(point_cloud_f32, vertices, roof.faces, algorithm="least_squares"), atol=1e-6)
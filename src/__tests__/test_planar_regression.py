@@ -5,7 +5,9 @@ import numpy as np
 import numpy.testing as npt
 
 from planar_regression import in_plane, planar_regression_lstsq, calculate_plane_equation_3_points, standardize_plane, \
-    standardize_plane_np
+    standardize_plane_np, standardize_planes_np, face_moments, planes_from_moments, planar_regression_lstsq_batched, \
+    ransac_iterations_required, ransac_plane, sample_triples, normal_histogram_peaks, normal_ransac_plane, \
+    face_medians, vertical_planes_from_moments, planar_regression_irls_batched, face_diagnostics
 
 
 ##############################
@@ -124,3 +126,284 @@ def test_planar_regression_lstsq_exact_unit_xy_square():
     ])
     plane = planar_regression_lstsq(points)
     npt.assert_almost_equal(plane, (0.0, 0.0, 1.0, 0.0), decimal=7)  # ground plane
+
+
+def test_standardize_planes_np():
+    planes = np.array([
+        (-1, -1, -1, -1),
+        (0, 0, 2, 4),
+    ], dtype=float)
+    z = 1 / math.sqrt(3)
+    expected_planes = np.array([
+        (z, z, z, z),
+        (0, 0, 1, 2),
+    ])
+    npt.assert_almost_equal(standardize_planes_np(planes), expected_planes)
+
+
+def test_face_moments():
+    points = np.array([
+        [1.0, 2.0, 3.0],
+        [4.0, 5.0, 6.0],
+        [7.0, 8.0, 9.0],
+    ])
+    labels = np.array([1, -1, 1])
+    counts, sums, outer_sums = face_moments(points, labels, 3)
+
+    npt.assert_array_equal(counts, [0, 2, 0])
+    npt.assert_array_equal(sums[1], [8.0, 10.0, 12.0])
+    npt.assert_array_equal(outer_sums[1], np.outer(points[0], points[0]) + np.outer(points[2], points[2]))
+    npt.assert_array_equal(outer_sums[0], np.zeros((3, 3)))
+
+
+def test_planar_regression_lstsq_batched():
+    # arrange
+    square = np.array([
+        [0.0, 0.0, 0.0],  # unit square defines the ground plane (singular A.T @ A)
+        [1.0, 0.0, 0.0],
+        [1.0, 1.0, 0.0],
+        [0.0, 1.0, 0.0],
+    ])
+    diamond = np.array([
+        [0.0, 0.0, 0.000003],  # 3D diamond pattern with noise
+        [1.0, 0.0, 1.000004],
+        [0.0, 1.0, 1.000005],
+        [1.0, 1.0, 2.000006],
+    ])
+    line = np.array([
+        [0.0, 0.0, 0.0],  # collinear points are rank deficient
+        [1.0, 1.0, 1.0],
+        [2.0, 2.0, 2.0],
+    ])
+    points = np.concatenate((square, diamond, line))
+    labels = np.array([0] * 4 + [2] * 4 + [1] * 3)
+    z = 1 / math.sqrt(3)
+
+    # act
+    planes, valid = planar_regression_lstsq_batched(points, labels, 4)
+
+    # assert
+    npt.assert_array_equal(valid, [True, False, True, False])  # face 3 has no points
+    npt.assert_almost_equal(planes[0], (0.0, 0.0, 1.0, 0.0))
+    npt.assert_almost_equal(planes[2], (-z, -z, z, 0), decimal=5)
+    npt.assert_almost_equal(planes[2], planar_regression_lstsq(diamond), decimal=5)
+    assert np.all(np.isnan(planes[1]))
+
+
+def test_planes_from_moments_accumulate_chunks():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-1.0, 1.0, size=(1000, 3))
+    points[:, 2] = 0.5 * points[:, 0] - 0.25 * points[:, 1] + 2.0 + rng.normal(scale=0.01, size=1000)
+    labels = rng.integers(-1, 2, size=1000)
+
+    # moments of two chunks add up to the moments of the whole
+    moments_1 = face_moments(points[:400], labels[:400], 2)
+    moments_2 = face_moments(points[400:], labels[400:], 2)
+    planes_chunked, _ = planes_from_moments(*[m_1 + m_2 for m_1, m_2 in zip(moments_1, moments_2)])
+    planes, valid = planar_regression_lstsq_batched(points, labels, 2)
+
+    assert np.all(valid)
+    npt.assert_almost_equal(planes_chunked, planes)
+
+
+def test_planar_regression_lstsq_batched_far_from_origin():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0.0, 10.0, size=(2000, 3))
+    points[:, 2] = 0.5 * points[:, 0] - 0.25 * points[:, 1] + 2.0 + rng.normal(scale=0.01, size=2000)
+    labels = rng.integers(-1, 2, size=2000)
+    offset = np.array([500000.0, 4000000.0, 100.0])  # UTM-scale coordinates
+
+    planes, valid = planar_regression_lstsq_batched(points, labels, 2)
+    far_planes, far_valid = planar_regression_lstsq_batched(points + offset, labels, 2)
+
+    npt.assert_array_equal(far_valid, valid)
+    npt.assert_allclose(far_planes[:, :3], planes[:, :3], atol=1e-9)
+    npt.assert_allclose(far_planes[:, 3], planes[:, 3] - planes[:, :3] @ offset, atol=1e-5)
+
+
+def test_ransac_iterations_required():
+    assert ransac_iterations_required(1.0, 0.99) == 1.0
+    assert ransac_iterations_required(0.0, 0.99) == math.inf
+    assert ransac_iterations_required(0.9, 0.99) == pytest.approx(math.log(0.01) / math.log(1 - 0.9 ** 3))
+    assert ransac_iterations_required(0.5, 0.99) > ransac_iterations_required(0.9, 0.99)
+
+
+def test_sample_triples():
+    rng = np.random.default_rng(0)
+    triples = sample_triples(rng, 4, 1000)
+    assert triples.shape == (3, 1000)
+    assert np.all((triples >= 0) & (triples < 4))
+    assert np.all((triples[0] != triples[1]) & (triples[0] != triples[2]) & (triples[1] != triples[2]))
+
+
+def test_ransac_plane():
+    # arrange
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-5.0, 5.0, size=(2000, 3))
+    points[:, 2] = 0.5 * points[:, 0] + 3.0 + rng.normal(scale=0.02, size=2000)  # z = 0.5x + 3
+    outliers = rng.random(2000) < 0.2
+    points[outliers, 2] += rng.uniform(1.0, 10.0, size=np.count_nonzero(outliers))
+    expected_plane = np.array((-0.5, 0.0, 1.0, -3.0)) / math.sqrt(1.25)
+
+    # act
+    plane, inliers, iterations = ransac_plane(points, distance_threshold=0.1, seed=42)
+
+    # assert
+    npt.assert_almost_equal(plane, expected_plane, decimal=1)
+    npt.assert_array_equal(inliers, ~outliers)
+    assert iterations < 500  # adaptive early termination
+
+    # reproducible under a seed
+    plane_2, inliers_2, iterations_2 = ransac_plane(points, distance_threshold=0.1, seed=42)
+    npt.assert_array_equal(plane, plane_2)
+    npt.assert_array_equal(inliers, inliers_2)
+    assert iterations == iterations_2
+
+
+def test_ransac_plane_too_few_points():
+    with pytest.raises(ValueError):
+        ransac_plane(np.zeros((2, 3)))
+
+
+@pytest.mark.parametrize("points", [
+    np.zeros((5, 3)),  # duplicates
+    np.arange(20)[:, np.newaxis] * np.array([[0.1, 0.2, 0.3]]) + 1000.0,  # along a line
+])
+def test_ransac_plane_collinear(points):
+    with pytest.raises(ValueError):
+        ransac_plane(points)
+
+
+def test_normal_histogram_peaks():
+    rng = np.random.default_rng(0)
+    normal_1 = np.array([0.0, -0.6, 0.8])
+    normal_2 = np.array([0.6, 0.0, 0.8])
+    normals = np.concatenate((
+        np.tile(normal_1, (700, 1)),
+        -np.tile(normal_2, (250, 1)),  # flipped onto the upper hemisphere
+        rng.normal(size=(50, 3)),
+    ))
+    normals += rng.normal(scale=0.02, size=normals.shape)
+
+    peaks = normal_histogram_peaks(normals, max_peaks=2)
+    assert peaks.shape == (2, 3)
+    npt.assert_almost_equal(peaks, [normal_1, normal_2], decimal=2)
+    assert normal_histogram_peaks(np.empty((0, 3))).shape == (0, 3)
+
+
+def test_normal_ransac_plane():
+    # arrange: half of the points are on rooftop objects with flat tops or vertical sides
+    rng = np.random.default_rng(0)
+    n = 4000
+    points = rng.uniform(-5.0, 5.0, size=(n, 3))
+    points[:, 2] = 0.5 * points[:, 0] + 3.0 + rng.normal(scale=0.02, size=n)  # z = 0.5x + 3
+    expected_plane = np.array((-0.5, 0.0, 1.0, -3.0)) / math.sqrt(1.25)
+    normals = np.tile(expected_plane[:3], (n, 1)) + rng.normal(scale=0.05, size=(n, 3))
+    outliers = rng.random(n) < 0.5
+    points[outliers, 2] += rng.uniform(1.0, 10.0, size=np.count_nonzero(outliers))
+    normals[outliers] = rng.normal(size=(np.count_nonzero(outliers), 3))
+
+    # act
+    plane, inliers, iterations = normal_ransac_plane(points, normals, distance_threshold=0.1, seed=42)
+    _, _, ransac_iterations = ransac_plane(points, distance_threshold=0.1, seed=42)
+
+    # assert
+    npt.assert_almost_equal(plane, expected_plane, decimal=2)
+    npt.assert_array_equal(inliers, ~outliers)
+    assert iterations < ransac_iterations
+
+    # reproducible under a seed
+    plane_2, _, iterations_2 = normal_ransac_plane(points, normals, distance_threshold=0.1, seed=42)
+    npt.assert_array_equal(plane, plane_2)
+    assert iterations == iterations_2
+
+    # the refinement keeps its precision far from the origin
+    offset = np.array([500000.0, 4000000.0, 100.0])
+    far_plane, far_inliers, _ = normal_ransac_plane(points + offset, normals, distance_threshold=0.1, seed=42)
+    npt.assert_array_equal(far_inliers, inliers)
+    npt.assert_allclose(far_plane[:3], plane[:3], atol=1e-9)
+    npt.assert_allclose(far_plane[3], plane[3] - plane[:3] @ offset, atol=1e-5)
+
+
+def test_face_medians():
+    values = np.array([5.0, -1.0, 3.0, 2.0, 7.0, 100.0])
+    labels = np.array([0, 1, 0, 0, -1, 1])
+    npt.assert_array_equal(face_medians(values, labels, 3), [3.0, -1.0, np.nan])
+
+    # small residuals keep their precision next to a huge one in another face
+    values = np.array([1e-9, 3e-9, 2e-9, 1e12])
+    labels = np.array([2, 2, 2, 0])
+    npt.assert_array_equal(face_medians(values, labels, 3), [1e12, np.nan, 2e-9])
+
+
+def test_vertical_planes_from_moments():
+    # vertical outliers shift the vertical least squares plane but do not tilt it
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-5.0, 5.0, size=(1000, 3))
+    points[:, 2] = 0.5 * points[:, 0] + 3.0
+    points[::2, 2] += 1.0
+    planes = vertical_planes_from_moments(*face_moments(points, np.zeros(1000, dtype=int), 1))
+    npt.assert_almost_equal(planes[0], np.array((-0.5, 0.0, 1.0, -3.5)) / math.sqrt(1.25), decimal=2)
+
+
+@pytest.mark.parametrize("loss", ["huber", "tukey"])
+def test_planar_regression_irls_batched(loss):
+    # arrange: 2 faces with outliers lifted above them and 1 rank deficient face
+    rng = np.random.default_rng(0)
+    n = 3000
+    points = rng.uniform(-5.0, 5.0, size=(n, 3))
+    labels = np.repeat([0, 1, -1], n // 3)
+    points[labels == 0, 2] = 0.5 * points[labels == 0, 0] + 3.0
+    points[labels == 1, 2] = -0.25 * points[labels == 1, 1] + 100.0
+    points[:, 2] += rng.normal(scale=0.02, size=n)
+    outliers = (labels >= 0) & (rng.random(n) < 0.2)
+    points[outliers, 2] += rng.uniform(0.5, 5.0, size=np.count_nonzero(outliers))
+    labels = np.append(labels, [2, 2])
+    points = np.vstack((points, [[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]]))
+    outliers = np.append(outliers, [False, False])
+    expected_planes = np.array([
+        np.array((-0.5, 0.0, 1.0, -3.0)) / math.sqrt(1.25),
+        np.array((0.0, 0.25, 1.0, -100.0)) / math.sqrt(1.0625),
+    ])
+
+    # act
+    planes, weights, valid, iterations = planar_regression_irls_batched(points, labels, 3, loss=loss)
+
+    # assert
+    npt.assert_array_equal(valid, [True, True, False])
+    assert np.all(np.isnan(planes[2]))
+    npt.assert_almost_equal(planes[:2], expected_planes, decimal=1 if loss == "huber" else 2)
+    assert np.all(weights[labels == -1] == 0.0)
+    assert weights[outliers].mean() < 0.5 * weights[(labels >= 0) & ~outliers].mean()
+    if loss == "tukey":
+        assert np.all(weights[outliers & (points[:, 2] - np.where(labels == 0, 3.0, 100.0) > 1.0)] == 0.0)
+    assert iterations <= 20
+
+    # deterministic
+    planes_2, weights_2, _, iterations_2 = planar_regression_irls_batched(points, labels, 3, loss=loss)
+    npt.assert_array_equal(planes_2, planes)
+    npt.assert_array_equal(weights_2, weights)
+    assert iterations_2 == iterations
+
+
+def test_face_diagnostics():
+    # face 0: 10 x 1 meter strip on z = 0 with one point 1 meter above; face 1: no points; face 2: collinear points
+    x = np.linspace(0.0, 10.0, 11)
+    points = np.vstack((
+        np.column_stack((np.tile(x, 2), np.repeat([0.0, 1.0], 11), np.zeros(22))),
+        [[5.0, 0.5, 1.0]],
+        np.column_stack((x[:3], x[:3], x[:3])),
+    ))
+    labels = np.array([0] * 23 + [2] * 3)
+    planes = np.array([[0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 1.0, 0.0]])
+
+    diagnostics = face_diagnostics(points, labels, planes, distance_threshold=0.2)
+
+    npt.assert_array_equal(diagnostics.counts, [23, 0, 3])
+    npt.assert_almost_equal(diagnostics.rmse[0], math.sqrt(1 / 23))
+    assert diagnostics.median_abs_residual[0] == 0.0
+    npt.assert_almost_equal(diagnostics.inlier_fraction[0], 22 / 23)
+    assert 30.0 < diagnostics.condition_number[0] < 50.0  # elongated strip
+    assert all(np.isnan(values[1]) for values in diagnostics[1:])
+    assert diagnostics.condition_number[2] == np.inf
+    assert diagnostics.to_dict()["counts"] == [23, 0, 3]
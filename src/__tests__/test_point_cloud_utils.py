@@ -1,7 +1,11 @@
 import numpy as np
 import numpy.testing as npt
+import pytest
 
-from point_cloud_utils import image_to_world, lasso_points
+from point_cloud_utils import image_to_world, world_to_image, lasso_points, PointGrid, assign_points_to_faces, \
+    face_index_slices, assign_points_to_faces_raster, rasterize_faces, PointCloud, point_xyz, points_in_polygon, \
+    voxel_downsample
+from synthetic import complex_roof
 
 
 def test_image_to_world():
@@ -21,6 +25,19 @@ def test_image_to_world():
     npt.assert_array_equal(vertices_world[2, :], [1, 1])   # verify +1 meter right and up from center
 
 
+def test_world_to_image():
+    image_shape = (201, 301)
+    vertices_pixels = np.array([
+        [150.0, 100.0],
+        [160.0, 110.0],
+        [17.5, 3.25],
+    ])
+    ppm = 10.0
+
+    vertices_world = image_to_world(vertices_pixels, ppm, image_shape)
+    npt.assert_almost_equal(world_to_image(vertices_world, ppm, image_shape), vertices_pixels)
+
+
 def test_lasso_points():
     face_polygon = np.array([
         [0.0, 0.0],  # unit square
@@ -38,3 +55,195 @@ def test_lasso_points():
     ])
     interior_points = lasso_points(face_polygon, point_cloud)
     npt.assert_array_equal(interior_points, point_cloud[:2, :])  # first two points are lassod
+
+
+def test_points_in_polygon():
+    polygon = np.array([[0.0, 0.0], [4.0, 0.0], [4.0, 1.0], [1.0, 1.0], [1.0, 3.0], [0.0, 3.0]])  # L-shape
+    points_xy = np.array([
+        [0.5, 0.5],  # interior
+        [3.5, 0.5],  # interior
+        [0.5, 2.5],  # interior
+        [2.0, 2.0],  # exterior, within the bounding box
+        [5.0, 0.5],  # exterior
+        [-1.0, 0.5],  # exterior
+    ])
+    npt.assert_array_equal(points_in_polygon(points_xy, polygon), [True, True, True, False, False, False])
+
+
+def test_point_grid_query_bbox():
+    rng = np.random.default_rng(0)
+    points_xy = rng.uniform(-10.0, 10.0, size=(5000, 2))
+    grid = PointGrid(points_xy)
+
+    xy_min, xy_max = np.array([-2.0, 1.0]), np.array([3.0, 4.5])
+    candidates = grid.query_bbox(xy_min, xy_max)
+    in_box = np.flatnonzero(np.all((points_xy >= xy_min) & (points_xy <= xy_max), axis=1))
+
+    assert set(in_box.tolist()) <= set(candidates.tolist())  # superset of the points within the box
+    assert len(candidates) < len(points_xy)  # without scanning the whole point cloud
+    assert len(grid.query_bbox(np.array([20.0, 20.0]), np.array([30.0, 30.0]))) == 0  # box outside the grid
+
+
+def test_face_index_slices():
+    labels = np.array([1, -1, 0, 1, 2, -1, 0])
+    face_indices = face_index_slices(labels, 4)
+    assert len(face_indices) == 4
+    npt.assert_array_equal(face_indices[0], [2, 6])
+    npt.assert_array_equal(face_indices[1], [0, 3])
+    npt.assert_array_equal(face_indices[2], [4])
+    assert len(face_indices[3]) == 0
+
+
+def test_assign_points_to_faces():
+    face_polygons = [
+        np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]),  # unit square
+        np.array([[1.0, 0.0], [2.0, 0.0], [2.0, 1.0], [1.0, 1.0]]),  # unit square to the right
+    ]
+    point_cloud = np.array([
+        [0.1, 0.1, 11.0],  # face 0
+        [1.9, 0.9, 12.0],  # face 1
+        [2.1, 0.1, 13.0],  # exterior
+        [0.9, 0.9, 14.0],  # face 0
+        [1.5, 0.5, 15.0],  # face 1
+    ])
+    labels, face_indices = assign_points_to_faces(point_cloud, face_polygons)
+    npt.assert_array_equal(labels, [0, 1, -1, 0, 1])
+    npt.assert_array_equal(face_indices[0], [0, 3])
+    npt.assert_array_equal(face_indices[1], [1, 4])
+
+
+def test_assign_points_to_faces_matches_lasso_points():
+    rng = np.random.default_rng(1)
+    point_cloud = np.column_stack((rng.uniform(-5.0, 5.0, size=(20000, 2)), rng.normal(size=20000)))
+    face_polygons = [
+        np.array([[-4.0, -4.0], [0.0, -4.0], [0.0, 0.0], [-4.0, 0.0]]),
+        np.array([[0.5, -3.0], [4.0, -1.0], [2.0, 3.5]]),  # triangle
+        np.array([[-4.5, 0.5], [-1.0, 0.5], [-1.0, 2.0], [-3.0, 2.0], [-3.0, 4.5], [-4.5, 4.5]]),  # L-shape
+    ]
+    _, face_indices = assign_points_to_faces(point_cloud, face_polygons)
+    for face_polygon, face_idx in zip(face_polygons, face_indices):
+        npt.assert_array_equal(point_cloud[face_idx, :], lasso_points(face_polygon, point_cloud))
+
+
+def test_assign_points_to_faces_workers():
+    rng = np.random.default_rng(2)
+    point_cloud = np.column_stack((rng.uniform(-5.0, 5.0, size=(20000, 2)), rng.normal(size=20000)))
+    face_polygons = [
+        np.array([[-4.0, -4.0], [1.0, -4.0], [1.0, 1.0], [-4.0, 1.0]]),
+        np.array([[0.0, 0.0], [4.0, 0.0], [4.0, 4.0], [0.0, 4.0]]),  # overlaps face 0
+        np.array([[0.5, -3.0], [4.0, -1.0], [2.0, 3.5]]),  # overlaps faces 0 and 1
+    ]
+    labels, face_indices = assign_points_to_faces(point_cloud, face_polygons)
+    labels_threaded, face_indices_threaded = assign_points_to_faces(point_cloud, face_polygons, workers=3)
+    npt.assert_array_equal(labels_threaded, labels)
+    for face_idx, face_idx_threaded in zip(face_indices, face_indices_threaded):
+        npt.assert_array_equal(face_idx_threaded, face_idx)
+
+
+def test_rasterize_faces():
+    face_polygons = [
+        np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]),  # unit square
+    ]
+    label_image, boundary_mask = rasterize_faces(face_polygons, np.array([-0.5, -0.5]), (20, 20), 10.0)
+
+    assert label_image.shape == (20, 20)
+    assert label_image[10, 10] == 1  # center of the square
+    assert label_image[0, 0] == 0  # background
+    assert not boundary_mask[10, 10]
+    assert np.all(boundary_mask[5:16, 5])  # left edge of the square at x == 0
+
+
+def test_assign_points_to_faces_raster_matches_grid():
+    rng = np.random.default_rng(2)
+    point_cloud = np.column_stack((rng.uniform(-5.0, 5.0, size=(20000, 2)), rng.normal(size=20000)))
+    face_polygons = [
+        np.array([[-4.0, -4.0], [0.0, -4.0], [0.0, 0.0], [-4.0, 0.0]]),
+        np.array([[0.5, -3.0], [4.0, -1.0], [2.0, 3.5]]),  # triangle
+        np.array([[-2.0, -2.0], [1.0, -2.0], [1.0, 1.0]]),  # overlaps the first two faces
+    ]
+    labels_grid, _ = assign_points_to_faces(point_cloud, face_polygons)
+    for supersample in (1, 3):
+        labels, face_indices = assign_points_to_faces_raster(point_cloud, face_polygons, 10.0, supersample)
+        npt.assert_array_equal(labels, labels_grid)
+        for i, face_idx in enumerate(face_indices):
+            npt.assert_array_equal(face_idx, np.flatnonzero(labels_grid == i))
+
+
+def test_assign_points_to_faces_raster_rotated():
+    # edges at every angle cross cells that thick drawn lines miss
+    roof = complex_roof(n_faces=20)
+    rng = np.random.default_rng(0)
+    for angle in (0.26, 0.7, 1.1, 1.5):
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        vertices = roof.vertices @ rotation.T
+        face_polygons = [vertices[face, :] for face in roof.faces]
+        xy = rng.uniform(vertices.min(axis=0), vertices.max(axis=0), size=(200000, 2))
+        labels_grid, _ = assign_points_to_faces(xy, face_polygons)
+        for supersample in (1, 3):
+            labels, _ = assign_points_to_faces_raster(xy, face_polygons, 10.0, supersample)
+            npt.assert_array_equal(labels, labels_grid)
+
+
+def test_point_cloud():
+    xyz = np.array([[0.1, 0.1, 11.0], [1.1, 0.1, 13.0], [0.9, 0.9, 12.0]], dtype=np.float32)
+    colors = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]], dtype=np.uint8)
+    point_cloud = PointCloud(xyz, colors=colors)
+
+    assert len(point_cloud) == 3
+    assert point_xyz(point_cloud) is xyz
+    npt.assert_array_equal(point_cloud.select(np.array([2, 0])).colors, colors[[2, 0]])
+
+    point_cloud_array = point_cloud.to_array()
+    assert point_cloud_array.shape == (3, 9)
+    npt.assert_array_equal(point_cloud_array[:, 3:6], 0)  # no normals
+    npt.assert_array_equal(point_cloud_array[:, 6:9], colors)
+
+    # lasso a PointCloud
+    face_polygon = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]])
+    interior_points = lasso_points(face_polygon, point_cloud)
+    npt.assert_array_equal(interior_points.xyz, xyz[[0, 2]])
+    npt.assert_array_equal(interior_points.colors, colors[[0, 2]])
+
+
+def test_voxel_downsample():
+    # two faces of 1 x 1 meter grids of 10 x 10 points, 4 points per 0.2 meter voxel, and a point of no face
+    grid = np.stack(np.meshgrid(np.arange(10) * 0.1 + 0.05, np.arange(10) * 0.1 + 0.05), axis=-1).reshape(-1, 2)
+    xyz = np.vstack((np.column_stack((grid, np.full(100, 3.0))), np.column_stack((grid + 5.0, np.full(100, 4.0))),
+                     [[9.0, 9.0, 9.0]]))
+    labels = np.concatenate((np.zeros(100), np.ones(100), [-1])).astype(np.int64)
+    point_cloud = np.zeros((len(xyz), 9))
+    point_cloud[:, :3] = xyz
+    point_cloud[:, 3:6] = [0.0, 0.6, 0.8]
+    point_cloud[:100, 3:6] = [0.0, 0.0, 1.0]
+    point_cloud[:, 6:9] = np.arange(len(xyz))[:, np.newaxis] % 2 * 255
+
+    voxel_points, voxel_labels = voxel_downsample(point_cloud, labels, voxel_size=0.2)
+    npt.assert_array_equal(voxel_labels, np.repeat([0, 1], 25))
+    assert voxel_points.shape == (50, 9)
+    npt.assert_allclose(np.sort(voxel_points[:25, 0] % 1.0), np.repeat(np.arange(5) * 0.2 + 0.1, 5))
+    npt.assert_allclose(voxel_points[:, 2], np.repeat([3.0, 4.0], 25))
+    npt.assert_allclose(np.linalg.norm(voxel_points[:, 3:6], axis=1), 1.0)
+    npt.assert_allclose(voxel_points[:25, 6:9], 127.5)  # 2 x 2 points of alternating colors per voxel
+
+    # a point budget coarsens the voxels of the faces over it
+    voxel_points, voxel_labels = voxel_downsample(point_cloud, labels, max_points_per_face=30)
+    assert np.all(np.bincount(voxel_labels) <= 30)
+    assert np.all(np.bincount(voxel_labels) >= 10)
+    voxel_points, voxel_labels = voxel_downsample(point_cloud, labels, max_points_per_face=100)
+    npt.assert_array_equal(voxel_points, point_cloud[:200])
+
+    with pytest.raises(ValueError):
+        voxel_downsample(point_cloud, labels, max_points_per_face=0)
+    with pytest.raises(ValueError):
+        voxel_downsample(point_cloud, labels, voxel_size=0.0)
+
+    # without face points there are no voxels
+    voxels, voxel_labels = voxel_downsample(point_cloud, np.full(len(point_cloud), -1), 0.2, 2)
+    assert voxels.shape == (0, point_cloud.shape[1])
+    assert voxel_labels.shape == (0,)
+
+    # PointCloud columns keep their dtypes
+    voxels, voxel_labels = voxel_downsample(
+        PointCloud(xyz.astype(np.float32), colors=point_cloud[:, 6:9].astype(np.uint8)), labels, voxel_size=0.5)
+    assert len(voxels) == 8 and voxels.normals is None
+    assert voxels.xyz.dtype == np.float32 and voxels.colors.dtype == np.uint8
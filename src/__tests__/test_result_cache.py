@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+
+from instrumentation import Instrumentation
+from model_roof_planes import model_roof_planes
+from result_cache import ResultCache, point_cloud_key, result_key
+from synthetic import hip_roof, sample_roof_points
+
+
+def test_result_key():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 1000)
+    face_polygons = [roof.vertices[face, :] for face in roof.faces]
+    key = result_key(point_cloud, face_polygons, algorithm="ransac", seed=0)
+
+    assert point_cloud_key(point_cloud) == point_cloud_key(point_cloud[:, :3].copy())
+    assert result_key(point_cloud.copy(), face_polygons, seed=0, algorithm="ransac") == key
+    assert result_key(point_cloud, face_polygons, algorithm="ransac", seed=1) != key
+    assert result_key(point_cloud, face_polygons[::-1], algorithm="ransac", seed=0) != key
+    moved = point_cloud.copy()
+    moved[0, 2] += 0.01
+    assert result_key(moved, face_polygons, algorithm="ransac", seed=0) != key
+
+
+def test_result_cache_lru(tmp_path):
+    planes = [(0.0, 0.0, 1.0, -3.0)] * 10
+    cache = ResultCache(tmp_path, max_bytes=2500)
+    for key in "abc":
+        cache.put(key, planes)
+        os.utime(tmp_path / f"{key}.json", ns=(0, {"a": 1, "b": 2, "c": 3}[key] * 10 ** 9))
+
+    # reading refreshes a, so b is the least recently used when d is added
+    assert cache.get("a") == planes
+    file_size = (tmp_path / "a.json").stat().st_size
+    cache.max_bytes = 3 * file_size
+    cache.put("d", planes)
+    assert sorted(path.stem for path in tmp_path.glob("*.json")) == ["a", "c", "d"]
+    assert cache.get("b") is None
+
+    memory_cache = ResultCache(memory_items=2)
+    for key in "abc":
+        memory_cache.put(key, planes)
+    assert list(memory_cache.memory) == ["b", "c"]
+
+
+def test_result_cache_eviction_is_amortized(tmp_path, monkeypatch):
+    planes = [(0.0, 0.0, 1.0, -3.0)] * 10
+    cache = ResultCache(tmp_path)
+    cache.put("0", planes)
+    file_size = (tmp_path / "0.json").stat().st_size
+    cache.max_bytes = 20 * file_size
+
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+    for i in range(1, 100):
+        cache.put(str(i), planes)
+        assert cache.total_bytes <= (1.0 + cache.eviction_margin) * cache.max_bytes
+
+    # the directory is listed once per margin of writes, not on every put
+    assert len(scans) < 100 // 2
+    assert sum(path.stat().st_size for path in tmp_path.glob("*.json")) == cache.total_bytes
+    assert cache.get("99") == planes
+
+
+def test_model_roof_planes_cache(tmp_path):
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 5000, noise=0.01, outlier_rate=0.05)
+    cache = ResultCache(tmp_path)
+
+    instrumentation = Instrumentation()
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, cache=cache, instrumentation=instrumentation)
+    assert instrumentation.counters["cache_misses"] == 1
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+    # a new cache on the same directory, as in the next run
+    instrumentation = Instrumentation()
+    planes_cached = model_roof_planes(point_cloud, roof.vertices, roof.faces, cache=ResultCache(tmp_path),
+                                      instrumentation=instrumentation)
+    assert planes_cached == planes
+    assert instrumentation.counters == {"cache_hits": 1}
+
+    # other settings are a miss
+    model_roof_planes(point_cloud, roof.vertices, roof.faces, cache=cache, seed=1)
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    np.testing.assert_almost_equal(planes, roof.planes, decimal=1)
@@ -0,0 +1,130 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from model_roof_planes import model_roof_planes
+from planar_regression import face_moments, planar_regression_lstsq_batched, vertical_planes_from_moments
+from point_cloud_utils import assign_points_to_faces
+from roof_geometry import fit_planes_jointly, shared_face_edges, solve_vertices_3d, vertex_face_incidence
+from synthetic import complex_roof, gable_roof, hip_roof, sample_roof_points
+
+
+def edge_gaps(planes: np.ndarray, vertices: np.ndarray, shared: np.ndarray) -> np.ndarray:
+    # height difference of the two faces' planes at both end vertices of each shared edge
+    x, y = vertices[shared[:, :2]].transpose(2, 0, 1)
+    a_f, b_f, c_f, d_f = np.asarray(planes)[shared[:, 2]].T[:, :, np.newaxis]
+    a_g, b_g, c_g, d_g = np.asarray(planes)[shared[:, 3]].T[:, :, np.newaxis]
+    return np.abs((a_f * x + b_f * y + d_f) / c_f - (a_g * x + b_g * y + d_g) / c_g)
+
+
+def test_vertex_face_incidence():
+    vertex_ids, face_ids = vertex_face_incidence([[0, 1, 2], [1, 3, 2], [3, 1, 1]])
+    npt.assert_array_equal(vertex_ids, [0, 1, 1, 1, 2, 2, 3, 3])
+    npt.assert_array_equal(face_ids, [0, 0, 1, 2, 0, 1, 1, 2])
+
+
+def test_solve_vertices_3d():
+    roof = hip_roof(width=20.0, depth=10.0, slope=0.5, eave_height=3.0)
+    vertices_3d, residuals = solve_vertices_3d(roof.vertices, roof.faces, roof.planes)
+
+    # exact planes: the eaves are at eave height and the ridge ends where 3 planes meet
+    ridge_ends = roof.vertices[:, 1] == 0.0
+    npt.assert_almost_equal(vertices_3d[:, :2], roof.vertices)
+    npt.assert_almost_equal(vertices_3d[ridge_ends, 2], 5.5)
+    npt.assert_almost_equal(vertices_3d[~ridge_ends, 2], 3.0)
+    npt.assert_almost_equal(residuals, 0.0)
+
+    # a vertex of no face
+    vertices_3d, residuals = solve_vertices_3d(np.vstack((roof.vertices, [[50.0, 50.0]])), roof.faces, roof.planes)
+    npt.assert_array_equal(vertices_3d[-1, :2], [50.0, 50.0])
+    assert np.isnan(vertices_3d[-1, 2]) and np.isnan(residuals[-1])
+
+    with pytest.raises(ValueError):
+        solve_vertices_3d(roof.vertices, roof.faces, roof.planes, xy_weight=0.0)
+
+
+def test_solve_vertices_3d_fitted_planes():
+    roof = complex_roof(n_faces=20)
+    point_cloud = sample_roof_points(roof, 50000, noise=0.02)
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="least_squares")
+
+    # gable modules of different slopes meet in height steps, where the residuals are large for any planes
+    vertices_3d, residuals = solve_vertices_3d(roof.vertices, roof.faces, planes)
+    expected_3d, expected_residuals = solve_vertices_3d(roof.vertices, roof.faces, roof.planes)
+    npt.assert_allclose(vertices_3d, expected_3d, atol=0.05)
+    npt.assert_allclose(residuals, expected_residuals, atol=0.02)
+
+
+def test_shared_face_edges():
+    roof = gable_roof()
+    npt.assert_array_equal(shared_face_edges(roof.faces), [[2, 3, 0, 1]])
+
+    # an edge of three faces pairs every two of them; listed edges restrict the result
+    faces = [[0, 1, 2], [1, 0, 3], [0, 4, 1], [2, 1, 3]]
+    npt.assert_array_equal(shared_face_edges(faces), [[0, 1, 0, 1], [0, 1, 0, 2], [0, 1, 1, 2], [1, 2, 0, 3],
+                                                      [1, 3, 1, 3]])
+    npt.assert_array_equal(shared_face_edges(faces, edges=np.array([[3, 1], [2, 1]])), [[1, 2, 0, 3], [1, 3, 1, 3]])
+    assert shared_face_edges([[0, 1, 2]]).shape == (0, 4)
+
+
+def test_fit_planes_jointly():
+    roof = hip_roof(width=20.0, depth=10.0, slope=0.5, eave_height=3.0)
+    point_cloud = sample_roof_points(roof, 2000, noise=0.1)
+    labels, _ = assign_points_to_faces(point_cloud, [roof.vertices[face, :] for face in roof.faces])
+    shared = shared_face_edges(roof.faces)
+
+    independent, _ = planar_regression_lstsq_batched(point_cloud[:, :3], labels, len(roof.faces))
+    planes, iterations = fit_planes_jointly(point_cloud[:, :3], labels, roof.vertices, roof.faces)
+    assert 0 < iterations < 100
+    npt.assert_allclose(np.linalg.norm(planes[:, :3], axis=1), 1.0)
+    npt.assert_allclose(planes, roof.planes, atol=0.05)
+
+    # ridges and hips close where the independent planes miss each other
+    assert edge_gaps(independent, roof.vertices, shared).max() > 0.05
+    assert edge_gaps(planes, roof.vertices, shared).max() < 0.01
+
+    # without constraints the joint fit is the independent fit of z
+    planes, _ = fit_planes_jointly(point_cloud[:, :3], labels, roof.vertices, roof.faces, edge_weight=0.0)
+    expected = vertical_planes_from_moments(*face_moments(point_cloud[:, :3], labels, len(roof.faces)))
+    npt.assert_allclose(planes, expected, atol=1e-6)
+
+
+def test_fit_planes_jointly_steps():
+    roof = complex_roof(n_faces=20)
+    point_cloud = sample_roof_points(roof, 50000, noise=0.02)
+    labels, _ = assign_points_to_faces(point_cloud, [roof.vertices[face, :] for face in roof.faces])
+    shared = shared_face_edges(roof.faces)
+    true_gaps = edge_gaps(roof.planes, roof.vertices, shared)
+
+    # height steps between gable modules of different slopes are kept
+    planes, _ = fit_planes_jointly(point_cloud[:, :3], labels, roof.vertices, roof.faces)
+    steps = true_gaps.max(axis=1) > 0.2
+    assert np.any(steps)
+    npt.assert_allclose(edge_gaps(planes, roof.vertices, shared)[steps], true_gaps[steps], atol=0.1)
+
+
+def test_fit_planes_jointly_vertical():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 2000, noise=0.02)
+    labels, _ = assign_points_to_faces(point_cloud, [roof.vertices[face, :] for face in roof.faces])
+
+    # the independent plane of face 0 is vertical (c = 0) and gives no warm start
+    point_cloud[labels == 0, 0] = 1.0
+    planes, _ = fit_planes_jointly(point_cloud[:, :3], labels, roof.vertices, roof.faces)
+    assert np.all(np.isfinite(planes))
+    npt.assert_allclose(planes[1:], roof.planes[1:], atol=0.2)
+
+
+def test_model_roof_planes_joint():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.02)
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="joint")
+    assert len(planes) == len(roof.faces)
+    npt.assert_allclose(planes, roof.planes, atol=0.01)
+
+    # listed edges restrict the constraints to those edges
+    labels, _ = assign_points_to_faces(point_cloud, [roof.vertices[face, :] for face in roof.faces])
+    edges = shared_face_edges(roof.faces)[:1, :2]
+    planes = model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm="joint", edges=edges)
+    expected, _ = fit_planes_jointly(point_cloud[:, :3], labels, roof.vertices, roof.faces, edges=edges)
+    npt.assert_allclose(planes, expected)
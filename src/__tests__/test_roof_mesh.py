@@ -0,0 +1,92 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+from plyfile import PlyData
+
+from roof_mesh import MeshWriter, ObjMeshWriter, ear_clip, open_mesh_writer, roof_mesh, triangulate_faces, \
+    write_roof_meshes
+from synthetic import complex_roof, hip_roof
+
+
+def signed_areas(xy: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    a, b, c = xy[triangles[:, 0]], xy[triangles[:, 1]], xy[triangles[:, 2]]
+    return ((b - a)[:, 0] * (c - a)[:, 1] - (b - a)[:, 1] * (c - a)[:, 0]) / 2
+
+
+def polygon_area(xy: np.ndarray) -> float:
+    return abs(np.sum(xy[:, 0] * np.roll(xy[:, 1], -1) - np.roll(xy[:, 0], -1) * xy[:, 1])) / 2
+
+
+@pytest.mark.parametrize("polygon", [
+    [[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]],  # L shape
+    [[0, 0], [0, 3], [1, 3], [1, 1], [2, 1], [2, 3], [3, 3], [3, 1], [4, 1], [4, 3], [5, 3], [5, 0]],  # comb, clockwise
+    [[0, 0], [1, 0], [2, 0], [2, 2], [0, 2]],  # collinear corner
+])
+def test_ear_clip(polygon):
+    polygon = np.array(polygon, dtype=float)
+    triangles = ear_clip(polygon)
+    assert triangles.shape == (len(polygon) - 2, 3)
+    assert np.all(signed_areas(polygon, triangles) >= 0)
+    npt.assert_almost_equal(signed_areas(polygon, triangles).sum(), polygon_area(polygon))
+
+
+def test_triangulate_faces():
+    vertices = np.array([[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2], [5, 5], [6, 5], [6, 6]], dtype=float)
+    faces = [[0, 1, 2, 3, 4, 5], [6, 7, 8], [8, 7, 6], [0, 1]]
+    corners, triangle_faces = triangulate_faces(vertices, faces)
+    npt.assert_array_equal(triangle_faces, [0, 0, 0, 0, 1, 2])
+
+    # counter-clockwise whatever the face orientation, and covering each face
+    xy = vertices[np.concatenate(faces)]
+    assert np.all(signed_areas(xy, corners) > 0)
+    npt.assert_almost_equal(signed_areas(xy, corners)[:4].sum(), 3.0)
+    npt.assert_array_equal(np.concatenate(faces)[corners[4:]], [[6, 7, 8], [8, 6, 7]])
+
+
+def test_roof_mesh():
+    roof = complex_roof(n_faces=20)
+    mesh_vertices, triangles, triangle_faces = roof_mesh(roof.vertices, roof.faces, roof.planes)
+    assert len(triangles) == sum(len(face) - 2 for face in roof.faces)
+
+    # corners lie on the planes of their faces and triangles face upwards
+    a, b, c, d = roof.planes[triangle_faces].T
+    for k in range(3):
+        corner = mesh_vertices[triangles[:, k]]
+        npt.assert_almost_equal(a * corner[:, 0] + b * corner[:, 1] + c * corner[:, 2] + d, 0.0)
+    edges_1, edges_2 = (mesh_vertices[triangles[:, k]] - mesh_vertices[triangles[:, 0]] for k in (1, 2))
+    assert np.all(np.cross(edges_1, edges_2)[:, 2] > 0)
+
+    # watertight meshes share the vertices of the faces
+    roof = hip_roof()
+    mesh_vertices, triangles, _ = roof_mesh(roof.vertices, roof.faces, roof.planes, watertight=True)
+    assert len(mesh_vertices) == len(roof.vertices)
+    npt.assert_almost_equal(mesh_vertices[:, :2], roof.vertices)
+
+
+def test_write_roof_meshes(tmp_path):
+    roof = hip_roof()
+    mesh_vertices, triangles, triangle_faces = roof_mesh(roof.vertices, roof.faces, roof.planes)
+    buildings = [(f"b{i}", roof.vertices, roof.faces, roof.planes) for i in range(3)]
+
+    assert write_roof_meshes(tmp_path / "roofs.ply", iter(buildings)) == 3
+    mesh = PlyData.read(str(tmp_path / "roofs.ply"))
+    npt.assert_almost_equal(np.column_stack([mesh["vertex"][name] for name in "xyz"]), np.tile(mesh_vertices, (3, 1)))
+    faces = mesh["face"]
+    npt.assert_array_equal(np.stack(faces["vertex_indices"]),
+                           np.concatenate([triangles + i * len(mesh_vertices) for i in range(3)]))
+    npt.assert_array_equal(faces["building"], np.repeat([0, 1, 2], len(triangles)))
+    npt.assert_array_equal(faces["face"], np.tile(triangle_faces, 3))
+
+    assert write_roof_meshes(tmp_path / "roofs.obj", iter(buildings)) == 3
+    lines = (tmp_path / "roofs.obj").read_text().splitlines()
+    assert [line for line in lines if line.startswith("o ")] == ["o b0", "o b1", "o b2"]
+    obj_vertices = np.array([line.split()[1:] for line in lines if line.startswith("v ")], dtype=float)
+    obj_triangles = np.array([line.split()[1:] for line in lines if line.startswith("f ")], dtype=int)
+    npt.assert_almost_equal(obj_vertices, np.tile(mesh_vertices, (3, 1)), decimal=5)
+    npt.assert_array_equal(obj_triangles[-len(triangles):], triangles + 2 * len(mesh_vertices) + 1)
+
+    assert isinstance(open_mesh_writer(tmp_path / "roofs.OBJ"), ObjMeshWriter)
+    with pytest.raises(ValueError):
+        open_mesh_writer(tmp_path / "roofs.stl")
+    with pytest.raises(TypeError):
+        MeshWriter(tmp_path / "roofs.mesh")  # abstract
@@ -0,0 +1,76 @@
+import numpy as np
+import numpy.testing as npt
+
+from model_roof_planes import model_roof_planes
+from point_cloud_utils import assign_points_to_faces
+from roof_model import RoofModel
+from synthetic import hip_roof, sample_roof_points
+
+
+def test_roof_model():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01, outlier_rate=0.05)
+
+    for algorithm in ("least_squares", "ransac"):
+        roof_model = RoofModel(point_cloud, roof.vertices, roof.faces, algorithm=algorithm)
+        npt.assert_almost_equal(
+            roof_model.roof_planes(),
+            model_roof_planes(point_cloud, roof.vertices, roof.faces, algorithm=algorithm),
+        )
+
+
+def test_roof_model_move_vertex():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01)
+    roof_model = RoofModel(point_cloud, roof.vertices, roof.faces)
+
+    # move a corner shared by 2 faces
+    v = roof.faces[1][0]
+    vertices = roof.vertices.copy()
+    vertices[v] += [0.7, -0.4]
+    refit = roof_model.move_vertex(v, vertices[v])
+
+    assert set(refit) == {f for f, face in enumerate(roof.faces) if v in face}
+
+    # same result as modeling the edited roof from scratch
+    labels, _ = assign_points_to_faces(point_cloud, [vertices[face, :] for face in roof.faces])
+    npt.assert_array_equal(roof_model.labels, labels)
+    npt.assert_almost_equal(
+        roof_model.roof_planes(),
+        model_roof_planes(point_cloud, vertices, roof.faces, algorithm="least_squares"),
+    )
+    npt.assert_almost_equal(roof_model.counts, np.bincount(labels[labels >= 0], minlength=len(roof.faces)))
+
+
+def test_roof_model_far_from_origin():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01)
+    point_cloud[:, :2] += [500000.0, 4000000.0]  # UTM-scale coordinates
+    vertices = roof.vertices + [500000.0, 4000000.0]
+    roof_model = RoofModel(point_cloud, vertices, roof.faces)
+
+    v = roof.faces[1][0]
+    vertices[v] += [0.7, -0.4]
+    roof_model.move_vertex(v, vertices[v])
+    planes = np.array(roof_model.roof_planes())
+    expected = np.array(model_roof_planes(point_cloud, vertices, roof.faces, algorithm="least_squares"))
+    npt.assert_allclose(planes[:, :3], expected[:, :3], atol=1e-9)
+    npt.assert_allclose(planes[:, 3], expected[:, 3], atol=1e-3)
+
+
+def test_roof_model_move_vertex_ransac():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01, outlier_rate=0.05)
+    roof_model = RoofModel(point_cloud, roof.vertices, roof.faces, algorithm="ransac")
+
+    # move an end of the ridge, which is shared by 3 faces
+    v = int(np.flatnonzero(roof.vertices[:, 1] == 0.0)[0])
+    vertices = roof.vertices.copy()
+    vertices[v] += [0.5, 0.3]
+    refit = roof_model.move_vertex(v, vertices[v])
+
+    assert len(refit) == 3
+    npt.assert_almost_equal(
+        roof_model.roof_planes(),
+        model_roof_planes(point_cloud, vertices, roof.faces, algorithm="ransac"),
+    )
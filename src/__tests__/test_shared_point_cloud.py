@@ -0,0 +1,116 @@
+import os
+import pickle
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from model_roof_planes import model_roof_planes
+from point_cloud_utils import PointCloud, lasso_points
+from shared_point_cloud import SharedPointCloud
+from synthetic import hip_roof, sample_roof_points
+
+
+def face_planes(point_cloud, vertices, faces):
+    return model_roof_planes(point_cloud, vertices, faces, algorithm="least_squares")
+
+
+def crash(point_cloud):
+    os._exit(1)
+
+
+def point_count(point_cloud):
+    return len(point_cloud)
+
+
+def test_shared_point_cloud():
+    point_cloud = sample_roof_points(hip_roof(), 1000)
+    with SharedPointCloud.create(point_cloud) as shared:
+        assert len(shared) == 1000
+        npt.assert_array_equal(shared.to_array(), point_cloud)
+
+        # pickles as the name of the block, not the points
+        assert len(pickle.dumps(shared)) < 1000
+        attached = pickle.loads(pickle.dumps(shared))
+        assert not attached.owner
+        assert not attached.xyz.flags.writeable
+        npt.assert_array_equal(attached.to_array(), point_cloud)
+        attached.close()
+
+        # closing an attached view leaves the block to the owner
+        npt.assert_array_equal(SharedPointCloud.attach(shared.name, 1000, shared.dtypes).xyz, point_cloud[:, :3])
+        name = shared.name
+
+    with pytest.raises(FileNotFoundError):
+        SharedPointCloud.attach(name, 1000, {"xyz": "<f8"})
+
+
+def test_shared_point_cloud_dtypes():
+    point_cloud = PointCloud(np.arange(12, dtype=np.float32).reshape(4, 3), colors=np.full((4, 3), 7, dtype=np.uint8))
+    with SharedPointCloud.create(point_cloud) as shared:
+        assert shared.normals is None
+        assert shared.xyz.dtype == np.float32
+        npt.assert_array_equal(shared.colors, point_cloud.colors)
+
+
+def test_shared_point_cloud_workers():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000, noise=0.01)
+    face_polygon = roof.vertices[roof.faces[0], :]
+
+    with SharedPointCloud.create(point_cloud) as shared:
+        npt.assert_array_equal(lasso_points(face_polygon, shared).to_array(), lasso_points(face_polygon, point_cloud))
+
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(face_planes, shared, roof.vertices, roof.faces) for _ in range(4)]
+            for future in futures:
+                assert future.result() == face_planes(point_cloud, roof.vertices, roof.faces)
+
+        # a crashed worker does not take the block with it
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            with pytest.raises(BrokenProcessPool):
+                executor.submit(crash, shared).result()
+        attached = SharedPointCloud.attach(shared.name, shared.n_points, shared.dtypes)
+        npt.assert_array_equal(attached.xyz, point_cloud[:, :3])
+        attached.close()
+
+
+def test_shared_point_cloud_owner_crash():
+    # an owner that crashes after a worker attached still has its block unlinked by its resource tracker
+    code = (
+        "import os, sys\n"
+        "from concurrent.futures import ProcessPoolExecutor\n"
+        "import numpy as np\n"
+        "from shared_point_cloud import SharedPointCloud\n"
+        "from __tests__.test_shared_point_cloud import point_count\n"
+        "shared = SharedPointCloud.create(np.ones((100, 9)))\n"
+        "with ProcessPoolExecutor(max_workers=1) as executor:\n"
+        "    assert executor.submit(point_count, shared).result() == 100\n"
+        "print(shared.name, flush=True)\n"
+        "os._exit(1)\n"
+    )
+    process = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parents[1], capture_output=True,
+                             text=True)
+    assert process.returncode == 1
+    assert "Traceback" not in process.stderr
+    name = process.stdout.strip()
+
+    # the tracker unlinks the block once the pool worker has exited too
+    deadline = time.monotonic() + 10.0
+    while True:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            break
+        shm.close()
+        if time.monotonic() > deadline:
+            shm.unlink()
+            pytest.fail(f"{name} was not unlinked")
+        time.sleep(0.1)
@@ -0,0 +1,67 @@
+import numpy as np
+import numpy.testing as npt
+
+from file_utils import read_image_lazy, read_metadata, read_ply
+from point_cloud_utils import image_to_world
+from synthetic import complex_roof, gable_roof, hip_roof, sample_roof_points, write_synthetic_building
+
+
+def heights(roof, xy):
+    a, b, c, d = roof.planes.T
+    return -(np.outer(xy[:, 0], a) + np.outer(xy[:, 1], b) + d) / c
+
+
+def test_gable_roof():
+    roof = gable_roof(width=20.0, depth=10.0, slope=0.5, eave_height=3.0)
+    assert len(roof.vertices) == 6
+    assert len(roof.faces) == 2
+    assert len(roof.edges) == 7  # 6 outline edges and the ridge
+
+    # both faces meet at the ridge height and the eaves
+    npt.assert_almost_equal(heights(roof, np.array([[0.0, 0.0]])), [[5.5, 5.5]])
+    npt.assert_almost_equal(heights(roof, np.array([[0.0, -5.0], [0.0, 5.0]]))[[0, 1], [0, 1]], [3.0, 3.0])
+
+
+def test_hip_roof():
+    roof = hip_roof(width=20.0, depth=10.0, slope=0.5, eave_height=3.0)
+    assert len(roof.faces) == 4
+
+    # the 3 faces at each end of the ridge meet at the ridge height
+    ridge_ends = np.flatnonzero(roof.vertices[:, 1] == 0.0)
+    assert len(ridge_ends) == 2
+    for v in ridge_ends:
+        face_ids = [i for i, face in enumerate(roof.faces) if v in face]
+        assert len(face_ids) == 3
+        face_heights = heights(roof, roof.vertices[[v], :])[0, face_ids]
+        npt.assert_almost_equal(face_heights, 5.5)
+
+
+def test_complex_roof():
+    roof = complex_roof(n_faces=20)
+    assert len(roof.faces) == 20
+    assert roof.planes.shape == (20, 4)
+    assert np.all(roof.planes[:, 2] > 0)
+
+
+def test_sample_roof_points():
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 5000, noise=0.0, outlier_rate=0.0)
+    assert point_cloud.shape == (5000, 9)
+
+    # noise-free points on the ground or on a face plane
+    on_roof = point_cloud[:, 2] > 0
+    residuals = np.abs(point_cloud[on_roof, :3] @ roof.planes[:, :3].T + roof.planes[:, 3])
+    npt.assert_almost_equal(residuals.min(axis=1), 0.0)
+    npt.assert_almost_equal(np.linalg.norm(point_cloud[:, 3:6], axis=1), 1.0)
+
+
+def test_write_synthetic_building(tmp_path):
+    roof = gable_roof()
+    point_cloud = sample_roof_points(roof, 1000)
+    image_shape = write_synthetic_building(tmp_path, "a", roof, point_cloud, ppm=10.0)
+
+    assert read_image_lazy(tmp_path, "a").shape[:2] == image_shape
+    npt.assert_almost_equal(read_ply(tmp_path, "a")[:, :3], point_cloud[:, :3], decimal=5)
+    vertices_pixels, edges, faces, ppm = read_metadata(tmp_path, "a")
+    npt.assert_almost_equal(image_to_world(vertices_pixels, ppm, image_shape), roof.vertices)
+    assert faces == roof.faces
@@ -0,0 +1,82 @@
+import numpy as np
+import numpy.testing as npt
+
+from point_cloud_utils import PointCloud, image_to_world, world_to_image
+from synthetic import gable_roof, sample_roof_points
+from tiling import TileIndex, crop_points, extract_building, recenter
+
+
+def survey(n=20000):
+    rng = np.random.default_rng(0)
+    point_cloud = np.zeros((n, 9))
+    point_cloud[:, :2] = rng.uniform([1000.0, 2000.0], [1400.0, 2300.0], size=(n, 2))
+    point_cloud[:, 2] = rng.normal(size=n)
+    point_cloud[:, 5] = 1.0
+    point_cloud[:, 6:9] = rng.integers(0, 256, size=(n, 3))
+    return point_cloud
+
+
+def test_tile_index(tmp_path):
+    point_cloud = survey()
+    chunks = (point_cloud[start:start + 3000] for start in range(0, len(point_cloud), 3000))
+    tile_index = TileIndex.build(chunks, tmp_path / "tiles", tile_size=100.0)
+
+    assert len(tile_index.tiles) == 4 * 3
+    assert sum(tile["count"] for tile in tile_index.tiles.values()) == len(point_cloud)
+
+    tile_index = TileIndex.load(tmp_path / "tiles")
+    tile = tile_index.read_tile((11, 21))
+    in_tile = np.all(np.floor(point_cloud[:, :2] / 100.0) == [11, 21], axis=1)
+    npt.assert_array_equal(tile.xyz, point_cloud[in_tile, :3])
+    npt.assert_array_equal(tile.colors, point_cloud[in_tile, 6:9])
+    assert tile_index.tiles_in_bbox(np.array([1150.0, 2150.0]), np.array([1160.0, 2160.0])) == [(11, 21)]
+
+    # the keys looked up from the box match a scan of the bounds of every tile
+    rng = np.random.default_rng(1)
+    for _ in range(100):
+        xy_min = rng.uniform([900.0, 1900.0], [1500.0, 2400.0])
+        xy_max = xy_min + rng.exponential(100.0, size=2)
+        expected = sorted(key for key, tile in tile_index.tiles.items()
+                          if np.all(np.array(tile["bounds"][0][:2]) <= xy_max)
+                          and np.all(np.array(tile["bounds"][1][:2]) >= xy_min))
+        assert tile_index.tiles_in_bbox(xy_min, xy_max) == expected
+    assert len(tile_index.tiles_in_bbox(np.array([-1e6, -1e6]), np.array([1e6, 1e6]))) == 4 * 3
+
+
+def test_crop_points(tmp_path):
+    point_cloud = survey()
+    tile_index = TileIndex.build([point_cloud], tmp_path / "tiles", tile_size=100.0)
+
+    xy_min, xy_max = np.array([1090.0, 2190.0]), np.array([1130.0, 2220.0])  # spans 4 tiles
+    crop = crop_points(tile_index, xy_min, xy_max)
+    in_box = np.all((point_cloud[:, :2] >= xy_min) & (point_cloud[:, :2] <= xy_max), axis=1)
+
+    order = np.lexsort(crop.xyz.T)
+    expected = point_cloud[in_box, :3]
+    npt.assert_array_equal(crop.xyz[order], expected[np.lexsort(expected.T)])
+
+
+def test_recenter():
+    point_cloud = PointCloud(np.array([[10.0, 20.0, 3.0]], dtype=np.float32))
+    npt.assert_array_equal(recenter(point_cloud, np.array([10.0, 21.0])).xyz, [[0.0, -1.0, 3.0]])
+
+
+def test_extract_building(tmp_path):
+    # a building in the middle of a survey, far from the world origin
+    roof = gable_roof()
+    offset = np.array([1200.0, 2150.0])
+    building = sample_roof_points(roof, 5000)
+    building[:, :2] += offset
+    tile_index = TileIndex.build([survey(), building], tmp_path / "tiles", tile_size=100.0)
+
+    footprint = roof.vertices + offset
+    point_cloud, center_xy, image_shape = extract_building(tile_index, footprint, ppm=10.0, margin=2.0)
+
+    npt.assert_almost_equal(center_xy, offset)
+    assert image_shape == (141, 241)  # (10 + 2 * 2) x (20 + 2 * 2) meters at 10 pixels-per-meter
+    assert len(point_cloud) >= len(building)
+    assert np.all(np.abs(point_cloud.xyz[:, :2]) <= [12.0, 7.0])
+
+    # the footprint in pixels of the cropped ortho maps back onto the re-centered points
+    vertices_pixels = world_to_image(footprint - center_xy, 10.0, image_shape)
+    npt.assert_almost_equal(image_to_world(vertices_pixels, 10.0, image_shape), roof.vertices)
@@ -0,0 +1,71 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+from PIL import Image
+
+from point_cloud_utils import assign_points_to_faces
+from synthetic import complex_roof, hip_roof, sample_roof_points
+from visualize import decimate_faces, decimate_points, render_roof, render_roof_thumbnails
+
+
+@pytest.mark.parametrize("method", ["voxel", "random"])
+def test_decimate_points(method):
+    roof = complex_roof(n_faces=20)
+    point_cloud = sample_roof_points(roof, 50000)
+    labels, _ = assign_points_to_faces(point_cloud, [roof.vertices[face, :] for face in roof.faces])
+
+    keep = decimate_points(point_cloud[:, :3], 5000, method=method, labels=labels)
+    assert 4000 < len(keep) <= 5000
+    assert np.all(np.diff(keep) > 0)
+
+    # every face keeps about its share of the points
+    kept, total = np.bincount(labels[keep] + 1), np.bincount(labels + 1)
+    npt.assert_allclose(kept / len(keep), total / len(labels), atol=0.01)
+
+    npt.assert_array_equal(decimate_points(point_cloud[:100, :3], 5000, method=method), np.arange(100))
+    npt.assert_array_equal(decimate_points(point_cloud[:, :3], 5000, method=method, seed=1),
+                           decimate_points(point_cloud[:, :3], 5000, method=method, seed=1))
+
+
+@pytest.mark.parametrize("method", ["voxel", "random"])
+def test_decimate_points_small_budget(method):
+    rng = np.random.default_rng(0)
+    xyz, labels = rng.random((100, 3)), np.arange(100) % 5
+
+    # one point per face at the smallest budget, which must cover every face
+    keep = decimate_points(xyz, 5, method=method, labels=labels)
+    npt.assert_array_equal(np.sort(labels[keep]), np.arange(5))
+    assert len(decimate_points(xyz, 7, method=method, labels=labels)) <= 7
+    with pytest.raises(ValueError):
+        decimate_points(xyz, 3, method=method, labels=labels)
+
+    # points at a single location
+    assert len(decimate_points(np.zeros((100, 3)), 5, method=method, labels=labels)) == 5
+
+
+def test_decimate_faces():
+    point_cloud = np.random.default_rng(0).random((1000, 9))
+    face_indices = [np.arange(0, 800), np.arange(800, 900), np.arange(950, 1000)]
+    decimated = decimate_faces(point_cloud, face_indices, 95, method="random")
+    assert [len(face_idx) for face_idx in decimated] == [78, 10, 5]
+    assert all(np.isin(face_idx, full).all() for face_idx, full in zip(decimated, face_indices))
+
+
+def test_render_roof(tmp_path):
+    roof = hip_roof()
+    point_cloud = sample_roof_points(roof, 20000)
+    polygons_2d = [roof.vertices[face, :] for face in roof.faces]
+    _, face_indices = assign_points_to_faces(point_cloud, polygons_2d)
+
+    paths = render_roof(point_cloud, polygons_2d, roof.planes, face_indices, path=tmp_path / "roof.png",
+                        max_points=1000, size=2.0, dpi=50)
+    assert paths == [tmp_path / "roof.png"]
+    assert Image.open(paths[0]).size == (100, 100)
+
+    paths = render_roof(point_cloud[:, :3], polygons_2d, path=tmp_path / "face.png", single_figure=False)
+    assert paths == [tmp_path / f"face_{f}.png" for f in range(len(roof.faces))]
+
+    buildings = ((name, point_cloud, polygons_2d, roof.planes, None) for name in ("a", "b"))
+    paths = render_roof_thumbnails(buildings, tmp_path / "thumbnails")
+    assert paths == [tmp_path / "thumbnails" / "a.png", tmp_path / "thumbnails" / "b.png"]
+    assert all(path.is_file() for path in paths)
@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Literal
+
+from file_utils import assign_points_to_faces_cached, read_image_lazy, read_metadata, read_ply_cached, read_ply_mmap
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from model_roof_planes import model_roof_planes
+from point_cloud_utils import image_to_world
+from result_cache import ResultCache
+from roof_mesh import open_mesh_writer, roof_mesh
+
+
+# a batch runs every building folder of a "data" folder
+#
+# data/<uid>/ortho.png
+# data/<uid>/dsm.ply
+# data/<uid>/metadata.json
+#
+
+
+def discover_uids(data_path: Path) -> list[str]:
+    """
+    Find the uids of all building folders with the files needed to model roof planes
+    """
+    uids = []
+    for building_path in sorted(Path(data_path).iterdir()):
+        if not building_path.is_dir():
+            continue
+        if all((building_path / name).is_file() for name in ("ortho.png", "dsm.ply", "metadata.json")):
+            uids.append(building_path.name)
+    return uids
+
+
+# result caches of this (worker) process by directory, shared by the buildings it processes so that the running
+# total of their size is kept between buildings rather than re-measured by listing the directory on every put
+_result_caches = {}
+
+
+def _result_cache(directory: Path) -> ResultCache:
+    directory = Path(directory)
+    if directory not in _result_caches:
+        _result_caches[directory] = ResultCache(directory)
+    return _result_caches[directory]
+
+
+def process_building(
+        data_path: Path,
+        uid: str,
+        algorithm: Literal["ransac", "normal_ransac", "least_squares", "irls", "auto", "joint"] = "ransac",
+        cache: bool = False,
+        instrument: bool = False,
+        result_cache: Path = None,
+        mesh: bool = False,
+) -> dict:
+    """
+    Model the roof planes of a single building; runs in a worker process
+
+    With cache, the point cloud and face labels are read through the data/<uid>/.cache sidecar files. With
+    instrument, the result record includes the instrumentation report of the run. With a result_cache directory,
+    a building whose point cloud, faces and settings were fit before reuses the cached planes (see ResultCache).
+    With mesh, the record also holds the (mesh_vertices, triangles, triangle_faces) arrays of the roof_mesh under
+    "mesh", which is not JSON serializable and is popped by run_batch; a building whose mesh fails keeps its planes
+    and records the error under "mesh_error". Returns a result record with the planes or the error of a failed
+    building, and the elapsed time in seconds.
+    """
+    instrumentation = Instrumentation(uid=uid) if instrument else NULL_INSTRUMENTATION
+    start = time.perf_counter()
+    try:
+        with instrumentation.stage("read"):
+            img = read_image_lazy(data_path, uid)
+            if img is None:
+                raise FileNotFoundError(f"Missing ortho.png for {uid}")
+            vertices_pixels, edges, faces, ppm = read_metadata(data_path, uid)
+            vertices = image_to_world(vertices_pixels, ppm, img.shape[:2])
+
+            if cache:
+                point_cloud = read_ply_cached(data_path, uid)
+                face_polygons = [vertices[face, :] for face in faces]
+                labels = assign_points_to_faces_cached(data_path, uid, point_cloud, face_polygons)
+            else:
+                point_cloud = read_ply_mmap(data_path, uid)
+                labels = None
+
+        planes = model_roof_planes(point_cloud, vertices, faces, algorithm=algorithm, labels=labels, edges=edges,
+                                   instrumentation=instrumentation,
+                                   cache=None if result_cache is None else _result_cache(result_cache))
+        result = {"uid": uid, "planes": [list(plane) for plane in planes], "error": None}
+        if mesh:
+            try:
+                with instrumentation.stage("mesh"):
+                    result["mesh"] = roof_mesh(vertices, faces, planes)
+            except Exception as e:
+                result["mesh_error"] = f"{type(e).__name__}: {e}"
+    except Exception as e:
+        result = {"uid": uid, "planes": None, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+
+    result["seconds"] = time.perf_counter() - start
+    if instrument:
+        result["instrumentation"] = instrumentation.emit()
+    return result
+
+
+def failed_result(uid: str, error: str) -> dict:
+    """
+    Result record of a building whose worker did not return a result
+    """
+    return {"uid": uid, "planes": None, "error": error, "seconds": None}
+
+
+def run_batch(
+        data_path: Path,
+        results_path: Path,
+        uids: list[str] = None,
+        algorithm: Literal["ransac", "normal_ransac", "least_squares", "irls", "auto", "joint"] = "ransac",
+        workers: int = None,
+        max_in_flight: int = None,
+        cache: bool = False,
+        instrument: bool = False,
+        result_cache: Path = None,
+        mesh_path: Path = None,
+) -> dict:
+    """
+    Model the roof planes of many buildings on a process pool
+
+    At most max_in_flight buildings (default 2 per worker) are submitted at a time. Each building's result record is
+    appended to results_path as a JSON line as soon as it completes; failed buildings are recorded with their error
+    and do not stop the batch. With cache, buildings are read through their .cache sidecar files; with instrument,
+    result records include per-stage timings and counters; with a result_cache directory, unchanged buildings reuse
+    their cached planes; with a mesh_path (.ply or .obj), the roof meshes of the succeeded buildings are streamed into
+    that file as they complete, and the records hold their index in it under "mesh_index" (or the error of a mesh
+    that could not be built or written under "mesh_error"). Returns a summary with the number of succeeded and failed
+    buildings.
+    """
+    if uids is None:
+        uids = discover_uids(data_path)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+
+    summary = {"succeeded": 0, "failed": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    pending_uids = list(reversed(uids))
+
+    with open(results_path, "a") as fp, (open_mesh_writer(mesh_path) if mesh_path else nullcontext()) as mesh_writer:
+
+        def write(result: dict):
+            mesh = result.pop("mesh", None)
+            if mesh is not None:
+                try:
+                    result["mesh_index"] = mesh_writer.add(*mesh, name=result["uid"])
+                except ValueError as e:
+                    result["mesh_error"] = f"{type(e).__name__}: {e}"
+            fp.write(json.dumps(result) + "\n")
+            fp.flush()
+            summary["failed" if result["error"] else "succeeded"] += 1
+
+        while pending_uids:
+            # a crashed worker breaks the pool; continue the remaining buildings on a fresh pool
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = {}
+                try:
+                    while pending_uids or in_flight:
+                        while pending_uids and len(in_flight) < max_in_flight:
+                            uid = pending_uids.pop()
+                            future = executor.submit(
+                                process_building, data_path, uid, algorithm, cache, instrument, result_cache,
+                                mesh_path is not None)
+                            in_flight[future] = uid
+
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            uid = in_flight.pop(future)
+                            try:
+                                write(future.result())
+                            except Exception as e:
+                                write(failed_result(uid, f"{type(e).__name__}: {e}"))
+                                if isinstance(e, BrokenProcessPool):
+                                    raise
+                except BrokenProcessPool:
+                    for uid in in_flight.values():
+                        write(failed_result(uid, "BrokenProcessPool: worker crashed"))
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model the roof planes of every building in a data folder")
+    parser.add_argument("data_path", type=Path, help="folder of data/<uid>/{ortho.png,dsm.ply,metadata.json}")
+    parser.add_argument("results_path", type=Path, help="JSON lines file the per-building results are appended to")
+    parser.add_argument("--algorithm", choices=["ransac", "normal_ransac", "least_squares", "irls", "auto", "joint"],
+                        default="ransac")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="submitted buildings (default: 2 per worker)")
+    parser.add_argument("--cache", action="store_true", help="read point clouds through data/<uid>/.cache")
+    parser.add_argument("--instrument", action="store_true", help="add stage timings and counters to the results")
+    parser.add_argument("--result-cache", type=Path, default=None, help="folder of cached plane fits to reuse")
+    parser.add_argument("--mesh", type=Path, default=None, help=".ply or .obj file to write the roof meshes to")
+    args_ = parser.parse_args()
+
+    summary_ = run_batch(args_.data_path, args_.results_path, algorithm=args_.algorithm, workers=args_.workers,
+                         max_in_flight=args_.max_in_flight, cache=args_.cache,
+                         instrument=args_.instrument, result_cache=args_.result_cache, mesh_path=args_.mesh)
+    print(f"{summary_['succeeded']} succeeded, {summary_['failed']} failed in {summary_['seconds']:.1f} seconds")
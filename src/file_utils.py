@@ -1,8 +1,14 @@
+import hashlib
 import json
+import os
 import numpy as np
+from numpy.lib import recfunctions
 from pathlib import Path
 from PIL import Image
 from plyfile import PlyData
+from typing import Iterator
+
+from point_cloud_utils import PointCloud, assign_points_to_faces
 
 
 # a "data" folder is organized with the following structure
@@ -11,6 +17,14 @@ from plyfile import PlyData
 # data/<uid>/dsm.ply
 # data/<uid>/...
 #
+# preprocessed point clouds are cached next to the dsm
+#
+# data/<uid>/.cache/manifest.json
+# data/<uid>/.cache/xyz.npy
+# data/<uid>/.cache/...
+#
+
+CACHE_DIR = ".cache"
 
 
 def read_image(data_path: Path, uid: str) -> np.ndarray:
@@ -34,26 +48,171 @@ def read_image(data_path: Path, uid: str) -> np.ndarray:
     return img
 
 
-def read_ply(data_path: Path, uid: str) -> np.ndarray:
+class LazyImage:
     """
-    Read 3D dsm / point cloud
+    Aerial image handle that reads only the image header when created and decodes pixels on request
+    """
+
+    def __init__(self, img_path: Path):
+        self.path = Path(img_path)
+        with Image.open(self.path) as p_img:
+            self.size = p_img.size  # (width, height)
+            self.mode = p_img.mode
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """
+        Shape of the decoded image array, (rows, cols) or (rows, cols, channels)
+        """
+        cols, rows = self.size
+        bands = Image.getmodebands(self.mode)
+        return (rows, cols) if bands == 1 else (rows, cols, bands)
+
+    def to_array(self) -> np.ndarray:
+        """
+        Decode the whole image
+        """
+        with Image.open(self.path) as p_img:
+            return np.array(p_img)
+
+    def crop(self, box: tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Decode a (left, upper, right, lower) window of the image
+        """
+        with Image.open(self.path) as p_img:
+            return np.array(p_img.crop(box))
+
+
+def read_image_lazy(data_path: Path, uid: str) -> LazyImage:
+    """
+    Open aerial image without decoding its pixels
+    """
+
+    img_path = Path(data_path) / uid / "ortho.png"
+
+    try:
+        img = LazyImage(img_path)
+    except FileNotFoundError as e:
+        print(e)
+        return
+
+    return img
+
+
+PLY_DTYPES = {
+    "char": "i1", "int8": "i1",
+    "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2",
+    "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4",
+    "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4",
+    "double": "f8", "float64": "f8",
+}
+
+
+def read_ply_header(ply_path: Path) -> tuple[str, int, np.dtype, int]:
+    """
+    Parse the header of a PLY file whose first element is "vertex"
+
+    Returns (format, n_vertices, vertex_dtype, data_offset) where data_offset is the byte offset of the vertex data.
+    Elements after the vertices (e.g. faces) are ignored; list properties of the vertices are not supported.
+    """
+    with open(ply_path, "rb") as fp:
+        if fp.readline().strip() != b"ply":
+            raise ValueError(f"Not a PLY file: {ply_path}")
+
+        ply_format, elements = None, []
+        for line in iter(fp.readline, b""):
+            words = line.decode("ascii").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "end_header":
+                break
+            if words[0] == "format":
+                ply_format = words[1]
+            elif words[0] == "element":
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == "property":
+                if elements[-1][0] != "vertex":
+                    continue
+                if words[1] == "list":
+                    raise ValueError(f"Unsupported list property {words[-1]} in {ply_path}")
+                elements[-1][2].append((words[2], PLY_DTYPES[words[1]]))
+        data_offset = fp.tell()
+
+    if not elements or elements[0][0] != "vertex":
+        raise ValueError(f"First PLY element is not vertex: {ply_path}")
+
+    _, n_vertices, properties = elements[0]
+    byte_order = ">" if ply_format == "binary_big_endian" else "<"
+    vertex_dtype = np.dtype([(name, byte_order + dtype) for name, dtype in properties])
+    return ply_format, n_vertices, vertex_dtype, data_offset
+
+
+def vertex_point_cloud(vertices: np.ndarray) -> PointCloud:
+    """
+    PointCloud whose xyz, normals and colors are zero-copy views into a structured vertex array
+    """
+    def columns(names: tuple[str, str, str]) -> np.ndarray:
+        if not all(name in vertices.dtype.names for name in names):
+            return None
+        return recfunctions.structured_to_unstructured(vertices[list(names)], copy=False).view(np.ndarray)
+
+    return PointCloud(columns(("x", "y", "z")), columns(("nx", "ny", "nz")), columns(("red", "green", "blue")))
+
+
+def read_ply_mmap(data_path: Path, uid: str) -> PointCloud:
     """
+    Read 3D dsm / point cloud by memory-mapping its vertex data
 
+    Binary PLY vertex data is memory-mapped as a structured array and xyz, normals and colors are views into it with
+    their native dtypes, so only the columns (and rows) used get read from disk. ASCII PLY files, and files whose
+    vertices are not the first element or have list properties, are parsed in full by plyfile.
+    """
     ply_path = Path(data_path) / uid / "dsm.ply"
 
     try:
-        plydata = PlyData.read(ply_path)
-        vertices = plydata['vertex']
-        x = np.array(vertices[:]['x'])
-        y = np.array(vertices[:]['y'])
-        z = np.array(vertices[:]['z'])
-        nx = np.array(vertices[:]['nx'])
-        ny = np.array(vertices[:]['ny'])
-        nz = np.array(vertices[:]['nz'])
-        r = np.array(vertices[:]['red'])
-        g = np.array(vertices[:]['green'])
-        b = np.array(vertices[:]['blue'])
-        point_cloud = np.column_stack((x, y, z, nx, ny, nz, r, g, b))
+        ply_format, n_vertices, vertex_dtype, data_offset = read_ply_header(ply_path)
+    except ValueError:
+        ply_format = None  # a layout that cannot be memory-mapped
+    if ply_format in (None, "ascii"):
+        vertices = PlyData.read(ply_path)['vertex'].data
+    else:
+        vertices = np.memmap(ply_path, dtype=vertex_dtype, mode="r", offset=data_offset, shape=(n_vertices,))
+
+    return vertex_point_cloud(vertices)
+
+
+def iter_ply_chunks(data_path: Path, uid: str, chunk_size: int = 1_000_000) -> Iterator[PointCloud]:
+    """
+    Read 3D dsm / point cloud in chunks of at most chunk_size points
+
+    Only one chunk is held in memory at a time, regardless of the size of the point cloud.
+    """
+    ply_path = Path(data_path) / uid / "dsm.ply"
+
+    ply_format, n_vertices, vertex_dtype, data_offset = read_ply_header(ply_path)
+    with open(ply_path, "rb") as fp:
+        fp.seek(data_offset)
+        for start in range(0, n_vertices, chunk_size):
+            count = min(chunk_size, n_vertices - start)
+            if ply_format == "ascii":
+                vertices = np.loadtxt(fp, dtype=vertex_dtype.newbyteorder("="), max_rows=count, ndmin=1)
+            else:
+                vertices = np.fromfile(fp, dtype=vertex_dtype, count=count)
+            yield vertex_point_cloud(vertices)
+
+
+def read_ply(data_path: Path, uid: str) -> np.ndarray:
+    """
+    Read 3D dsm / point cloud
+
+    Returns a (N, 9) float64 array with columns x, y, z, nx, ny, nz, r, g, b
+    """
+
+    try:
+        point_cloud = read_ply_mmap(data_path, uid).to_array()
     except FileNotFoundError as e:
         print(e)
         return
@@ -61,6 +220,147 @@ def read_ply(data_path: Path, uid: str) -> np.ndarray:
     return point_cloud
 
 
+def file_signature(path: Path, with_hash: bool = True) -> dict:
+    """
+    Size, modification time and (optionally) SHA-256 of a file, used to validate caches derived from it
+    """
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for block in iter(lambda: fp.read(1 << 20), b""):
+                sha256.update(block)
+        signature["sha256"] = sha256.hexdigest()
+    return signature
+
+
+def _cache_is_valid(manifest: dict, source_path: Path) -> bool:
+    """
+    A cache is valid if its source has the same size and mtime, or the same size and content hash
+
+    A source that was only touched gets its new mtime recorded in the manifest.
+    """
+    cached = manifest["source"]
+    current = file_signature(source_path, with_hash=False)
+    if current["size"] != cached["size"]:
+        return False
+    if current["mtime_ns"] == cached["mtime_ns"]:
+        return True
+
+    current = file_signature(source_path)
+    if current["sha256"] != cached["sha256"]:
+        return False
+    manifest["source"] = current
+    _write_manifest(source_path.parent / CACHE_DIR, manifest)
+    return True
+
+
+def _save_npy(path: Path, arr: np.ndarray):
+    """
+    Write an .npy file atomically so that concurrent readers never see a partial file
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as fp:
+        np.save(fp, np.ascontiguousarray(arr))
+    os.replace(tmp_path, path)
+
+
+def _write_manifest(cache_path: Path, manifest: dict):
+    tmp_path = cache_path / f".manifest.json.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(tmp_path, cache_path / "manifest.json")
+
+
+def _read_manifest(cache_path: Path) -> dict:
+    try:
+        with open(cache_path / "manifest.json", "r") as fp:
+            return json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def read_ply_cached(data_path: Path, uid: str) -> PointCloud:
+    """
+    Read 3D dsm / point cloud through a columnar cache of .npy files next to the dsm
+
+    The first read parses dsm.ply and writes xyz, normals and colors as .npy files plus a manifest with the
+    signature of dsm.ply and the xyz bounds. Later reads validate the manifest against dsm.ply and memory-map the
+    .npy files.
+    """
+    ply_path = Path(data_path) / uid / "dsm.ply"
+    cache_path = Path(data_path) / uid / CACHE_DIR
+
+    manifest = _read_manifest(cache_path)
+    if manifest is not None and _cache_is_valid(manifest, ply_path):
+        columns = {name: np.load(cache_path / f"{name}.npy", mmap_mode="r") for name in manifest["columns"]}
+        return PointCloud(columns["xyz"], columns.get("normals"), columns.get("colors"))
+
+    # (re)build the cache; labels of a previous dsm are stale
+    point_cloud = read_ply_mmap(data_path, uid)
+    cache_path.mkdir(exist_ok=True)
+    for labels_path in cache_path.glob("labels_*.npy"):
+        labels_path.unlink()
+
+    columns = {"xyz": point_cloud.xyz, "normals": point_cloud.normals, "colors": point_cloud.colors}
+    columns = {name: column for name, column in columns.items() if column is not None}
+    for name, column in columns.items():
+        _save_npy(cache_path / f"{name}.npy", column)
+
+    xyz = point_cloud.xyz
+    manifest = {
+        "source": file_signature(ply_path),
+        "n_points": len(xyz),
+        "columns": list(columns),
+        "bounds": [xyz.min(axis=0).tolist(), xyz.max(axis=0).tolist()] if len(xyz) else None,
+    }
+    _write_manifest(cache_path, manifest)
+
+    return read_ply_cached(data_path, uid)
+
+
+def read_cached_bounds(data_path: Path, uid: str) -> np.ndarray:
+    """
+    (2, 3) array of the min and max xyz of the cached point cloud, or None if there is no cache
+    """
+    manifest = _read_manifest(Path(data_path) / uid / CACHE_DIR)
+    if manifest is None or manifest["bounds"] is None:
+        return None
+    return np.array(manifest["bounds"])
+
+
+def face_polygons_key(face_polygons: list[np.ndarray]) -> str:
+    """
+    Hash of the face polygon vertices
+    """
+    sha256 = hashlib.sha256()
+    for face_polygon in face_polygons:
+        sha256.update(np.ascontiguousarray(face_polygon, dtype=float).tobytes())
+        sha256.update(b"|")
+    return sha256.hexdigest()[:16]
+
+
+def assign_points_to_faces_cached(
+        data_path: Path,
+        uid: str,
+        point_cloud: PointCloud,
+        face_polygons: list[np.ndarray],
+) -> np.ndarray:
+    """
+    Face labels of the points of a cached point cloud (see assign_points_to_faces), cached per set of face polygons
+
+    point_cloud must be the result of read_ply_cached for the same building.
+    """
+    labels_path = Path(data_path) / uid / CACHE_DIR / f"labels_{face_polygons_key(face_polygons)}.npy"
+    if labels_path.is_file():
+        return np.load(labels_path, mmap_mode="r")
+
+    labels, _ = assign_points_to_faces(point_cloud, face_polygons)
+    _save_npy(labels_path, labels.astype(np.int32))
+    return labels
+
+
 def read_metadata(data_path: Path, uid: str) -> tuple[np.ndarray, np.ndarray, list[list[int]], float]:
     """
     Read 2D vertices, edges, and faces (polygons) from metadata file
@@ -0,0 +1,133 @@
+import json
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Union
+
+
+##############################
+# Opt-in instrumentation of a run: per-stage wall and CPU timers plus counters, emitted as a report to a sink.
+# Functions take an optional Instrumentation and fall back to NULL_INSTRUMENTATION, whose methods do nothing.
+##############################
+
+
+class MemorySink:
+    """
+    Keeps emitted reports in a list
+    """
+
+    def __init__(self):
+        self.reports = []
+
+    def emit(self, report: dict):
+        self.reports.append(report)
+
+
+class JsonLinesSink:
+    """
+    Appends each emitted report as a line of JSON to a file
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def emit(self, report: dict):
+        # a single write per report keeps lines intact when several processes append to the same file
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(report) + "\n")
+
+
+class LoggingSink:
+    """
+    Logs each emitted report as JSON
+    """
+
+    def __init__(self, logger: logging.Logger = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger("roof_modeling.instrumentation")
+        self.level = level
+
+    def emit(self, report: dict):
+        self.logger.log(self.level, "%s", json.dumps(report))
+
+
+class Instrumentation:
+    """
+    Collects per-stage wall and CPU times and counters of a run
+
+    Counters added with count are summed; values added with record are kept as lists (e.g. one value per face).
+    context holds identifying fields of the run (e.g. the building uid) and is included in the report.
+    """
+
+    enabled = True
+
+    def __init__(self, sink: Union[MemorySink, JsonLinesSink, LoggingSink] = None, **context):
+        self.sink = sink
+        self.context = context
+        self.stages = {}
+        self.counters = {}
+        self.records = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage of the run; repeated stages accumulate
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            timing = self.stages.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0})
+            timing["wall_seconds"] += time.perf_counter() - wall
+            timing["cpu_seconds"] += time.process_time() - cpu
+            timing["calls"] += 1
+
+    def count(self, name: str, value: Union[int, float] = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, name: str, values: list):
+        self.records.setdefault(name, []).extend(values)
+
+    def report(self) -> dict:
+        return {
+            "context": dict(self.context),
+            "stages": {name: dict(timing) for name, timing in self.stages.items()},
+            "counters": dict(self.counters),
+            "records": {name: list(values) for name, values in self.records.items()},
+        }
+
+    def emit(self) -> dict:
+        """
+        Send the report to the sink, if any, and return it
+        """
+        report = self.report()
+        if self.sink is not None:
+            self.sink.emit(report)
+        return report
+
+
+class NullInstrumentation(Instrumentation):
+    """
+    Instrumentation that records nothing; the default when instrumentation is disabled
+    """
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__()
+        self._null_stage = nullcontext()
+
+    def stage(self, name: str):
+        return self._null_stage
+
+    def count(self, name: str, value: Union[int, float] = 1):
+        pass
+
+    def record(self, name: str, values: list):
+        pass
+
+    def emit(self) -> dict:
+        return self.report()
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
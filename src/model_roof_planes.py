@@ -1,89 +1,341 @@
 import numpy as np
-from open3d import geometry, utility
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Literal
+from typing import Iterable, Literal, Union
 
-from file_utils import read_image, read_metadata, read_ply
-from planar_regression import standardize_plane_np, planar_regression_lstsq
-from point_cloud_utils import lasso_points, image_to_world
-from visualize import visualize_roof_model, visualize_point_cloud, visualize_roof_planes, visualize_roof_points
+from file_utils import read_image_lazy, read_metadata, read_ply
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from planar_regression import FaceDiagnostics, face_diagnostics, face_moments, face_seeds, normal_ransac_plane, \
+    planes_from_moments, standardize_plane_np, planar_regression_irls_batched, planar_regression_lstsq_batched, \
+    ransac_plane
+from point_cloud_utils import PointCloud, assign_points_to_faces, assign_points_to_faces_raster, face_index_slices, \
+    image_to_world, point_normals, point_xyz, voxel_downsample
+from result_cache import ResultCache, point_cloud_key, result_key
+from roof_geometry import fit_planes_jointly
 
 
-def detect_plane_ransac(points: np.ndarray) -> tuple[float, float, float, float]:
+# algorithm "auto" re-fits a face with RANSAC when fewer of its points than this fraction are within the distance
+# threshold of its least squares plane, or when the RMSE of the plane exceeds the distance threshold
+AUTO_MIN_INLIER_FRACTION = 0.95
+
+
+def fit_plane_ransac(
+        points: np.ndarray,
+        distance_threshold: float = 0.2,
+        num_iterations: int = 500,
+        seed: int = 0,
+        engine: Literal["numpy", "open3d"] = "numpy",
+        normals: np.ndarray = None,
+) -> tuple[np.ndarray, np.ndarray, int]:
     """
-    Detect 3D plane equation given a set of 3D points. Use RANSAC to separate outliers.
+    Detect 3D plane equation given a set of 3D points with RANSAC
 
-    Returns tuple (a, b, c, d) where ax + by + cz + d = 0 is the 3D equation of a plane.
+    With the normals of the points, the numpy engine generates plane hypotheses from the dominant normal directions
+    (see normal_ransac_plane).
+    Returns (plane, inliers, iterations): the standardized plane (a, b, c, d), a boolean mask of the inlier points
+    and the number of RANSAC iterations run.
     """
-    face_points_o3d = geometry.PointCloud()
-    face_points_o3d.points = utility.Vector3dVector(points)
+    if engine == "numpy" and normals is not None:
+        plane, inliers, iterations = normal_ransac_plane(
+            points, normals, distance_threshold=distance_threshold, max_iterations=num_iterations, seed=seed)
+    elif engine == "open3d":
+        from open3d import geometry, utility
+
+        face_points_o3d = geometry.PointCloud()
+        face_points_o3d.points = utility.Vector3dVector(points)
 
-    # get plane with RANSAC using open3d utility
-    plane, inliers = face_points_o3d.segment_plane(distance_threshold=0.2, ransac_n=3, num_iterations=500)
+        # get plane with RANSAC using open3d utility
+        plane, inlier_indices = face_points_o3d.segment_plane(
+            distance_threshold=distance_threshold, ransac_n=3, num_iterations=num_iterations)
+        inliers = np.zeros(len(points), dtype=bool)
+        inliers[inlier_indices] = True
+        iterations = num_iterations
+    else:
+        plane, inliers, iterations = ransac_plane(
+            points, distance_threshold=distance_threshold, max_iterations=num_iterations, seed=seed)
 
     # ensure the plane coefficients have a positive 'c'; this means normals point up
-    plane = standardize_plane_np(plane)
+    plane = standardize_plane_np(np.asarray(plane, dtype=float))
+
+    return plane, inliers, iterations
+
+
+def detect_plane_ransac(
+        points: np.ndarray,
+        distance_threshold: float = 0.2,
+        num_iterations: int = 500,
+        seed: int = 0,
+        engine: Literal["numpy", "open3d"] = "numpy",
+) -> tuple[float, float, float, float]:
+    """
+    Detect 3D plane equation given a set of 3D points. Use RANSAC to separate outliers.
 
+    engine "numpy" uses the built-in vectorized RANSAC, which stops early once the confidence bound is met and is
+    reproducible under a seed; engine "open3d" always runs num_iterations with open3d's segment_plane.
+
+    Returns tuple (a, b, c, d) where ax + by + cz + d = 0 is the 3D equation of a plane.
+    """
+    plane, _, _ = fit_plane_ransac(points, distance_threshold, num_iterations, seed, engine)
     return tuple(plane.tolist())
 
 
 def model_roof_planes(
-        point_cloud: np.ndarray,
+        point_cloud: Union[np.ndarray, PointCloud],
         vertices: np.ndarray,
         faces: list[list[int]],
-        algorithm: Literal["ransac", "least_squares"] = "ransac",
-) -> list[tuple[float, float, float, float]]:
+        algorithm: Literal["ransac", "normal_ransac", "least_squares", "irls", "auto", "joint"] = "ransac",
+        assignment: Literal["grid", "raster"] = "grid",
+        ppm: float = None,
+        supersample: int = 1,
+        labels: np.ndarray = None,
+        instrumentation: Instrumentation = None,
+        seed: int = 0,
+        workers: int = None,
+        distance_threshold: float = 0.2,
+        num_iterations: int = 500,
+        cache: ResultCache = None,
+        loss: Literal["huber", "tukey"] = "tukey",
+        return_diagnostics: bool = False,
+        voxel_size: float = None,
+        max_points_per_face: int = None,
+        edges: np.ndarray = None,
+) -> Union[list[tuple[float, float, float, float]], tuple[list[tuple[float, float, float, float]], FaceDiagnostics]]:
+    """
+    Model the 3D plane of each roof face from the point cloud points within its 2D polygon
+
+    assignment selects how points are lassoed by the face polygons: "grid" tests points against each polygon using
+    a grid index; "raster" looks points up in a label image rasterized at ppm * supersample cells-per-meter.
+    Precomputed face labels of the points (e.g. from assign_points_to_faces_cached) skip the assignment.
+    An Instrumentation collects stage timings and per-face counters of the run. RANSAC of each face is seeded with
+    its own seed derived from seed. algorithm "normal_ransac" guides RANSAC by the point normals (nx, ny, nz), which
+    converges in far fewer iterations when many points are outliers; without normals it is plain RANSAC.
+    algorithm "irls" fits all faces at once with iteratively reweighted least squares using Huber or Tukey loss
+    weights (see planar_regression_irls_batched); it is deterministic and robust to outliers at a few times the
+    cost of least squares. algorithm "auto" fits all faces with least squares and re-fits with RANSAC (guided by
+    the normals, if any) only the faces whose fit diagnostics suggest outliers (see AUTO_MIN_INLIER_FRACTION).
+    algorithm "joint" fits all faces together by least squares with soft constraints that faces sharing an edge meet
+    along it (see fit_planes_jointly), so that ridges and valleys close; with edges (the (E, 2) vertex index pairs of
+    metadata.json) only the listed edges are constrained, otherwise every polygon edge shared by two faces is.
+    With workers > 1 the grid assignment and the RANSAC fits of the faces run concurrently on a thread pool of that
+    many threads; the planes are returned in face order and are the same as with a serial run.
+    distance_threshold and num_iterations are the RANSAC inlier distance (meters) and maximum number of iterations.
+    A ResultCache is consulted first, keyed by the point cloud xyz, the face polygons and the fit settings; a miss
+    is fit and stored in it. The cache is not used when return_diagnostics is set, in which case the planes are
+    returned with the FaceDiagnostics (RMSE, inlier fraction, ...) of every face.
+    voxel_size (meters) and max_points_per_face fit the planes to the face points downsampled to voxel means (see
+    voxel_downsample), which trades accuracy for speed on dense point clouds; the instrumentation counts the
+    downsampled points, and the diagnostics are of all the face points.
+    """
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    xyz = point_xyz(point_cloud)
+    normals = point_normals(point_cloud) if algorithm in ("normal_ransac", "auto") else None
+    face_polygons = [vertices[face, :] for face in faces]
+
+    if cache is not None and not return_diagnostics:
+        with instrumentation.stage("cache"):
+            key = result_key(xyz, face_polygons, algorithm=algorithm, assignment=assignment, ppm=ppm,
+                             supersample=supersample, seed=seed, distance_threshold=distance_threshold,
+                             num_iterations=num_iterations, loss=loss, voxel_size=voxel_size,
+                             max_points_per_face=max_points_per_face,
+                             normals=None if normals is None else point_cloud_key(normals),
+                             edges=None if edges is None else np.asarray(edges).tolist())
+            roof_planes = cache.get(key)
+        instrumentation.count("cache_hits" if roof_planes is not None else "cache_misses")
+        if roof_planes is None:
+            roof_planes = model_roof_planes(
+                point_cloud, vertices, faces, algorithm=algorithm, assignment=assignment, ppm=ppm,
+                supersample=supersample, labels=labels, instrumentation=instrumentation, seed=seed, workers=workers,
+                distance_threshold=distance_threshold, num_iterations=num_iterations, loss=loss,
+                voxel_size=voxel_size, max_points_per_face=max_points_per_face, edges=edges)
+            cache.put(key, roof_planes)
+        return roof_planes
+
+    # get points within each 2D roof polygon in a single pass over the point cloud
+    with instrumentation.stage("assign"):
+        if labels is not None:
+            face_indices = face_index_slices(labels, len(faces))
+        elif assignment == "raster":
+            if ppm is None:
+                raise ValueError("Raster face assignment requires ppm (pixels-per-meter)")
+            labels, face_indices = assign_points_to_faces_raster(
+                point_cloud, face_polygons, ppm, supersample=supersample)
+        else:
+            labels, face_indices = assign_points_to_faces(point_cloud, face_polygons, workers=workers)
 
-    roof_planes = []
-    for face in faces:
-        # get points within each 2D roof polygon
-        face_polygon = vertices[face, :]
-        face_points = lasso_points(face_polygon, point_cloud)
+    if instrumentation.enabled:
+        instrumentation.count("points", len(xyz))
+        instrumentation.count("faces", len(faces))
+        instrumentation.record("points_per_face", [len(face_idx) for face_idx in face_indices])
 
-        if algorithm == "ransac":
-            plane = detect_plane_ransac(face_points[:, :3])
+    # fit to voxel means of the face points; diagnostics are of all the face points
+    all_xyz, all_labels = xyz, labels
+    if voxel_size is not None or max_points_per_face is not None:
+        with instrumentation.stage("downsample"):
+            # average only the columns that are fit
+            voxels, labels = voxel_downsample(PointCloud(xyz, normals), labels, voxel_size, max_points_per_face)
+            xyz, normals = voxels.xyz, voxels.normals
+            face_indices = face_index_slices(labels, len(faces))
+        instrumentation.count("downsampled_points", len(xyz))
+        instrumentation.record("downsampled_points_per_face", [len(face_idx) for face_idx in face_indices])
+
+    def fit_face(face_idx: np.ndarray, face_seed: int) -> tuple[np.ndarray, np.ndarray, int]:
+        face_normals = None if normals is None else normals[face_idx, :]
+        return fit_plane_ransac(xyz[face_idx, :], distance_threshold, num_iterations, seed=face_seed,
+                                normals=face_normals)
+
+    def fit_faces_ransac(face_ids: list[int]) -> np.ndarray:
+        seeds = face_seeds(seed, len(faces))
+        fit_face_indices = [face_indices[f] for f in face_ids]
+        fit_seeds = [seeds[f] for f in face_ids]
+        if workers is not None and workers > 1:
+            # each face has its own seed, so the fits do not depend on the order the threads run them
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fits = list(executor.map(fit_face, fit_face_indices, fit_seeds))
         else:
-            plane = planar_regression_lstsq(face_points[:, :3])
-        roof_planes.append(plane)
+            fits = [fit_face(face_idx, face_seed) for face_idx, face_seed in zip(fit_face_indices, fit_seeds)]
+
+        if instrumentation.enabled:
+            instrumentation.record("ransac_iterations", [iterations for _, _, iterations in fits])
+            instrumentation.record("inliers_per_face", [int(np.count_nonzero(inliers)) for _, inliers, _ in fits])
+        return np.array([plane for plane, _, _ in fits]).reshape(-1, 4)
+
+    if algorithm in ("least_squares", "irls", "auto", "joint"):
+        # fit all faces at once from per-face sufficient statistics
+        with instrumentation.stage("fit"):
+            if algorithm == "irls":
+                planes, _, valid, iterations = planar_regression_irls_batched(xyz, labels, len(faces), loss=loss)
+                instrumentation.count("irls_iterations", iterations)
+            else:
+                planes, valid = planar_regression_lstsq_batched(xyz, labels, len(faces))
+        instrumentation.count("rank_deficient_faces", int(np.count_nonzero(~valid)))
+        if not np.all(valid):
+            raise ValueError(f"Unable to determine best fit plane for faces {np.flatnonzero(~valid).tolist()}")
+
+        if algorithm == "joint":
+            # warm-started from the independent least squares planes
+            with instrumentation.stage("fit_joint"):
+                planes, iterations = fit_planes_jointly(xyz, labels, vertices, faces, edges=edges)
+            instrumentation.count("joint_iterations", iterations)
 
-        # DEBUG: visualize point cloud points within a single face polygon
-        # visualize_point_cloud(face_points, polygon_2d=face_polygon, plane=plane)
+        if algorithm == "auto":
+            # only faces whose least squares fit looks contaminated by outliers take the robust path
+            with instrumentation.stage("diagnose"):
+                # of all the face points, since voxel means average outliers away
+                diagnostics = face_diagnostics(all_xyz, all_labels, planes, distance_threshold)
+            escalate = np.flatnonzero((diagnostics.inlier_fraction < AUTO_MIN_INLIER_FRACTION) |
+                                      (diagnostics.rmse > distance_threshold)).tolist()
+            instrumentation.count("escalated_faces", len(escalate))
+            if escalate:
+                with instrumentation.stage("fit_robust"):
+                    planes[escalate] = fit_faces_ransac(escalate)
+    else:
+        with instrumentation.stage("fit"):
+            planes = fit_faces_ransac(list(range(len(faces))))
+
+    # DEBUG: visualize point cloud points within a single face polygon
+    # visualize_point_cloud(xyz[face_indices[0], :], polygon_2d=face_polygons[0], plane=planes[0])
+
+    roof_planes = [tuple(plane) for plane in planes.tolist()]
+    if return_diagnostics:
+        with instrumentation.stage("diagnose"):
+            return roof_planes, face_diagnostics(all_xyz, all_labels, planes, distance_threshold)
     return roof_planes
 
 
+def model_roof_planes_streaming(
+        chunks: Iterable[Union[np.ndarray, PointCloud]],
+        vertices: np.ndarray,
+        faces: list[list[int]],
+        instrumentation: Instrumentation = None,
+) -> list[tuple[float, float, float, float]]:
+    """
+    Model the least squares 3D plane of each roof face from a point cloud read in chunks (e.g. iter_ply_chunks)
+
+    Each chunk's points are assigned to faces and accumulated into per-face sufficient statistics, so the planes are
+    the same as model_roof_planes with algorithm "least_squares" while memory is bounded by the chunk size.
+    """
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    n_faces = len(faces)
+    face_polygons = [vertices[face, :] for face in faces]
+
+    # moments are accumulated relative to an origin near the points to avoid cancellation with large coordinates
+    origin = None
+    counts, sums, outer_sums = np.zeros(n_faces), np.zeros((n_faces, 3)), np.zeros((n_faces, 3, 3))
+    for chunk in chunks:
+        xyz = point_xyz(chunk)
+        if len(xyz) == 0:
+            continue
+        with instrumentation.stage("assign"):
+            labels, _ = assign_points_to_faces(xyz, face_polygons)
+        with instrumentation.stage("accumulate"):
+            if origin is None:
+                origin = xyz.mean(axis=0, dtype=float)
+            chunk_moments = face_moments(xyz - origin, labels, n_faces)
+            counts += chunk_moments[0]
+            sums += chunk_moments[1]
+            outer_sums += chunk_moments[2]
+        instrumentation.count("points", len(xyz))
+        instrumentation.count("chunks")
+
+    with instrumentation.stage("fit"):
+        planes, valid = planes_from_moments(counts, sums, outer_sums)
+    instrumentation.count("rank_deficient_faces", int(np.count_nonzero(~valid)))
+    if not np.all(valid):
+        raise ValueError(f"Unable to determine best fit plane for faces {np.flatnonzero(~valid).tolist()}")
+
+    # planes relative to the origin -> world coordinates
+    if origin is not None:
+        planes[:, 3] -= planes[:, :3] @ origin
+    return [tuple(plane) for plane in planes.tolist()]
+
+
 if __name__ == "__main__":
+    # visualization pulls in matplotlib; only the demo needs it
+    from visualize import visualize_roof_model, visualize_point_cloud, visualize_roof_planes, visualize_roof_points
+
     # data inputs
     data_path_ = Path('/Users/merrillmck/source/github/roof_modeling/data')
     uid_ = "ftlaud_1"
 
     # read data from files
-    img_ = read_image(data_path_, uid_)
+    img_ = read_image_lazy(data_path_, uid_)  # header only; pixels are not needed to model the roof
     point_cloud_ = read_ply(data_path_, uid_)
     vertices_pixels_, _, faces_, ppm_ = read_metadata(data_path_, uid_)
     vertices_ = image_to_world(vertices_pixels_, ppm_, img_.shape[:2])
 
     # model roof planes with RANSAC
-    roof_planes_ransac_ = model_roof_planes(point_cloud_, vertices_, faces_, algorithm="ransac")
+    roof_planes_ransac_ = model_roof_planes(point_cloud_, vertices_, faces_, algorithm="ransac",
+                                            assignment="raster", ppm=ppm_)
 
     # model roof planes with least squares fit
-    roof_planes_lstsq_ = model_roof_planes(point_cloud_, vertices_, faces_, algorithm="least_squares")
+    roof_planes_lstsq_ = model_roof_planes(point_cloud_, vertices_, faces_, algorithm="least_squares",
+                                           assignment="raster", ppm=ppm_)
+
+    # model roof planes with least squares, re-fitting only faces with outliers with RANSAC
+    roof_planes_auto_, diagnostics_ = model_roof_planes(point_cloud_, vertices_, faces_, algorithm="auto",
+                                                        assignment="raster", ppm=ppm_, return_diagnostics=True)
+    for face_id_, (rmse_, inlier_fraction_) in enumerate(zip(diagnostics_.rmse, diagnostics_.inlier_fraction)):
+        print(f"face {face_id_}: rmse {rmse_:.3f} m, inlier fraction {inlier_fraction_:.2f}")
 
     # visualize roof
     polygons_2d_ = []
     for face_ in faces_:
         polygons_2d_.append(vertices_[face_, :])
+    _, face_indices_ = assign_points_to_faces(point_cloud_, polygons_2d_)
 
     #
-    visualize_roof_points(point_cloud_, polygons_2d_)
+    visualize_roof_points(point_cloud_, polygons_2d_, face_indices=face_indices_)
 
     #
-    visualize_roof_planes(point_cloud_, polygons_2d_, roof_planes_lstsq_, title="Least squares")
+    visualize_roof_planes(point_cloud_, polygons_2d_, roof_planes_lstsq_, title="Least squares",
+                          face_indices=face_indices_)
 
     #
-    visualize_roof_planes(point_cloud_, polygons_2d_, roof_planes_ransac_, title="RANSAC")
+    visualize_roof_planes(point_cloud_, polygons_2d_, roof_planes_ransac_, title="RANSAC", face_indices=face_indices_)
 
     # RANSAC
-    visualize_roof_model(point_cloud_, polygons_2d_, roof_planes_ransac_, title="RANSAC")
+    visualize_roof_model(point_cloud_, polygons_2d_, roof_planes_ransac_, title="RANSAC", face_indices=face_indices_)
 
     # least squares
-    # visualize_roof_model(point_cloud_, polygons_2d_, roof_planes_lstsq_, title="Least squares")
+    # visualize_roof_model(point_cloud_, polygons_2d_, roof_planes_lstsq_, title="Least squares",
+    #                      face_indices=face_indices_)
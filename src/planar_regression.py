@@ -1,6 +1,6 @@
 import math
 import numpy as np
-from typing import Union
+from typing import Literal, NamedTuple, Union
 
 
 ##############################
@@ -110,3 +110,535 @@ def planar_regression_lstsq(points: np.ndarray) -> tuple[float, float, float, fl
     plane = standardize_plane_np(plane)
 
     return plane.tolist()
+
+
+def standardize_planes_np(planes: np.ndarray) -> np.ndarray:
+    """
+    Standardize a (F, 4) array of plane equations so that each c >= 0 and each <a, b, c> is a unit normal vector
+    """
+    # ensure the plane coefficients have a positive 'c'; this means normals "point up"
+    planes = np.where(planes[:, 2:3] < 0, -planes, planes)
+
+    # normalize normal vectors <a, b, c> to be unit normal vectors
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def face_moments(
+        points: np.ndarray,
+        labels: np.ndarray,
+        n_faces: int,
+        weights: np.ndarray = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-face sufficient statistics for plane fitting, accumulated with segmented reductions over a face label array
+
+    Returns (counts, sums, outer_sums) with shapes (F,), (F, 3) and (F, 3, 3): the (weighted) number of points, the
+    sums of x, y, z and the sums of the outer products of <x, y, z> of the points of each face. Points labeled -1 are
+    ignored. Statistics of disjoint sets of points add up, so they can be accumulated over chunks of a point cloud.
+    """
+    assigned = labels >= 0
+    face = labels[assigned]
+    xyz = points[assigned, :3]
+    w = None if weights is None else weights[assigned]
+
+    counts = np.bincount(face, weights=w, minlength=n_faces).astype(float)
+    sums = np.empty((n_faces, 3))
+    outer_sums = np.empty((n_faces, 3, 3))
+    for j in range(3):
+        wx = xyz[:, j] if w is None else w * xyz[:, j]
+        sums[:, j] = np.bincount(face, weights=wx, minlength=n_faces)
+        for k in range(j, 3):
+            outer_sums[:, j, k] = outer_sums[:, k, j] = np.bincount(face, weights=wx * xyz[:, k], minlength=n_faces)
+
+    return counts, sums, outer_sums
+
+
+def planes_from_moments(
+        counts: np.ndarray,
+        sums: np.ndarray,
+        outer_sums: np.ndarray,
+        rank_tolerance: float = 1e-10,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Model the 3D plane with least squared orthogonal error of every face from its sufficient statistics
+
+    The plane normal is the eigenvector of the smallest eigenvalue of the covariance matrix of the face points and
+    the plane passes through their centroid; all faces are solved as one stacked eigen-decomposition.
+
+    The covariances are differences of raw moments, so the moments should be accumulated relative to an origin near
+    the points (see planar_regression_lstsq_batched) rather than in large world coordinates.
+
+    Returns (planes, valid) where planes is a (F, 4) array of standardized planes (a, b, c, d) and valid is False for
+    rank deficient faces (fewer than 3 points or collinear points) whose planes are NaN.
+    """
+    n = np.maximum(counts, np.finfo(float).tiny)[:, np.newaxis]
+    centroids = sums / n
+    covariances = outer_sums / n[:, :, np.newaxis] - centroids[:, :, np.newaxis] * centroids[:, np.newaxis, :]
+
+    # eigenvalues in ascending order; the points must spread in at least 2 directions
+    eigenvalues, eigenvectors = np.linalg.eigh(covariances)
+    valid = (counts >= 3) & (eigenvalues[:, 1] > rank_tolerance * np.maximum(eigenvalues[:, 2], 0.0))
+
+    normals = eigenvectors[:, :, 0]
+    d = -np.einsum("ij,ij->i", normals, centroids)
+    planes = standardize_planes_np(np.column_stack((normals, d)))
+    planes[~valid] = np.nan
+
+    return planes, valid
+
+
+def vertical_planes_from_moments(
+        counts: np.ndarray,
+        sums: np.ndarray,
+        outer_sums: np.ndarray,
+) -> np.ndarray:
+    """
+    Model the 3D plane z = alpha * x + beta * y + gamma with least squared vertical error of every face from its
+    sufficient statistics (see face_moments)
+
+    Unlike the orthogonal fit, points far above or below the plane only shift it and do not tilt it towards the
+    vertical. Returns a (F, 4) array of standardized planes (a, b, c, d); faces whose xy are collinear get the
+    minimum norm solution.
+    """
+    # normal equations of z against <x, y, 1>
+    lhs = np.empty((len(counts), 3, 3))
+    lhs[:, :2, :2] = outer_sums[:, :2, :2]
+    lhs[:, :2, 2] = lhs[:, 2, :2] = sums[:, :2]
+    lhs[:, 2, 2] = counts
+    rhs = np.column_stack((outer_sums[:, :2, 2], sums[:, 2]))
+    alpha, beta, gamma = np.einsum("fij,fj->fi", np.linalg.pinv(lhs), rhs).T
+    return standardize_planes_np(np.column_stack((-alpha, -beta, np.ones(len(counts)), -gamma)))
+
+
+def planar_regression_lstsq_batched(
+        points: np.ndarray,
+        labels: np.ndarray,
+        n_faces: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Model the least squares 3D plane of every face of a labeled point cloud in one vectorized call
+
+    labels[i] is the face index of point i or -1 if the point belongs to no face.
+
+    Returns (planes, valid): a (F, 4) array of planes (a, b, c, d) where ax + by + cz + d = 0, c is non-negative, and
+    <a, b, c> is the unit normal vector, and a mask that is False for rank deficient faces.
+    """
+    # moments are accumulated relative to the centroid of the face points to avoid cancellation in the covariances
+    # with large (e.g. UTM) coordinates
+    assigned = labels >= 0
+    origin = points[assigned, :3].mean(axis=0) if np.any(assigned) else np.zeros(3)
+    planes, valid = planes_from_moments(*face_moments(points[:, :3] - origin, labels, n_faces))
+    planes[:, 3] -= planes[:, :3] @ origin
+    return planes, valid
+
+
+def face_medians(values: np.ndarray, labels: np.ndarray, n_faces: int) -> np.ndarray:
+    """
+    (Lower) median of the values of each face with a single sort; NaN for faces without values
+    """
+    assigned = labels >= 0
+    face, values = labels[assigned], values[assigned]
+    counts = np.bincount(face, minlength=n_faces)
+    has_values = counts > 0
+    medians = np.full(n_faces, np.nan)
+    if len(values) == 0:
+        return medians
+
+    # sorted by face, then by value within each face: a stable sort by face of the values in sorted order orders
+    # them like np.lexsort((values, face)), in a fraction of the time; a stable sort of 16 bit integers is a radix sort
+    order = np.argsort(values)
+    face_order = face[order].astype(np.int16) if n_faces <= np.iinfo(np.int16).max else face[order]
+    ordered = values[order[np.argsort(face_order, kind="stable")]]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    faces = np.flatnonzero(has_values)
+    medians[faces] = ordered[starts[faces] + (counts[faces] - 1) // 2]
+    return medians
+
+
+def robust_weights(residuals: np.ndarray, scales: np.ndarray, loss: Literal["huber", "tukey"]) -> np.ndarray:
+    """
+    IRLS weights of residuals in units of a robust scale; Huber (k = 1.345) or Tukey biweight (c = 4.685)
+    """
+    u = np.abs(residuals) / scales
+    if loss == "huber":
+        return np.minimum(1.0, 1.345 / np.maximum(u, np.finfo(float).tiny))
+    return np.square(np.maximum(0.0, 1.0 - np.square(u / 4.685)))
+
+
+def planar_regression_irls_batched(
+        points: np.ndarray,
+        labels: np.ndarray,
+        n_faces: int,
+        loss: Literal["huber", "tukey"] = "tukey",
+        max_iterations: int = 10,
+        tolerance: float = 1e-6,
+        min_scale: float = 1e-3,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Model a robust 3D plane of every face of a labeled point cloud with iteratively reweighted least squares
+
+    Starting from the vertical least squares planes, trimmed iterations re-fit each face to the half of its points
+    closest to the median residual, which gives a start that outliers on one side of the plane (e.g. HVAC units)
+    do not drag along. Each IRLS iteration then weights every point by its residual in units of its face's robust
+    scale (1.4826 times the median absolute deviation of the residuals, at least min_scale meters) and re-fits all
+    faces at once from weighted moments with vertical least squares (see vertical_planes_from_moments); the
+    redescending Tukey loss gives outliers zero weight. Each stage stops when no plane coefficient changes by more
+    than tolerance or after max_iterations, so the result is deterministic.
+
+    Returns (planes, weights, valid, iterations): the (F, 4) standardized planes, the final weight of each point
+    (0 for points of no face), the mask of faces that are not rank deficient and the number of iterations run.
+    """
+    counts, sums, _ = face_moments(points, labels, n_faces)
+
+    # fit relative to the face centroids to keep the moments well conditioned, with the points ordered by face so
+    # that the weighted moments of every iteration are segmented sums of precomputed monomials
+    assigned = np.flatnonzero(labels >= 0)
+    assigned = assigned[np.argsort(labels[assigned], kind="stable")]
+    face = labels[assigned]
+    centroids = sums / np.maximum(counts, 1.0)[:, np.newaxis]
+    local = points[assigned, :3] - centroids[face]
+    # (10, N): 1, x, y, z and the upper triangle of the outer product of <x, y, z>, contiguous per monomial
+    monomials = np.vstack((np.ones(len(local)), local.T, *(local[:, j] * local[:, j:].T for j in range(3))))
+    face_counts = np.bincount(face, minlength=n_faces)
+    nonempty = np.flatnonzero(face_counts)
+    starts = (np.cumsum(face_counts) - face_counts)[nonempty]
+    weighted_monomials = np.empty_like(monomials)
+
+    def weighted_moments(weights: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # a segmented sum of the weighted monomials over the contiguous points of each face
+        moments = np.zeros((n_faces, 10))
+        if len(nonempty):
+            np.multiply(monomials, weights, out=weighted_monomials)
+            moments[nonempty] = np.add.reduceat(weighted_monomials, starts, axis=1).T
+        upper = np.triu_indices(3)
+        weighted_outer_sums = np.zeros((n_faces, 3, 3))
+        weighted_outer_sums[:, upper[0], upper[1]] = moments[:, 4:]
+        weighted_outer_sums[:, upper[1], upper[0]] = moments[:, 4:]
+        return moments[:, 0], moments[:, 1:4], weighted_outer_sums
+
+    weights = np.ones(len(assigned))
+    moments = weighted_moments(weights)
+    _, valid = planes_from_moments(*moments)
+    planes = vertical_planes_from_moments(*moments)
+    iterations = 0
+    for stage in ("trimmed", loss):
+        for _ in range(max_iterations):
+            iterations += 1
+            residuals = np.einsum("ij,ij->i", local, planes[face, :3]) + planes[face, 3]
+            deviations = np.abs(residuals - face_medians(residuals, face, n_faces)[face])
+            median_deviations = face_medians(deviations, face, n_faces)[face]
+            if stage == "trimmed":
+                weights = (deviations <= median_deviations).astype(float)
+            else:
+                scales = np.maximum(1.4826 * median_deviations, min_scale)
+                weights = np.nan_to_num(robust_weights(residuals, scales, stage))
+
+            moments = weighted_moments(weights)
+            _, new_valid = planes_from_moments(*moments)
+            new_planes = vertical_planes_from_moments(*moments)
+            # keep the previous plane of a face whose weighted points became rank deficient
+            new_planes[~new_valid] = planes[~new_valid]
+            change = np.nan_to_num(np.abs(new_planes - planes)).max(initial=0.0)
+            planes = new_planes
+            if change <= tolerance:
+                break
+
+    planes[:, 3] -= np.einsum("ij,ij->i", planes[:, :3], centroids)
+    planes[~valid] = np.nan
+    point_weights = np.zeros(len(labels))
+    point_weights[assigned] = weights
+    return planes, point_weights, valid, iterations
+
+
+class FaceDiagnostics(NamedTuple):
+    counts: np.ndarray  # (F,) points of each face
+    rmse: np.ndarray  # (F,) root mean square orthogonal residual in meters
+    median_abs_residual: np.ndarray  # (F,) median absolute orthogonal residual in meters
+    inlier_fraction: np.ndarray  # (F,) fraction of points within distance_threshold of the plane
+    condition_number: np.ndarray  # (F,) largest / middle covariance eigenvalue; large for sliver faces
+
+    def to_dict(self) -> dict:
+        return {name: values.tolist() for name, values in self._asdict().items()}
+
+
+def face_diagnostics(
+        points: np.ndarray,
+        labels: np.ndarray,
+        planes: np.ndarray,
+        distance_threshold: float = 0.2,
+) -> FaceDiagnostics:
+    """
+    Fit quality of the (F, 4) planes of every face of a labeled point cloud with segmented reductions
+
+    Statistics of faces without points are NaN; the condition number of a face whose points are collinear is inf.
+    """
+    n_faces = len(planes)
+    assigned = labels >= 0
+    face = labels[assigned]
+    residuals = np.abs(np.einsum("ij,ij->i", points[assigned, :3], planes[face, :3]) + planes[face, 3])
+
+    counts = np.bincount(face, minlength=n_faces)
+    has_points = counts > 0
+    n = np.maximum(counts, 1)
+    rmse = np.sqrt(np.bincount(face, weights=np.square(residuals), minlength=n_faces) / n)
+    inlier_fraction = np.bincount(face, weights=residuals < distance_threshold, minlength=n_faces) / n
+
+    # covariance eigenvalues of the points relative to their face centroid
+    centroids = face_moments(points, labels, n_faces)[1] / n[:, np.newaxis]
+    face_counts, _, outer_sums = face_moments(points[assigned, :3] - centroids[face], face, n_faces)
+    eigenvalues = np.linalg.eigvalsh(outer_sums / np.maximum(face_counts, 1.0)[:, np.newaxis, np.newaxis])
+    condition_number = np.divide(eigenvalues[:, 2], eigenvalues[:, 1], out=np.full(n_faces, np.inf),
+                                 where=eigenvalues[:, 1] > 1e-10 * np.maximum(eigenvalues[:, 2], 0.0))
+
+    return FaceDiagnostics(
+        counts=counts,
+        rmse=np.where(has_points, rmse, np.nan),
+        median_abs_residual=face_medians(residuals, face, n_faces),
+        inlier_fraction=np.where(has_points, inlier_fraction, np.nan),
+        condition_number=np.where(has_points, condition_number, np.nan),
+    )
+
+
+def face_seeds(seed: Union[None, int], n_faces: int) -> list[Union[None, int]]:
+    """
+    Independent, reproducible RANSAC seeds for each face derived from a single seed (None stays random)
+    """
+    if seed is None:
+        return [None] * n_faces
+    return np.random.SeedSequence(seed).generate_state(n_faces).tolist()
+
+
+def ransac_iterations_required(inlier_ratio: float, confidence: float, sample_size: int = 3) -> float:
+    """
+    Number of RANSAC iterations needed to draw at least one all-inlier sample with the given confidence
+    """
+    p_good_sample = inlier_ratio ** sample_size
+    if p_good_sample >= 1.0:
+        return 1.0
+    if p_good_sample <= 0.0:
+        return math.inf
+    return math.log(1.0 - confidence) / math.log(1.0 - p_good_sample)
+
+
+def sample_triples(rng: np.random.Generator, n: int, size: int) -> np.ndarray:
+    """
+    Draw size random triples of distinct indices in [0, n) as a (3, size) array
+    """
+    i1 = rng.integers(0, n, size=size)
+    i2 = rng.integers(0, n - 1, size=size)
+    i3 = rng.integers(0, n - 2, size=size)
+
+    # shift past the indices already drawn so that the 3 indices are distinct
+    i2 += i2 >= i1
+    lo, hi = np.minimum(i1, i2), np.maximum(i1, i2)
+    i3 += i3 >= lo
+    i3 += i3 >= hi
+    return np.stack((i1, i2, i3))
+
+
+def ransac_plane(
+        points: np.ndarray,
+        distance_threshold: float = 0.2,
+        max_iterations: int = 500,
+        confidence: float = 0.99,
+        block_size: int = 8,
+        seed: Union[None, int, np.random.Generator] = None,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Detect the 3D plane supported by the most points with RANSAC
+
+    Plane hypotheses are generated from blocks of random 3-point samples and scored against all points with one
+    matrix product per block; ties in the number of inliers go to the lower inlier RMSE. Iteration stops early once
+    the best inlier ratio so far guarantees an all-inlier sample with the given confidence.
+
+    Returns (plane, inliers, iterations) where plane is the standardized (a, b, c, d), inliers is a boolean mask of
+    the points within distance_threshold of the plane and iterations is the number of hypotheses evaluated.
+    """
+    n = len(points)
+    if n < 3:
+        raise ValueError(f"Unable to determine plane with RANSAC; {n} points")
+
+    rng = np.random.default_rng(seed)
+    xyz = points[:, :3]
+    homogeneous = np.column_stack((xyz, np.ones(n)))
+
+    # bound the size of the (N, block) distance matrix
+    block_size = max(1, min(block_size, 4_000_000 // n))
+
+    best_plane, best_count, best_sse = None, 0, math.inf
+    required = max_iterations
+    iterations = 0
+    while iterations < min(required, max_iterations):
+        block = min(block_size, max_iterations - iterations)
+        iterations += block
+
+        # plane hypotheses from minimal samples of 3 points
+        x1, x2, x3 = xyz[sample_triples(rng, n, block), :]
+        normals = np.cross(x2 - x1, x3 - x1)
+        norms = np.linalg.norm(normals, axis=1)
+        # samples that are (numerically) collinear or repeat a point determine no plane
+        non_degenerate = norms > 1e-9 * np.linalg.norm(x2 - x1, axis=1) * np.linalg.norm(x3 - x1, axis=1)
+        normals[non_degenerate] /= norms[non_degenerate, np.newaxis]
+        hypotheses = np.column_stack((normals, -np.einsum("ij,ij->i", normals, x1)))
+
+        # score all hypotheses of the block at once
+        distances = np.abs(homogeneous @ hypotheses.T)
+        is_inlier = distances < distance_threshold
+        counts = np.count_nonzero(is_inlier, axis=0)
+        counts[~non_degenerate] = 0
+        sse = np.einsum("ij,ij->j", distances * is_inlier, distances)
+        sse[~non_degenerate] = math.inf
+
+        k = np.lexsort((sse, -counts))[0]
+        if not non_degenerate[k]:
+            continue
+        if counts[k] > best_count or (counts[k] == best_count and sse[k] < best_sse):
+            if counts[k] > best_count:
+                required = ransac_iterations_required(counts[k] / n, confidence)
+            best_plane, best_count, best_sse = hypotheses[k], counts[k], sse[k]
+
+    if best_plane is None:
+        raise ValueError("Unable to determine plane with RANSAC; all samples are collinear")
+
+    inliers = np.abs(homogeneous @ best_plane) < distance_threshold
+    plane = standardize_plane_np(best_plane.copy())
+    return plane, inliers, iterations
+
+
+def normal_histogram_peaks(
+        normals: np.ndarray,
+        bins: int = 16,
+        max_peaks: int = 3,
+        min_fraction: float = 0.05,
+) -> np.ndarray:
+    """
+    Dominant directions of point normals from a binned Gaussian-sphere histogram
+
+    Normals are flipped onto the upper hemisphere and binned by their (nx, ny) projection into a bins x bins grid;
+    counts are summed over 3 x 3 neighborhoods so that a cluster split by a bin edge still forms one peak. Peaks are
+    local maxima holding at least min_fraction of the normals, and each peak direction is the mean of the normals
+    in its neighborhood. Returns a (P, 3) array of unit normals ordered by decreasing support, P <= max_peaks.
+    """
+    normals = normals[np.all(np.isfinite(normals), axis=1)]
+    norms = np.linalg.norm(normals, axis=1)
+    normals = normals[norms > 0] / norms[norms > 0, np.newaxis]
+    normals = np.where(normals[:, 2:3] < 0, -normals, normals)
+    if len(normals) == 0:
+        return np.empty((0, 3))
+
+    cells = np.clip(np.floor((normals[:, :2] + 1.0) / 2.0 * bins).astype(np.int64), 0, bins - 1)
+    flat_cells = cells[:, 0] * bins + cells[:, 1]
+    counts = np.bincount(flat_cells, minlength=bins * bins).reshape(bins, bins)
+    padded = np.pad(counts, 1)
+    window_counts = sum(padded[i:i + bins, j:j + bins] for i in range(3) for j in range(3))
+
+    # local maxima of the windowed counts; ties between neighbors keep the first cell in row-major order
+    padded_window = np.pad(window_counts, 1, constant_values=-1)
+    is_peak = window_counts >= max(1, min_fraction * len(normals))
+    for i in range(3):
+        for j in range(3):
+            if (i, j) == (1, 1):
+                continue
+            neighbor = padded_window[i:i + bins, j:j + bins]
+            is_peak &= (window_counts > neighbor) if (i, j) < (1, 1) else (window_counts >= neighbor)
+
+    peaks = np.argwhere(is_peak)
+    peaks = peaks[np.argsort(-window_counts[is_peak], kind="stable")][:max_peaks]
+    peak_normals = []
+    for i, j in peaks.tolist():
+        in_window = (np.abs(cells[:, 0] - i) <= 1) & (np.abs(cells[:, 1] - j) <= 1)
+        mean_normal = normals[in_window].sum(axis=0)
+        peak_normals.append(mean_normal / np.linalg.norm(mean_normal))
+    return np.array(peak_normals).reshape(-1, 3)
+
+
+def normal_ransac_plane(
+        points: np.ndarray,
+        normals: np.ndarray,
+        distance_threshold: float = 0.2,
+        max_iterations: int = 500,
+        confidence: float = 0.99,
+        angle_threshold: float = 15.0,
+        block_size: int = 8,
+        seed: Union[None, int, np.random.Generator] = None,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Detect the 3D plane supported by the most points with RANSAC guided by the point normals
+
+    The dominant normal directions (see normal_histogram_peaks) fix the orientation of the plane hypotheses, so a
+    hypothesis needs a single sample: a point whose normal lies within angle_threshold (degrees) of a peak
+    direction, through which the plane passes. Points with other normals (e.g. the sides of HVAC units and
+    chimneys) are never sampled, and directions agreeing with fewer points than the best plane so far are skipped.
+    The best hypothesis is refined by a least squares fit to its inliers.
+
+    Returns (plane, inliers, iterations) like ransac_plane. Falls back to ransac_plane when no normal direction
+    has enough support.
+    """
+    n = len(points)
+    if n < 3:
+        raise ValueError(f"Unable to determine plane with RANSAC; {n} points")
+
+    rng = np.random.default_rng(seed)
+    xyz = points[:, :3]
+    peak_normals = normal_histogram_peaks(normals)
+    if len(peak_normals) == 0:
+        return ransac_plane(points, distance_threshold, max_iterations, confidence, seed=rng)
+
+    unit_normals = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), np.finfo(float).tiny)
+    cos_threshold = math.cos(math.radians(angle_threshold))
+
+    # bound the size of the (N, block) distance matrix
+    block_size = max(1, min(block_size, 4_000_000 // n))
+
+    best_plane, best_count, best_sse = None, 0, math.inf
+    iterations = 0
+    for peak_normal in peak_normals:
+        # only points whose normal agrees with the peak direction are sampled; a direction agreeing with fewer
+        # points than the best plane so far has inliers is not tried
+        members = np.flatnonzero(np.abs(unit_normals @ peak_normal) >= cos_threshold)
+        if len(members) == 0 or len(members) <= best_count:
+            continue
+        projections = xyz @ peak_normal
+
+        required = max_iterations
+        peak_iterations = 0
+        while peak_iterations < min(required, max_iterations - iterations):
+            block = min(block_size, max_iterations - iterations - peak_iterations)
+            peak_iterations += block
+
+            # all hypotheses of a peak share the normal, so the distances are differences of projections
+            offsets = projections[members[rng.integers(0, len(members), size=block)]]
+            distances = np.abs(projections[:, np.newaxis] - offsets)
+            is_inlier = distances < distance_threshold
+            counts = np.count_nonzero(is_inlier, axis=0)
+            sse = np.einsum("ij,ij->j", distances * is_inlier, distances)
+
+            k = np.lexsort((sse, -counts))[0]
+            if counts[k] > best_count or (counts[k] == best_count and sse[k] < best_sse):
+                best_plane, best_count, best_sse = np.append(peak_normal, -offsets[k]), counts[k], sse[k]
+            # the chance to sample the offset of this peak's plane depends on the share of members on it
+            member_count = np.count_nonzero(np.abs(projections[members] - offsets[k]) < distance_threshold)
+            required = min(required, ransac_iterations_required(member_count / len(members), confidence, 1))
+        iterations += peak_iterations
+
+    if best_plane is None:
+        return ransac_plane(points, distance_threshold, max_iterations, confidence, seed=rng)
+
+    # refine the orientation by a least squares fit to the inliers, as long as it does not lose support
+    inliers = np.abs(xyz @ best_plane[:3] + best_plane[3]) < distance_threshold
+    for _ in range(3):
+        # relative to the inlier centroid to avoid cancellation in the covariance with large coordinates
+        centroid = xyz[inliers].mean(axis=0)
+        planes, valid = planes_from_moments(
+            *face_moments(xyz[inliers] - centroid, np.zeros(best_count, dtype=np.int64), 1))
+        if not valid[0]:
+            break
+        planes[0, 3] -= planes[0, :3] @ centroid
+        refined_inliers = np.abs(xyz @ planes[0, :3] + planes[0, 3]) < distance_threshold
+        if np.count_nonzero(refined_inliers) < best_count:
+            break
+        best_plane, inliers = planes[0], refined_inliers
+        best_count = np.count_nonzero(inliers)
+
+    plane = standardize_plane_np(np.array(best_plane, dtype=float))
+    return plane, inliers, iterations
@@ -1,5 +1,8 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from matplotlib import path as mpl_polygon
+from typing import Union
+from PIL import Image, ImageDraw
 
 
 def image_to_world(vertices_pixels: np.ndarray, ppm: float, image_shape: tuple[int, int]) -> np.ndarray:
@@ -19,11 +22,489 @@ def image_to_world(vertices_pixels: np.ndarray, ppm: float, image_shape: tuple[i
     return vertices_meters
 
 
-def lasso_points(face_polygon: np.ndarray, point_cloud: np.ndarray) -> np.ndarray:
+def world_to_image(vertices_meters: np.ndarray, ppm: float, image_shape: tuple[int, int]) -> np.ndarray:
+    """
+    Helper function to convert xy world coordinates in the point cloud coordinate system to xy image coordinates in
+    pixels; the inverse of image_to_world
+    """
+    # center of image in subpixels
+    rows, cols = image_shape
+    c_row, c_col = (rows - 1) / 2, (cols - 1) / 2
+
+    # convert from meters to pixels, flip in the y-axis, and then offset by center of image
+    vertices_pixels = vertices_meters * ppm * np.array([1.0, -1.0]) + np.array([c_col, c_row])
+    return vertices_pixels
+
+
+class PointCloud:
+    """
+    Columnar point cloud with xyz coordinates, normals and rgb colors as separate (N, 3) arrays
+
+    Columns keep their native dtypes and may be views into a memory-mapped file, in which case only the columns
+    (and rows) that are accessed get read.
+    """
+
+    def __init__(self, xyz: np.ndarray, normals: np.ndarray = None, colors: np.ndarray = None):
+        self.xyz = xyz
+        self.normals = normals
+        self.colors = colors
+
+    def __len__(self) -> int:
+        return len(self.xyz)
+
+    def select(self, index: np.ndarray) -> "PointCloud":
+        """
+        Copy of the points selected by an index array or boolean mask
+        """
+        return PointCloud(
+            self.xyz[index],
+            None if self.normals is None else self.normals[index],
+            None if self.colors is None else self.colors[index],
+        )
+
+    def to_array(self) -> np.ndarray:
+        """
+        (N, 9) float64 array with columns x, y, z, nx, ny, nz, r, g, b
+        """
+        point_cloud = np.zeros((len(self), 9))
+        point_cloud[:, :3] = self.xyz
+        if self.normals is not None:
+            point_cloud[:, 3:6] = self.normals
+        if self.colors is not None:
+            point_cloud[:, 6:9] = self.colors
+        return point_cloud
+
+
+def point_xyz(point_cloud: Union[np.ndarray, PointCloud]) -> np.ndarray:
+    """
+    (N, 3) xyz coordinates of a point cloud array with columns x, y, z, ... or of a PointCloud
+    """
+    if isinstance(point_cloud, PointCloud):
+        return point_cloud.xyz
+    return point_cloud[:, :3]
+
+
+def point_normals(point_cloud: Union[np.ndarray, PointCloud]) -> Union[None, np.ndarray]:
+    """
+    (N, 3) normals of a point cloud array with columns x, y, z, nx, ny, nz, ... or of a PointCloud (None if absent)
+    """
+    if isinstance(point_cloud, PointCloud):
+        return point_cloud.normals
+    if point_cloud.shape[1] < 6:
+        return None
+    return point_cloud[:, 3:6]
+
+
+def points_in_polygon(points_xy: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """
+    Boolean mask of the 2D points within a 2D polygon (even-odd rule), vectorized over the points
+    """
+    x, y = points_xy[:, 0], points_xy[:, 1]
+    inside = np.zeros(len(points_xy), dtype=bool)
+    for (x_1, y_1), (x_2, y_2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        # a horizontal ray from each point towards +x crosses the edge (x_1, y_1) - (x_2, y_2)
+        spans = np.flatnonzero((y_1 > y) != (y_2 > y))
+        x_cross = x_1 + (y[spans] - y_1) * (x_2 - x_1) / (y_2 - y_1)
+        inside[spans] ^= x[spans] < x_cross
+    return inside
+
+
+def lasso_points(
+        face_polygon: np.ndarray,
+        point_cloud: Union[np.ndarray, PointCloud],
+) -> Union[np.ndarray, PointCloud]:
     """
     Lasso 3D points with a 2D polygon
     """
-    polygon_path = mpl_polygon.Path(vertices=face_polygon)
-    points_mask = polygon_path.contains_points(point_cloud[:, :2], radius=0.0)
+    points_mask = points_in_polygon(point_xyz(point_cloud)[:, :2], face_polygon)
+    if isinstance(point_cloud, PointCloud):
+        return point_cloud.select(points_mask)
     interior_points = point_cloud[points_mask, :]
-    return interior_points
\ No newline at end of file
+    return interior_points
+
+
+class PointGrid:
+    """
+    Uniform 2D grid over the xy coordinates of a point cloud
+
+    Points are bucketed by grid cell once, sorted so that the points of a row of cells are contiguous. The points
+    within any axis-aligned box can then be gathered without scanning the whole point cloud.
+    """
+
+    MAX_CELLS_PER_AXIS = 4096
+
+    def __init__(self, points_xy: np.ndarray, cell_size: float = None, points_per_cell: int = 64):
+        xy = np.asarray(points_xy[:, :2], dtype=float)
+        n = len(xy)
+
+        if n > 0:
+            self.origin = xy.min(axis=0)
+            extent = xy.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+
+        # default cell size targets a fixed average number of points per cell
+        if cell_size is None:
+            area = extent[0] * extent[1]
+            cell_size = math.sqrt(area * points_per_cell / n) if n > 0 and area > 0 else 0.0
+        cell_size = max(cell_size, float(extent.max()) / self.MAX_CELLS_PER_AXIS)
+        if cell_size <= 0:
+            cell_size = 1.0
+        self.cell_size = cell_size
+
+        # (rows, cols) where rows run along y and cols along x
+        cols, rows = (np.floor(extent / cell_size).astype(int) + 1).tolist()
+        self.shape = (rows, cols)
+
+        # sort points by cell id; cell_starts[k]:cell_starts[k + 1] are the sorted positions of the points in cell k
+        cell_ids = self._cell_ids(xy)
+        self.order = np.argsort(cell_ids, kind="stable")
+        self.cell_starts = np.searchsorted(cell_ids[self.order], np.arange(rows * cols + 1))
+
+    def _cell_ids(self, xy: np.ndarray) -> np.ndarray:
+        rows, cols = self.shape
+        col_row = np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+        col = np.clip(col_row[:, 0], 0, cols - 1)
+        row = np.clip(col_row[:, 1], 0, rows - 1)
+        return row * cols + col
+
+    def query_bbox(self, xy_min: np.ndarray, xy_max: np.ndarray) -> np.ndarray:
+        """
+        Indices of the points in all grid cells overlapping the box [xy_min, xy_max]
+
+        The result is a superset of the points strictly within the box; callers apply an exact test afterward.
+        """
+        rows, cols = self.shape
+        lo = np.floor((np.asarray(xy_min, dtype=float) - self.origin) / self.cell_size).astype(int)
+        hi = np.floor((np.asarray(xy_max, dtype=float) - self.origin) / self.cell_size).astype(int)
+        col_0, row_0 = max(lo[0], 0), max(lo[1], 0)
+        col_1, row_1 = min(hi[0], cols - 1), min(hi[1], rows - 1)
+        if col_0 > col_1 or row_0 > row_1:
+            return np.empty(0, dtype=np.int64)
+
+        # the cells col_0..col_1 of a single row are contiguous in the sorted order
+        row_ids = np.arange(row_0, row_1 + 1) * cols
+        starts = self.cell_starts[row_ids + col_0]
+        stops = self.cell_starts[row_ids + col_1 + 1]
+        return np.concatenate([self.order[start:stop] for start, stop in zip(starts, stops)])
+
+
+def face_index_slices(labels: np.ndarray, n_faces: int) -> list[np.ndarray]:
+    """
+    Per-face point indices from a face label array (label -1 means unassigned)
+
+    The returned index arrays are slices of a single sorted index array and list point indices in ascending order.
+    """
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels[labels >= 0], minlength=n_faces)
+    offsets = np.count_nonzero(labels < 0) + np.concatenate(([0], np.cumsum(counts)))
+    return [order[offsets[i]:offsets[i + 1]] for i in range(n_faces)]
+
+
+def assign_points_to_faces(
+        point_cloud: Union[np.ndarray, PointCloud],
+        face_polygons: list[np.ndarray],
+        grid: PointGrid = None,
+        workers: int = None,
+) -> tuple[np.ndarray, list[np.ndarray]]:
+    """
+    Lasso 3D points with every 2D face polygon in a single pass over a grid index of the point cloud
+
+    Returns (labels, face_indices) where labels[i] is the index of the face containing point i (or -1) and
+    face_indices[f] are the indices of the points within face f. A point within overlapping faces is assigned to the
+    lowest face index. With workers > 1 the polygons are tested concurrently on a thread pool; the labels are the
+    same as with a serial run.
+    """
+    xy = point_xyz(point_cloud)[:, :2]
+    if grid is None:
+        grid = PointGrid(xy)
+
+    labels = np.full(len(xy), -1, dtype=np.int64)
+    if workers is not None and workers > 1:
+        def lasso_face(face_polygon: np.ndarray) -> np.ndarray:
+            candidates = grid.query_bbox(face_polygon.min(axis=0), face_polygon.max(axis=0))
+            return candidates[points_in_polygon(xy[candidates], face_polygon)]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            face_points = list(executor.map(lasso_face, face_polygons))
+
+        # merge in face order so that the lowest face index wins, as in the serial loop
+        for i, points_idx in enumerate(face_points):
+            labels[points_idx[labels[points_idx] < 0]] = i
+        return labels, face_index_slices(labels, len(face_polygons))
+
+    for i, face_polygon in enumerate(face_polygons):
+        # only test points in grid cells overlapping the polygon bounding box that are not yet assigned
+        candidates = grid.query_bbox(face_polygon.min(axis=0), face_polygon.max(axis=0))
+        candidates = candidates[labels[candidates] < 0]
+        if len(candidates) == 0:
+            continue
+
+        points_mask = points_in_polygon(xy[candidates], face_polygon)
+        labels[candidates[points_mask]] = i
+
+    return labels, face_index_slices(labels, len(face_polygons))
+
+
+def _edge_cells(uv_1: np.ndarray, uv_2: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (rows, cols) of every raster cell a segment passes through (a supercover), from its end points in cell units
+
+    Cell (row, col) covers u in [col, col + 1) and v in [row, row + 1). A segment enters a cell across one of its grid
+    lines, so the cells on both sides of every grid line crossing, plus the cells of the end points, cover it; a
+    crossing within rounding of a cell corner marks the cells on both sides of that corner too.
+    """
+    cells = [np.floor(np.array([uv_1, uv_2])).astype(np.int64)]
+    for axis in (0, 1):
+        other = 1 - axis
+        lo, hi = sorted((uv_1[axis], uv_2[axis]))
+        crossings = np.arange(np.ceil(lo), np.floor(hi) + 1.0)
+        if len(crossings) == 0 or hi == lo:
+            continue
+        t = (crossings - uv_1[axis]) / (uv_2[axis] - uv_1[axis])
+        at = uv_1[other] + t * (uv_2[other] - uv_1[other])
+        for line_side in (-1, 0):
+            for rounding in (-1e-9, 1e-9):
+                crossing_cells = np.empty((len(crossings), 2), dtype=np.int64)
+                crossing_cells[:, axis] = crossings.astype(np.int64) + line_side
+                crossing_cells[:, other] = np.floor(at + rounding).astype(np.int64)
+                cells.append(crossing_cells)
+    cells = np.concatenate(cells)
+    return cells[:, 1], cells[:, 0]
+
+
+def rasterize_faces(
+        face_polygons: list[np.ndarray],
+        xy_origin: np.ndarray,
+        shape: tuple[int, int],
+        cells_per_meter: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rasterize 2D face polygons into an integer label image and a boundary mask
+
+    Raster cell (row, col) covers world x in xy_origin[0] + [col, col + 1) / cells_per_meter and likewise y with row.
+    Returns (label_image, boundary_mask) where label_image holds face index + 1 (0 is background) and boundary_mask
+    marks every cell a polygon edge passes through and its 8 neighbors. Cells not on a boundary lie entirely within
+    or outside each face, and their label is exact.
+    """
+    rows, cols = shape
+    p_labels = Image.new("I", (cols, rows), 0)
+    labels_pencil = ImageDraw.Draw(p_labels)
+    boundary_mask = np.zeros((rows, cols), dtype=bool)
+
+    # draw in reverse so that the lowest face index wins where faces overlap
+    for i in reversed(range(len(face_polygons))):
+        uv = (face_polygons[i] - xy_origin) * cells_per_meter
+        # Pillow pixel centers are at integer coordinates
+        labels_pencil.polygon(xy=[tuple(xy) for xy in (uv - 0.5).tolist()], fill=i + 1)
+
+        # mark every cell an edge passes through; drawn lines miss some cells of edges that are not axis-aligned
+        for uv_1, uv_2 in zip(uv, np.roll(uv, -1, axis=0)):
+            edge_rows, edge_cols = _edge_cells(uv_1, uv_2)
+            in_raster = (edge_rows >= 0) & (edge_rows < rows) & (edge_cols >= 0) & (edge_cols < cols)
+            boundary_mask[edge_rows[in_raster], edge_cols[in_raster]] = True
+
+    # Pillow fills cells up to a cell outside a polygon; grow the mask by a cell to cover them
+    grown = boundary_mask.copy()
+    grown[1:, :] |= boundary_mask[:-1, :]
+    grown[:-1, :] |= boundary_mask[1:, :]
+    boundary_mask = grown.copy()
+    boundary_mask[:, 1:] |= grown[:, :-1]
+    boundary_mask[:, :-1] |= grown[:, 1:]
+
+    label_image = np.array(p_labels, dtype=np.int64)
+
+    # cleanup
+    p_labels.close()
+
+    return label_image, boundary_mask
+
+
+def assign_points_to_faces_raster(
+        point_cloud: Union[np.ndarray, PointCloud],
+        face_polygons: list[np.ndarray],
+        ppm: float,
+        supersample: int = 1,
+) -> tuple[np.ndarray, list[np.ndarray]]:
+    """
+    Lasso 3D points with every 2D face polygon by rasterizing the polygons into one label image
+
+    The label image has the resolution of the ortho image (ppm pixels-per-meter) times supersample. Points are
+    labeled by a vectorized lookup of their raster cell; only points in cells crossed by a polygon edge get an
+    exact point-in-polygon test. Returns (labels, face_indices) with the same meaning as assign_points_to_faces.
+    """
+    xy = point_xyz(point_cloud)[:, :2]
+    labels = np.full(len(xy), -1, dtype=np.int64)
+    if len(face_polygons) == 0:
+        return labels, []
+
+    # raster covers the bounding box of all faces with a margin of a couple of cells
+    cells_per_meter = ppm * supersample
+    all_vertices = np.concatenate(face_polygons)
+    xy_origin = all_vertices.min(axis=0) - 2.0 / cells_per_meter
+    cols, rows = (np.ceil((all_vertices.max(axis=0) - xy_origin) * cells_per_meter).astype(int) + 2).tolist()
+    label_image, boundary_mask = rasterize_faces(face_polygons, xy_origin, (rows, cols), cells_per_meter)
+
+    # gather the raster cell of each point within the raster
+    col_row = np.floor((xy - xy_origin) * cells_per_meter).astype(np.int64)
+    col, row = col_row[:, 0], col_row[:, 1]
+    in_raster = np.flatnonzero((col >= 0) & (col < cols) & (row >= 0) & (row < rows))
+    col, row = col[in_raster], row[in_raster]
+    labels[in_raster] = label_image[row, col] - 1
+
+    # exact polygon test only for points in boundary cells
+    on_boundary = in_raster[boundary_mask[row, col]]
+    if len(on_boundary) > 0:
+        labels[on_boundary], _ = assign_points_to_faces(xy[on_boundary, :], face_polygons)
+
+    return labels, face_index_slices(labels, len(face_polygons))
+
+
+def _group_keys(keys: np.ndarray, n_keys: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (unique keys, inverse) of integer keys in [0, n_keys); counted in O(N + n_keys) without a sort when n_keys is not
+    much larger than the number of keys
+    """
+    if n_keys > 4 * len(keys) + (1 << 20):
+        return np.unique(keys, return_inverse=True)
+    occupied = np.bincount(keys, minlength=n_keys) > 0
+    return np.flatnonzero(occupied), (np.cumsum(occupied) - 1)[keys]
+
+
+def voxel_downsample(
+        point_cloud: Union[np.ndarray, PointCloud],
+        labels: np.ndarray,
+        voxel_size: float = None,
+        max_points_per_face: int = None,
+) -> tuple[Union[np.ndarray, PointCloud], np.ndarray]:
+    """
+    Downsample the face points of a labeled point cloud to the means of their points in each voxel
+
+    Voxels are cubes of voxel_size meters per face, so a voxel never mixes faces; without voxel_size points are kept
+    as they are. Faces with more than max_points_per_face points (or voxels) get coarser voxels until they are
+    within the budget. Points of no face (label -1) are dropped.
+
+    Every voxel is keyed by a single integer (the mixed-radix index of its cell within the bounding box of its face,
+    offset by the cells of the faces before it), and keys are grouped by counting rather than sorting. Only the faces
+    over budget are re-keyed while their voxels are coarsened. xyz, normals and colors are averaged per voxel by
+    bincount, and mean normals are re-normalized.
+
+    Downsampling costs a few passes over the points, about as much as a least squares fit of them, so it pays off
+    for fits whose cost grows faster with the points of a face (RANSAC with many iterations, IRLS) on faces with
+    far more points than the budget; it does not speed up least squares.
+
+    Returns (point_cloud, labels): the voxel points, of the type of the input point cloud, grouped by face in face
+    order, and their face labels.
+    """
+    if voxel_size is not None and not voxel_size > 0:
+        raise ValueError(f"voxel_size must be positive, not {voxel_size}")
+    if max_points_per_face is not None and max_points_per_face < 1:
+        raise ValueError(f"max_points_per_face must be at least 1, not {max_points_per_face}")
+
+    # the face points sorted by face, so that every face is a contiguous segment
+    labels = np.asarray(labels)
+    point_idx = np.flatnonzero(labels >= 0)
+    face = labels[point_idx].astype(np.int64)
+    n_faces = int(face.max()) + 1 if len(face) else 0
+    # a stable sort of 16 bit integers is a radix sort
+    point_idx = point_idx[np.argsort(face.astype(np.int16) if n_faces <= np.iinfo(np.int16).max else face,
+                                     kind="stable")]
+    face = labels[point_idx].astype(np.int64)
+    xyz = np.asarray(point_xyz(point_cloud)[point_idx], dtype=float)
+    counts = np.bincount(face, minlength=n_faces)
+    starts = np.cumsum(counts) - counts
+
+    # per-face bounding boxes
+    nonempty = counts > 0
+    lo, hi = np.zeros((n_faces, 3)), np.zeros((n_faces, 3))
+    if len(face):
+        lo[nonempty] = np.minimum.reduceat(xyz, starts[nonempty])
+        hi[nonempty] = np.maximum.reduceat(xyz, starts[nonempty])
+    extent = hi - lo
+
+    sizes = np.full(n_faces, 0.0 if voxel_size is None else float(voxel_size))
+    active = np.empty(0, dtype=np.int64)
+    if max_points_per_face is not None:
+        # start over-budget faces at the voxel size that spreads the budget over the xy extent of the face
+        active = np.flatnonzero(counts > max_points_per_face)
+        xy_area = np.maximum(extent[active, 0], 1e-6) * np.maximum(extent[active, 1], 1e-6)
+        sizes[active] = np.maximum(sizes[active], np.sqrt(xy_area / max_points_per_face))
+
+    def face_keys(face_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (point positions, keys within their face, cells per face) of the points of the faces, with per-face values
+        # repeated over their contiguous segments; faces without voxels keep every point: one cell per point
+        n = counts[face_ids]
+        positions = np.arange(n.sum()) + np.repeat(starts[face_ids] - (np.cumsum(n) - n), n)
+        gridded = sizes[face_ids] > 0
+        shape = np.column_stack((n, np.ones((len(face_ids), 2), dtype=np.int64)))
+        shape[gridded] = np.floor(extent[face_ids[gridded]] / sizes[face_ids[gridded], np.newaxis]).astype(np.int64) + 1
+
+        inverse_sizes = np.divide(1.0, sizes[face_ids], out=np.zeros(len(face_ids)), where=gridded)
+        face_xyz = xyz if len(positions) == len(xyz) else xyz[positions]  # all faces are in face order
+        cells = (face_xyz - np.repeat(lo[face_ids], n, axis=0)) * np.repeat(inverse_sizes, n)[:, np.newaxis]
+        cells = np.minimum(cells.astype(np.int64), np.repeat(shape - 1, n, axis=0))  # non-negative: truncation floors
+        if not np.all(gridded):
+            rank = np.arange(len(positions)) - np.repeat(np.cumsum(n) - n, n)
+            cells[:, 0] += np.where(np.repeat(gridded, n), 0, rank)
+
+        strides = np.column_stack((np.ones(len(face_ids), dtype=np.int64), shape[:, 0], shape[:, 0] * shape[:, 1]))
+        return positions, np.einsum("ij,ij->i", cells, np.repeat(strides, n, axis=0)), np.prod(shape, axis=1)
+
+    def group(positions: np.ndarray, keys: np.ndarray, n_cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # unique keys and inverse of the points' keys offset by the cells of the faces before theirs (n_cells by face)
+        offsets = np.cumsum(n_cells) - n_cells
+        return _group_keys(offsets[face[positions]] + keys, int(n_cells.sum()))
+
+    # coarsen the voxels of the faces over budget; the keys of the faces within budget are kept for the end
+    n_cells = np.zeros(n_faces, dtype=np.int64)
+    remaining = np.ones(n_faces, dtype=bool)
+    parts = []
+    while len(active):
+        positions, keys, n_cells[active] = face_keys(active)
+        active_cells = np.zeros(n_faces, dtype=np.int64)
+        active_cells[active] = n_cells[active]
+        unique_keys, _ = group(positions, keys, active_cells)
+        voxel_counts = np.bincount(np.searchsorted(np.cumsum(active_cells), unique_keys, side="right"),
+                                   minlength=n_faces)[active]
+        over = voxel_counts > max_points_per_face
+        within = ~np.repeat(over, counts[active])
+        parts.append((positions[within], keys[within]))
+        remaining[active[~over]] = False
+        # voxel counts of a surface shrink with the square of the voxel size; aim a little under the budget
+        sizes[active[over]] *= 1.1 * np.sqrt(voxel_counts[over] / max_points_per_face)
+        active = active[over]
+
+    positions, keys, n_cells[remaining] = face_keys(np.flatnonzero(remaining))
+    positions = np.concatenate([positions] + [part[0] for part in parts])
+    keys = np.concatenate([keys] + [part[1] for part in parts])
+    unique_keys, inverse = group(positions, keys, n_cells)
+    n_voxels = len(unique_keys)
+    voxel_of = np.empty(len(face), dtype=np.int64)  # voxel of each face point, in face order
+    voxel_of[positions] = inverse
+    points_per_voxel = np.bincount(voxel_of, minlength=n_voxels)
+    voxel_labels = np.searchsorted(np.cumsum(n_cells), unique_keys, side="right").astype(labels.dtype)
+
+    def voxel_means(values: np.ndarray) -> np.ndarray:
+        # (N, k) values of the face points in face order; (0, k) without face points
+        return np.column_stack([np.bincount(voxel_of, weights=values[:, j], minlength=n_voxels)
+                                for j in range(values.shape[1])]) / points_per_voxel[:, np.newaxis]
+
+    def unit(normals: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(normals, axis=1, keepdims=True)
+        return np.divide(normals, norms, out=np.zeros_like(normals), where=norms > 0)
+
+    if isinstance(point_cloud, PointCloud):
+        normals, colors = point_cloud.normals, point_cloud.colors
+        return PointCloud(
+            voxel_means(xyz).astype(point_cloud.xyz.dtype),
+            None if normals is None else unit(voxel_means(np.asarray(normals[point_idx], dtype=float))).astype(
+                normals.dtype),
+            None if colors is None else np.round(voxel_means(np.asarray(colors[point_idx], dtype=float))).astype(
+                colors.dtype),
+        ), voxel_labels
+
+    voxel_points = voxel_means(np.asarray(point_cloud[point_idx], dtype=float)).astype(point_cloud.dtype)
+    if voxel_points.shape[1] >= 6:
+        voxel_points[:, 3:6] = unit(voxel_points[:, 3:6])
+    return voxel_points, voxel_labels
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+from file_utils import face_polygons_key
+from point_cloud_utils import PointCloud, point_xyz
+
+
+##############################
+# Content-addressed cache of roof plane fits. A result is keyed by hashes of the point cloud xyz, the face polygon
+# vertices and the fit settings, so an unchanged building is recognized whatever its file names or modification
+# times. Results are kept as small JSON files in a directory bounded to about max_bytes, evicting the least recently
+# used files first, and optionally in a per-process in-memory LRU.
+##############################
+
+
+def point_cloud_key(point_cloud: Union[np.ndarray, PointCloud]) -> str:
+    """
+    Hash of the xyz coordinates of a point cloud
+    """
+    xyz = point_xyz(point_cloud)
+    sha256 = hashlib.sha256(f"{xyz.dtype.str}{xyz.shape}".encode())
+    # hash in blocks of rows so that a memory-mapped point cloud is not copied as a whole
+    for start in range(0, len(xyz), 1 << 20):
+        sha256.update(np.ascontiguousarray(xyz[start:start + (1 << 20)]).tobytes())
+    return sha256.hexdigest()
+
+
+def result_key(point_cloud: Union[np.ndarray, PointCloud], face_polygons: list[np.ndarray], **settings) -> str:
+    """
+    Cache key of a fit of the faces of a point cloud with the given settings (e.g. algorithm, seed)
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(point_cloud_key(point_cloud).encode())
+    sha256.update(face_polygons_key(face_polygons).encode())
+    sha256.update(json.dumps(settings, sort_keys=True).encode())
+    return sha256.hexdigest()
+
+
+class ResultCache:
+    """
+    Least recently used cache of roof plane fits on disk and, with memory_items > 0, in memory
+
+    directory None keeps results in memory only (unbounded unless memory_items > 0). Reading a result from disk
+    refreshes its modification time, which orders the files for eviction. The total size of the files is tracked as
+    results are put and re-measured by listing the directory every rescan_puts puts (files of other processes sharing
+    the directory are only seen then); once it exceeds max_bytes by eviction_margin, the least recently used files
+    are deleted down to max_bytes, so the directory is listed once per eviction_margin * max_bytes written rather
+    than on every put.
+    """
+
+    eviction_margin = 0.1
+    rescan_puts = 256
+
+    def __init__(self, directory: Path = None, max_bytes: int = 64 * 1024 * 1024, memory_items: int = 0):
+        self.directory = None if directory is None else Path(directory)
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.total_bytes = None  # unknown until the directory is listed
+        self.puts_since_scan = 0
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> list[tuple[float, float, float, float]]:
+        """
+        Cached planes of a key, or None
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return list(self.memory[key])
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key), "r") as fp:
+                planes = [tuple(plane) for plane in json.load(fp)["planes"]]
+            os.utime(self._path(key))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        self._remember(key, planes)
+        return planes
+
+    def put(self, key: str, planes: list[tuple[float, float, float, float]]):
+        planes = [tuple(plane) for plane in planes]
+        self._remember(key, planes)
+        if self.directory is None:
+            return
+
+        # write atomically so that concurrent readers never see a partial file
+        tmp_path = self.directory / f".{key}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump({"planes": planes}, fp)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, self._path(key))
+
+        # a replaced file is counted twice until the next scan, which only evicts sooner
+        self.puts_since_scan += 1
+        if self.total_bytes is not None:
+            self.total_bytes += size
+        if (self.total_bytes is None or self.puts_since_scan >= self.rescan_puts
+                or self.total_bytes > (1.0 + self.eviction_margin) * self.max_bytes):
+            self.evict()
+
+    def _remember(self, key: str, planes: list[tuple[float, float, float, float]]):
+        if self.memory_items <= 0 and self.directory is not None:
+            return
+        self.memory[key] = planes
+        self.memory.move_to_end(key)
+        while self.memory_items > 0 and len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        """
+        Delete the least recently used result files until their total size is at most max_bytes
+
+        Lists the whole directory and resets the running total size of the files.
+        """
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+        self.total_bytes = total_bytes
+        self.puts_since_scan = 0
@@ -0,0 +1,198 @@
+import numpy as np
+from typing import Union
+
+from planar_regression import face_moments, planes_from_moments, standardize_planes_np
+
+
+##############################
+# 3D roof geometry from the fitted face planes. Every roof vertex is shared by the faces whose polygons list it, so
+# lifting each vertex onto (the intersection of) its faces' planes gives a watertight 3D roof model.
+##############################
+
+
+def vertex_face_incidence(faces: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vertex-face incidence of the face polygons as (vertex_ids, face_ids) pairs; a vertex listed more than once by
+    the same face is paired once
+    """
+    face_ids = np.repeat(np.arange(len(faces)), [len(face) for face in faces])
+    vertex_ids = np.concatenate([np.asarray(face, dtype=np.int64) for face in faces]) if faces else \
+        np.empty(0, dtype=np.int64)
+    pairs = np.unique(np.column_stack((vertex_ids, face_ids)), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def solve_vertices_3d(
+        vertices: np.ndarray,
+        faces: list[list[int]],
+        planes: Union[np.ndarray, list[tuple[float, float, float, float]]],
+        xy_weight: float = 0.1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    3D roof vertices at the least squares intersection of the planes of the faces incident to each vertex
+
+    Each vertex p minimizes sum_k (n_k . p + d_k)^2 over its incident face planes (n_k, d_k), plus
+    xy_weight^2 * |p_xy - vertex_xy|^2, which keeps the 2D vertex position where the planes do not determine it
+    (e.g. an eave corner on a single face, or nearly parallel planes). All vertices are solved at once as a stack of
+    3 x 3 normal equations accumulated over the vertex-face incidence.
+
+    Returns (vertices_3d, residuals): the (V, 3) vertices and the root mean square distance of each vertex to its
+    incident planes. Vertices of no face keep their xy with z and residual NaN.
+    """
+    if xy_weight <= 0:
+        raise ValueError("xy_weight must be positive; vertices on fewer than 3 faces are otherwise undetermined")
+    vertices = np.asarray(vertices, dtype=float)
+    planes = np.asarray(planes, dtype=float).reshape(-1, 4)
+    n_vertices = len(vertices)
+    vertex_ids, face_ids = vertex_face_incidence(faces)
+    normals, offsets = planes[face_ids, :3], planes[face_ids, 3]
+
+    # normal equations A p = b with A = sum n n^T + w^2 diag(1, 1, 0) and b = sum -d n + w^2 (x, y, 0)
+    lhs = np.zeros((n_vertices, 3, 3))
+    rhs = np.zeros((n_vertices, 3))
+    for j in range(3):
+        rhs[:, j] = np.bincount(vertex_ids, weights=-offsets * normals[:, j], minlength=n_vertices)
+        for k in range(j, 3):
+            lhs[:, j, k] = lhs[:, k, j] = np.bincount(vertex_ids, weights=normals[:, j] * normals[:, k],
+                                                      minlength=n_vertices)
+    lhs[:, [0, 1], [0, 1]] += xy_weight ** 2
+    rhs[:, :2] += xy_weight ** 2 * vertices[:, :2]
+
+    incident_count = np.bincount(vertex_ids, minlength=n_vertices)
+    solvable = incident_count > 0
+    vertices_3d = np.column_stack((vertices[:, :2], np.full(n_vertices, np.nan)))
+    vertices_3d[solvable] = np.linalg.solve(lhs[solvable], rhs[solvable, :, np.newaxis])[:, :, 0]
+
+    distances = np.einsum("ij,ij->i", normals, vertices_3d[vertex_ids]) + offsets
+    residuals = np.sqrt(np.bincount(vertex_ids, weights=np.square(distances), minlength=n_vertices) /
+                        np.maximum(incident_count, 1))
+    residuals[~solvable] = np.nan
+    return vertices_3d, residuals
+
+
+def shared_face_edges(faces: list[list[int]], edges: np.ndarray = None) -> np.ndarray:
+    """
+    Polygon edges shared by two faces as a (S, 4) array of (vertex_1, vertex_2, face_1, face_2)
+
+    An edge shared by more than two faces yields a row per pair of faces. With edges (e.g. from metadata.json), only
+    the listed edges are returned.
+    """
+    outline = [(min(v_1, v_2), max(v_1, v_2), f) for f, face in enumerate(faces)
+               for v_1, v_2 in zip(face, face[1:] + face[:1]) if v_1 != v_2]
+    outline = np.unique(np.array(outline, dtype=np.int64).reshape(-1, 3), axis=0)
+
+    # rows of the same edge are adjacent after sorting; pair every face of an edge with the faces that follow it
+    shared = []
+    for offset in range(1, len(outline)):
+        same_edge = np.all(outline[offset:, :2] == outline[:-offset, :2], axis=1)
+        if not np.any(same_edge):
+            break
+        first, second = outline[:-offset][same_edge], outline[offset:][same_edge]
+        shared.append(np.column_stack((first[:, :2], first[:, 2], second[:, 2])))
+    shared = np.concatenate(shared) if shared else np.empty((0, 4), dtype=np.int64)
+
+    if edges is not None and len(shared) > 0:
+        listed = {(min(v_1, v_2), max(v_1, v_2)) for v_1, v_2 in np.asarray(edges).tolist()}
+        shared = shared[[(v_1, v_2) in listed for v_1, v_2 in shared[:, :2].tolist()]]
+    return shared[np.lexsort((shared[:, 3], shared[:, 2], shared[:, 1], shared[:, 0]))]
+
+
+def fit_planes_jointly(
+        points: np.ndarray,
+        labels: np.ndarray,
+        vertices: np.ndarray,
+        faces: list[list[int]],
+        edges: np.ndarray = None,
+        edge_weight: float = 1.0,
+        max_step: float = 0.2,
+        tolerance: float = 1e-10,
+        max_iterations: int = 1000,
+) -> tuple[np.ndarray, int]:
+    """
+    Fit the planes of all faces together so that the planes of faces sharing an edge meet along it
+
+    Each face's plane is parameterized as z = alpha * x + beta * y + gamma. The objective sums the mean squared
+    vertical residual of every face's points (from its face_moments) and, for both end vertices of every shared
+    edge (see shared_face_edges), edge_weight times the squared height difference of the two faces' planes at the
+    vertex. Edges where the independent least squares planes differ in height by more than max_step meters are
+    steps between roof levels and are not constrained.
+
+    The normal equations form one sparse, block-structured linear system over all faces with a 3 x 3 block per face
+    and per pair of faces sharing an edge. It is solved by conjugate gradients with a block Jacobi preconditioner
+    and warm-started from the independent least squares planes (planar_regression_lstsq_batched), so each iteration
+    costs O(faces + shared edges).
+
+    Returns (planes, iterations): the (F, 4) standardized planes and the number of conjugate gradient iterations.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    n_faces = len(faces)
+
+    # coordinates relative to the roof center keep the normal equations well conditioned
+    origin = np.append(vertices.mean(axis=0), 0.0) if len(vertices) else np.zeros(3)
+    local_vertices = vertices - origin[:2]
+    counts, sums, outer_sums = face_moments(points[:, :3] - origin, labels, n_faces)
+
+    # warm start from the independent planes; vertical planes have no z = alpha * x + beta * y + gamma form
+    planes, valid = planes_from_moments(counts, sums, outer_sums)
+    warm = valid & (planes[:, 2] > 0)
+    theta = np.zeros((n_faces, 3))
+    theta[warm] = -planes[warm][:, [0, 1, 3]] / planes[warm][:, [2]]
+
+    # data term: mean squared vertical residual of each face, theta^T H theta - 2 g^T theta + const
+    n = np.maximum(counts, 1.0)[:, np.newaxis]
+    hessians = np.empty((n_faces, 3, 3))
+    hessians[:, :2, :2] = outer_sums[:, :2, :2]
+    hessians[:, :2, 2] = hessians[:, 2, :2] = sums[:, :2]
+    hessians[:, 2, 2] = counts
+    hessians /= n[:, :, np.newaxis]
+    gradients = np.column_stack((outer_sums[:, :2, 2], sums[:, 2])) / n
+    # a small ridge keeps faces without points or constraints determined
+    hessians[:, [0, 1, 2], [0, 1, 2]] += 1e-9
+
+    # constraint rows: height of face f minus height of face g at an end vertex of a shared edge
+    shared = shared_face_edges(faces, edges)
+    rows = np.column_stack((local_vertices[shared[:, :2].ravel()], np.ones(2 * len(shared))))
+    face_f, face_g = np.repeat(shared[:, 2], 2), np.repeat(shared[:, 3], 2)
+    steps = np.abs(np.einsum("kj,kj->k", rows, theta[face_f] - theta[face_g]))
+    step_edges = np.repeat((steps.reshape(-1, 2) > max_step).any(axis=1), 2)
+    rows, face_f, face_g = rows[~step_edges], face_f[~step_edges], face_g[~step_edges]
+
+    def scatter(values: np.ndarray, face_ids: np.ndarray) -> np.ndarray:
+        return np.column_stack([np.bincount(face_ids, weights=values[:, j], minlength=n_faces) for j in range(3)])
+
+    def matvec(x: np.ndarray) -> np.ndarray:
+        product = np.einsum("fij,fj->fi", hessians, x)
+        differences = edge_weight * np.einsum("kj,kj->k", rows, x[face_f] - x[face_g])[:, np.newaxis] * rows
+        return product + scatter(differences, face_f) - scatter(differences, face_g)
+
+    # block Jacobi preconditioner: the 3 x 3 diagonal block of every face
+    row_outer = edge_weight * rows[:, :, np.newaxis] * rows[:, np.newaxis, :]
+    diagonal_blocks = hessians.copy()
+    for face_ids in (face_f, face_g):
+        for j in range(3):
+            for k in range(3):
+                diagonal_blocks[:, j, k] += np.bincount(face_ids, weights=row_outer[:, j, k], minlength=n_faces)
+    inverse_blocks = np.linalg.inv(diagonal_blocks)
+
+    # preconditioned conjugate gradients
+    residual = gradients - matvec(theta)
+    z = np.einsum("fij,fj->fi", inverse_blocks, residual)
+    direction = z.copy()
+    rz = np.vdot(residual, z)
+    threshold = tolerance * max(np.vdot(gradients, gradients), np.finfo(float).tiny)
+    iterations = 0
+    while iterations < max_iterations and np.vdot(residual, residual) > threshold:
+        iterations += 1
+        product = matvec(direction)
+        step = rz / np.vdot(direction, product)
+        theta += step * direction
+        residual -= step * product
+        z = np.einsum("fij,fj->fi", inverse_blocks, residual)
+        rz, rz_previous = np.vdot(residual, z), rz
+        direction = z + (rz / rz_previous) * direction
+
+    # z = alpha x + beta y + gamma relative to the origin -> standardized (a, b, c, d) in world coordinates
+    alpha, beta, gamma = theta.T
+    planes = np.column_stack((-alpha, -beta, np.ones(n_faces), -gamma))
+    planes[:, 3] -= planes[:, :3] @ origin
+    return standardize_planes_np(planes), iterations
@@ -0,0 +1,310 @@
+import shutil
+import tempfile
+import numpy as np
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, Union
+
+from roof_geometry import solve_vertices_3d
+
+
+##############################
+# Triangle meshes of fitted roof models. Each face polygon is triangulated in 2D (fans for convex faces, all at
+# once; ear clipping for concave faces) and its corners are lifted onto the face's plane. Meshes of many buildings
+# are streamed into a single binary PLY or OBJ file with buffered bulk writes of the NumPy arrays.
+##############################
+
+
+BUFFER_SIZE = 1 << 20
+
+# binary PLY triangle record: vertex_indices (list uchar int), building and face index
+PLY_FACE_DTYPE = np.dtype([("count", "u1"), ("vertex_indices", "<i4", (3,)), ("building", "<i4"), ("face", "<i4")])
+
+
+def _cross_2d(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def ear_clip(polygon: np.ndarray) -> np.ndarray:
+    """
+    Triangulate a simple 2D polygon by ear clipping; returns (n - 2, 3) counter-clockwise triangles of polygon
+    vertex indices
+    """
+    polygon = np.asarray(polygon, dtype=float)[:, :2]
+    polygon = polygon - polygon.mean(axis=0)
+    idx = np.arange(len(polygon))
+    if _cross_2d(polygon, np.roll(polygon, -1, axis=0)).sum() < 0:
+        idx = idx[::-1]
+    eps = 1e-12 * max(1.0, np.square(polygon).sum(axis=1).max(initial=0.0))
+
+    triangles = []
+    while len(idx) > 3:
+        p = polygon[idx]
+        prev, next_ = np.roll(p, 1, axis=0), np.roll(p, -1, axis=0)
+        turn = _cross_2d(p - prev, next_ - p)
+        reflex = np.flatnonzero(turn <= eps)
+
+        # an ear is a convex corner whose triangle contains no reflex vertex (other than its own corners)
+        candidates = np.flatnonzero(turn > eps)
+        a, b, c = prev[candidates, None], p[candidates, None], next_[candidates, None]
+        q = p[None, reflex]
+        inside = (_cross_2d(b - a, q - a) >= -eps) & (_cross_2d(c - b, q - b) >= -eps) & \
+                 (_cross_2d(a - c, q - c) >= -eps)
+        n = len(idx)
+        own = (reflex[None, :] == (candidates[:, None] - 1) % n) | (reflex[None, :] == (candidates[:, None] + 1) % n)
+        ears = candidates[~np.any(inside & ~own, axis=1)]
+        # a degenerate polygon (e.g. collinear or self-touching) may have no ear; clip its flattest corner
+        k = ears[0] if len(ears) else int(np.argmax(turn))
+
+        triangles.append((idx[k - 1], idx[k], idx[(k + 1) % n]))
+        idx = np.delete(idx, k)
+    triangles.append(tuple(idx))
+    return np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+
+def triangulate_faces(vertices: np.ndarray, faces: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Triangulate the 2D face polygons with counter-clockwise triangles
+
+    Convex faces are triangulated as fans from their first vertex in one vectorized pass; concave faces by ear
+    clipping. Faces with fewer than 3 vertices get no triangles.
+
+    Returns (corners, triangle_faces): the (T, 3) triangle corners as indices into the concatenated face vertex
+    lists (so np.concatenate(faces)[corners] are vertex indices) and the face of each triangle, in face order.
+    """
+    sizes = np.array([len(face) for face in faces], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    if offsets[-1] == 0:
+        return np.empty((0, 3), dtype=np.int64), np.empty(0, dtype=np.int64)
+    xy = np.asarray(vertices, dtype=float)[np.concatenate(faces).astype(np.int64), :2]
+    xy = xy - xy.mean(axis=0)
+
+    # orientation (signed area) and reflex corners of every face from its consecutive edges
+    face_of = np.repeat(np.arange(len(faces)), sizes)
+    position = np.arange(len(xy)) - offsets[face_of]
+    next_ = offsets[face_of] + (position + 1) % sizes[face_of]
+    prev = offsets[face_of] + (position - 1) % sizes[face_of]
+    orientation = np.sign(np.bincount(face_of, weights=_cross_2d(xy, xy[next_]), minlength=len(faces)))
+    orientation[orientation == 0] = 1.0
+    turn = _cross_2d(xy - xy[prev], xy[next_] - xy) * orientation[face_of]
+    eps = 1e-12 * max(1.0, np.square(xy).sum(axis=1).max())
+    convex = np.bincount(face_of, weights=turn < -eps, minlength=len(faces)) == 0
+    convex &= sizes >= 3
+
+    # fans of the convex faces: (0, i, i + 1) for i in 1 .. n - 2, reversed for clockwise faces
+    fan_faces = np.flatnonzero(convex)
+    fan_counts = sizes[fan_faces] - 2
+    triangle_faces = [np.repeat(fan_faces, fan_counts)]
+    i = np.arange(fan_counts.sum()) - np.repeat(np.cumsum(fan_counts) - fan_counts, fan_counts) + 1
+    first = offsets[triangle_faces[0]]
+    corners = [np.column_stack((first, first + i, first + i + 1))]
+    clockwise = orientation[triangle_faces[0]] < 0
+    corners[0][clockwise] = corners[0][clockwise][:, [0, 2, 1]]
+
+    for f in np.flatnonzero(~convex & (sizes >= 3)):
+        corners.append(offsets[f] + ear_clip(xy[offsets[f]:offsets[f + 1]]))
+        triangle_faces.append(np.full(sizes[f] - 2, f))
+
+    corners, triangle_faces = np.concatenate(corners), np.concatenate(triangle_faces)
+    order = np.argsort(triangle_faces, kind="stable")
+    return corners[order], triangle_faces[order]
+
+
+def roof_mesh(
+        vertices: np.ndarray,
+        faces: list[list[int]],
+        planes: Union[np.ndarray, list[tuple[float, float, float, float]]],
+        watertight: bool = False,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    3D triangle mesh of a roof model from its 2D vertices, face polygons and fitted face planes
+
+    By default every face has its own copies of its vertices, lifted onto its plane, so that height steps between
+    faces are kept. With watertight, faces share vertices lifted to the intersection of their incident planes (see
+    solve_vertices_3d). Faces with vertical planes get NaN heights.
+
+    Returns (mesh_vertices, triangles, triangle_faces): the (M, 3) vertices, the (T, 3) counter-clockwise (upward
+    facing) triangles as indices into mesh_vertices and the face of each triangle.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    planes = np.asarray(planes, dtype=float).reshape(-1, 4)
+    corners, triangle_faces = triangulate_faces(vertices, faces)
+    vertex_ids = np.concatenate(faces).astype(np.int64) if faces else np.empty(0, dtype=np.int64)
+
+    if watertight:
+        vertices_3d, _ = solve_vertices_3d(vertices, faces, planes)
+        used, triangles = np.unique(vertex_ids[corners], return_inverse=True)
+        return vertices_3d[used], triangles.reshape(-1, 3), triangle_faces
+
+    # z = -(ax + by + d) / c on the plane of the face listing the vertex
+    a, b, c, d = planes[np.repeat(np.arange(len(faces)), [len(face) for face in faces])].T
+    xy = vertices[vertex_ids, :2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(c > 0, -(a * xy[:, 0] + b * xy[:, 1] + d) / c, np.nan)
+    return np.column_stack((xy, z)), corners, triangle_faces
+
+
+class MeshWriter(ABC):
+    """
+    Streaming writer of the triangle meshes of many buildings into a single file
+
+    add appends a building's mesh, whose triangles index its own vertices; they are offset by the vertices written
+    before. Use it as a context manager, or call close, to complete the file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.n_vertices = 0
+        self.n_triangles = 0
+        self.n_meshes = 0
+        self._fp = open(self.path, "wb", buffering=BUFFER_SIZE)
+
+    @abstractmethod
+    def add(
+            self,
+            mesh_vertices: np.ndarray,
+            triangles: np.ndarray,
+            triangle_faces: np.ndarray = None,
+            name: str = None,
+    ) -> int:
+        """
+        Append a mesh (e.g. from roof_mesh); returns its building index in the file
+        """
+
+    def _added(self, mesh_vertices: np.ndarray, triangles: np.ndarray) -> int:
+        self.n_vertices += len(mesh_vertices)
+        self.n_triangles += len(triangles)
+        self.n_meshes += 1
+        return self.n_meshes - 1
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self) -> "MeshWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class PlyMeshWriter(MeshWriter):
+    """
+    Binary little endian PLY with double vertex coordinates and, per triangle, its building and face index
+
+    Vertices are written to the file as they are added while triangles are spooled to a temporary file and appended
+    on close, when the element counts in the fixed-width header are filled in.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._triangles_fp = tempfile.TemporaryFile(buffering=BUFFER_SIZE)
+        self._fp.write(self._header())
+
+    def _header(self) -> bytes:
+        # counts are zero-padded to a fixed width so that the header can be rewritten in place
+        return (
+            "ply\n"
+            "format binary_little_endian 1.0\n"
+            f"element vertex {self.n_vertices:012d}\n"
+            "property double x\n"
+            "property double y\n"
+            "property double z\n"
+            f"element face {self.n_triangles:012d}\n"
+            "property list uchar int vertex_indices\n"
+            "property int building\n"
+            "property int face\n"
+            "end_header\n"
+        ).encode("ascii")
+
+    def add(
+            self,
+            mesh_vertices: np.ndarray,
+            triangles: np.ndarray,
+            triangle_faces: np.ndarray = None,
+            name: str = None,
+    ) -> int:
+        if self.n_vertices + len(mesh_vertices) > np.iinfo(np.int32).max:
+            raise ValueError(f"Too many vertices for PLY int vertex indices in {self.path}")
+        self._fp.write(np.ascontiguousarray(mesh_vertices, dtype="<f8").data)
+
+        records = np.empty(len(triangles), dtype=PLY_FACE_DTYPE)
+        records["count"] = 3
+        records["vertex_indices"] = np.asarray(triangles) + self.n_vertices
+        records["building"] = self.n_meshes
+        records["face"] = -1 if triangle_faces is None else triangle_faces
+        self._triangles_fp.write(records.data)
+        return self._added(mesh_vertices, triangles)
+
+    def close(self):
+        if self._fp.closed:
+            return
+        self._triangles_fp.seek(0)
+        shutil.copyfileobj(self._triangles_fp, self._fp, BUFFER_SIZE)
+        self._triangles_fp.close()
+        self._fp.seek(0)
+        self._fp.write(self._header())
+        super().close()
+
+
+class ObjMeshWriter(MeshWriter):
+    """
+    Wavefront OBJ with an object per building (named by name, or by its building index)
+
+    OBJ is a text format; each mesh's vertex and face lines are formatted from the arrays in bulk.
+    """
+
+    def add(
+            self,
+            mesh_vertices: np.ndarray,
+            triangles: np.ndarray,
+            triangle_faces: np.ndarray = None,
+            name: str = None,
+    ) -> int:
+        mesh_vertices = np.asarray(mesh_vertices, dtype=float).reshape(-1, 3)
+        triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3) + self.n_vertices + 1  # 1-based
+        self._fp.write(f"o {self.n_meshes if name is None else name}\n".encode())
+        self._fp.write(("v %.6f %.6f %.6f\n" * len(mesh_vertices) % tuple(mesh_vertices.ravel())).encode("ascii"))
+        self._fp.write(("f %d %d %d\n" * len(triangles) % tuple(triangles.ravel().tolist())).encode("ascii"))
+        return self._added(mesh_vertices, triangles)
+
+
+def open_mesh_writer(path: Path) -> MeshWriter:
+    """
+    PlyMeshWriter or ObjMeshWriter by the suffix of path
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".ply":
+        return PlyMeshWriter(path)
+    if suffix == ".obj":
+        return ObjMeshWriter(path)
+    raise ValueError(f"Unsupported mesh file suffix {suffix}: expected .ply or .obj")
+
+
+def write_roof_meshes(
+        path: Path,
+        buildings: Iterable[tuple[str, np.ndarray, list[list[int]], np.ndarray]],
+        watertight: bool = False,
+) -> int:
+    """
+    Stream the roof meshes of (name, vertices, faces, planes) buildings into one PLY or OBJ file
+
+    Only one building's mesh is held in memory at a time. Returns the number of buildings written.
+    """
+    with open_mesh_writer(path) as writer:
+        for name, vertices, faces, planes in buildings:
+            writer.add(*roof_mesh(vertices, faces, planes, watertight=watertight), name=name)
+        return writer.n_meshes
+
+
+if __name__ == "__main__":
+    from synthetic import complex_roof
+
+    roof_ = complex_roof(n_faces=20)
+    mesh_vertices_, triangles_, triangle_faces_ = roof_mesh(roof_.vertices, roof_.faces, roof_.planes)
+    print(f"{len(roof_.faces)} faces -> {len(triangles_)} triangles, {len(mesh_vertices_)} vertices")
+
+    with tempfile.TemporaryDirectory() as tmp_path_:
+        for suffix_ in (".ply", ".obj"):
+            mesh_path_ = Path(tmp_path_) / f"roofs{suffix_}"
+            write_roof_meshes(mesh_path_, ((f"b{i_}", roof_.vertices, roof_.faces, roof_.planes) for i_ in range(1000)))
+            print(f"{mesh_path_.name}: {mesh_path_.stat().st_size / 1e6:.1f} MB")
@@ -0,0 +1,115 @@
+import numpy as np
+from typing import Literal, Union
+
+from model_roof_planes import fit_plane_ransac
+from planar_regression import face_moments, face_seeds, planes_from_moments
+from point_cloud_utils import PointCloud, PointGrid, assign_points_to_faces, point_xyz, points_in_polygon
+
+
+class RoofModel:
+    """
+    Stateful roof model that re-fits only the faces affected by an edit of the face polygons
+
+    Keeps the point-to-face assignment, a grid index of the points, per-face sufficient statistics (point count,
+    sums and outer-product sums) and per-face RANSAC seeds. When a vertex moves, only points near the edges of the
+    faces that share it are re-tested, the statistics are updated by the points that changed face, and only faces
+    that gained or lost points are re-fit.
+    """
+
+    def __init__(
+            self,
+            point_cloud: Union[np.ndarray, PointCloud],
+            vertices: np.ndarray,
+            faces: list[list[int]],
+            algorithm: Literal["ransac", "least_squares"] = "least_squares",
+            seed: int = 0,
+    ):
+        self.xyz = point_xyz(point_cloud)
+        self.vertices = np.array(vertices, dtype=float)
+        self.faces = [list(face) for face in faces]
+        self.algorithm = algorithm
+        self.seeds = face_seeds(seed, len(faces))
+
+        self.grid = PointGrid(self.xyz)
+        self.labels, _ = assign_points_to_faces(self.xyz, self.face_polygons(), self.grid)
+        # moments are kept relative to the centroid of the points to avoid cancellation with large coordinates
+        self.origin = self.xyz.mean(axis=0, dtype=float) if len(self.xyz) else np.zeros(3)
+        self.counts, self.sums, self.outer_sums = face_moments(self.xyz - self.origin, self.labels, len(faces))
+
+        self.planes = np.full((len(faces), 4), np.nan)
+        self.valid = np.zeros(len(faces), dtype=bool)
+        self._fit(np.arange(len(faces)))
+
+    def face_polygons(self) -> list[np.ndarray]:
+        return [self.vertices[face, :] for face in self.faces]
+
+    def roof_planes(self) -> list[tuple[float, float, float, float]]:
+        """
+        Plane (a, b, c, d) of each face, like model_roof_planes
+        """
+        return [tuple(plane) for plane in self.planes.tolist()]
+
+    def _fit(self, face_ids: np.ndarray):
+        if len(face_ids) == 0:
+            return
+        if self.algorithm == "least_squares":
+            planes, self.valid[face_ids] = planes_from_moments(
+                self.counts[face_ids], self.sums[face_ids], self.outer_sums[face_ids])
+            planes[:, 3] -= planes[:, :3] @ self.origin
+            self.planes[face_ids] = planes
+            return
+        for f in face_ids:
+            face_points = self.xyz[self.labels == f, :]
+            self.valid[f] = len(face_points) >= 3
+            if self.valid[f]:
+                self.planes[f], _, _ = fit_plane_ransac(face_points, seed=self.seeds[f])
+            else:
+                self.planes[f] = np.nan
+
+    def move_vertex(self, v: int, xy: np.ndarray) -> list[int]:
+        """
+        Move vertex v to xy and re-fit the affected faces; returns the indices of the re-fit faces
+        """
+        old_xy = self.vertices[v].copy()
+        self.vertices[v] = xy
+
+        # the area a face gains or loses lies within the triangles formed by the moved vertex (at its old and new
+        # position) and its neighbors along the face outline
+        candidates = []
+        for face in self.faces:
+            if v not in face:
+                continue
+            k = face.index(v)
+            corners = np.array([old_xy, xy, self.vertices[face[k - 1]], self.vertices[face[(k + 1) % len(face)]]])
+            candidates.append(self.grid.query_bbox(corners.min(axis=0), corners.max(axis=0)))
+        if not candidates:
+            return []
+        candidates = np.unique(np.concatenate(candidates))
+        if len(candidates) == 0:
+            return []
+
+        # re-assign the candidate points, testing faces in index order so that the lowest face index wins
+        xy_candidates = self.xyz[candidates, :2]
+        lo, hi = xy_candidates.min(axis=0), xy_candidates.max(axis=0)
+        new_labels = np.full(len(candidates), -1, dtype=self.labels.dtype)
+        for f, face_polygon in enumerate(self.face_polygons()):
+            if np.any(face_polygon.max(axis=0) < lo) or np.any(face_polygon.min(axis=0) > hi):
+                continue
+            unassigned = np.flatnonzero(new_labels < 0)
+            new_labels[unassigned[points_in_polygon(xy_candidates[unassigned], face_polygon)]] = f
+
+        # update the sufficient statistics by the points that changed face
+        changed = new_labels != self.labels[candidates]
+        changed_points = self.xyz[candidates[changed], :] - self.origin
+        old_labels = self.labels[candidates[changed]]
+        for sign, labels in ((-1.0, old_labels), (1.0, new_labels[changed])):
+            counts, sums, outer_sums = face_moments(changed_points, labels, len(self.faces))
+            self.counts += sign * counts
+            self.sums += sign * sums
+            self.outer_sums += sign * outer_sums
+        self.labels[candidates[changed]] = new_labels[changed]
+
+        refit = np.union1d(old_labels, new_labels[changed])
+        refit = refit[refit >= 0]
+        self._fit(refit)
+        return refit.tolist()
@@ -0,0 +1,126 @@
+import sys
+import weakref
+from multiprocessing import shared_memory
+from typing import Union
+
+import numpy as np
+
+from point_cloud_utils import PointCloud
+
+
+##############################
+# A point cloud in a shared memory block that worker processes attach to by name instead of receiving a pickled
+# copy. The columns (xyz, normals, colors) are laid out one after another in a single block and viewed as (N, 3)
+# NumPy arrays, so every process reads the same physical memory.
+#
+# The creating process owns the block and unlinks it when closed, garbage collected or at exit; should the owner
+# crash, its resource tracker unlinks the block. Workers, started by the owner through multiprocessing so that they
+# share its resource tracker, only map the block and never unlink it, so a crashed worker leaves the block intact
+# for the owner and the other workers. A process unmaps the block once the last
+# array viewing it is gone, which may be after the point cloud is closed.
+##############################
+
+
+COLUMNS = ("xyz", "normals", "colors")
+
+
+def _close(shm: shared_memory.SharedMemory):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # arrays still view the block at interpreter exit; the mapping goes with the process
+
+
+def _unlink(shm: shared_memory.SharedMemory):
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # before Python 3.13 attaching registers the block with the resource tracker. Processes started by the owner
+    # through multiprocessing share its tracker, where the block is already registered, so this changes nothing;
+    # unregistering it here would remove the owner's registration and leak the block should the owner crash
+    return shared_memory.SharedMemory(name=name)
+
+
+class SharedPointCloud(PointCloud):
+    """
+    PointCloud whose columns are views into a shared memory block
+
+    Create one with SharedPointCloud.create in the parent process and pass it to workers (e.g. as an argument of
+    ProcessPoolExecutor.submit): it pickles as the name and layout of the block, and unpickles by attaching to it.
+    Use it as a context manager, or call close, to release the block; the owner also unlinks it.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, n_points: int, dtypes: dict, owner: bool):
+        self._shm = shm
+        self.n_points = n_points
+        self.dtypes = dtypes  # column name -> dtype string, in layout order
+        self.owner = owner
+        self._finalizer = weakref.finalize(self, _unlink, shm) if owner else None
+
+        # the columns are views of one byte array, whose buffer (a memoryview kept as its base) is released with the
+        # last array viewing the block; the block can only be unmapped after that
+        block = np.frombuffer(shm.buf, dtype=np.uint8)
+        weakref.finalize(block.base, _close, shm)
+        columns, offset = {}, 0
+        for name, dtype in dtypes.items():
+            nbytes = 3 * n_points * np.dtype(dtype).itemsize
+            column = block[offset:offset + nbytes].view(dtype).reshape(n_points, 3)
+            column.flags.writeable = owner
+            columns[name] = column
+            offset += nbytes
+        super().__init__(columns["xyz"], columns.get("normals"), columns.get("colors"))
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @classmethod
+    def create(cls, point_cloud: Union[np.ndarray, PointCloud]) -> "SharedPointCloud":
+        """
+        Copy a point cloud array with columns x, y, z, nx, ny, nz, r, g, b, or a PointCloud, into a new shared block
+
+        PointCloud columns keep their dtypes; columns that are None are left out.
+        """
+        if not isinstance(point_cloud, PointCloud):
+            point_cloud = PointCloud(point_cloud[:, :3], point_cloud[:, 3:6], point_cloud[:, 6:9])
+        columns = {name: getattr(point_cloud, name) for name in COLUMNS if getattr(point_cloud, name) is not None}
+        dtypes = {name: column.dtype.str for name, column in columns.items()}
+
+        n_points = len(point_cloud)
+        size = sum(n_points * 3 * np.dtype(dtype).itemsize for dtype in dtypes.values())
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        shared = cls(shm, n_points, dtypes, owner=True)
+        for name, column in columns.items():
+            getattr(shared, name)[:] = column
+        return shared
+
+    @classmethod
+    def attach(cls, name: str, n_points: int, dtypes: dict) -> "SharedPointCloud":
+        """
+        Read-only view of an existing shared block; closing it does not unlink the block
+        """
+        return cls(_attach(name), n_points, dtypes, owner=False)
+
+    def __reduce__(self):
+        return SharedPointCloud.attach, (self.name, self.n_points, self.dtypes)
+
+    def close(self):
+        """
+        Drop this process's views of the block, which unmaps it unless other arrays still view it; the owner also
+        unlinks the block
+        """
+        self.xyz = self.normals = self.colors = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self) -> "SharedPointCloud":
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
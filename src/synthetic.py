@@ -0,0 +1,220 @@
+import json
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from plyfile import PlyData, PlyElement
+from typing import NamedTuple
+
+from planar_regression import standardize_planes_np
+from point_cloud_utils import assign_points_to_faces, world_to_image
+
+
+##############################
+# Synthetic roofs for tests and benchmarks. Roofs are built in world coordinates (meters) and converted to the
+# metadata format (pixel vertices, edges, faces, pixels_per_meter) of the "data" folder.
+##############################
+
+
+class SyntheticRoof(NamedTuple):
+    vertices: np.ndarray  # (V, 2) world xy in meters
+    edges: np.ndarray  # (E, 2) vertex indices
+    faces: list[list[int]]  # vertex indices of each face polygon
+    planes: np.ndarray  # (F, 4) standardized plane (a, b, c, d) of each face
+
+
+def _slope_plane(gradient_x: float, gradient_y: float, z_0: float) -> np.ndarray:
+    """
+    Plane z = gradient_x * x + gradient_y * y + z_0 as (a, b, c, d)
+    """
+    return np.array([-gradient_x, -gradient_y, 1.0, -z_0])
+
+
+def _build_roof(vertices: list[tuple[float, float]], faces: list[list[int]], planes: list[np.ndarray]) -> SyntheticRoof:
+    """
+    Merge duplicated vertices and derive the edges of the face polygons
+    """
+    vertex_ids, merged_vertices, merged_faces = {}, [], []
+    for face in faces:
+        merged_face = []
+        for v in face:
+            key = tuple(np.round(vertices[v], 6))
+            if key not in vertex_ids:
+                vertex_ids[key] = len(merged_vertices)
+                merged_vertices.append(key)
+            merged_face.append(vertex_ids[key])
+        merged_faces.append(merged_face)
+
+    edges = sorted({tuple(sorted((v_1, v_2))) for face in merged_faces for v_1, v_2 in zip(face, face[1:] + face[:1])})
+    return SyntheticRoof(
+        vertices=np.array(merged_vertices, dtype=float),
+        edges=np.array(edges, dtype=int),
+        faces=merged_faces,
+        planes=standardize_planes_np(np.array(planes, dtype=float)),
+    )
+
+
+def gable_roof(
+        width: float = 20.0,
+        depth: float = 10.0,
+        slope: float = 0.5,
+        eave_height: float = 3.0,
+        center: tuple[float, float] = (0.0, 0.0),
+) -> SyntheticRoof:
+    """
+    Gable roof with 2 faces and a ridge along x
+    """
+    x, y = center
+    w, d = width / 2, depth / 2
+    vertices = [(x - w, y - d), (x + w, y - d), (x + w, y), (x + w, y + d), (x - w, y + d), (x - w, y)]
+    faces = [[0, 1, 2, 5], [5, 2, 3, 4]]
+    planes = [
+        _slope_plane(0.0, slope, eave_height + slope * (d - y)),  # south face rises to the north
+        _slope_plane(0.0, -slope, eave_height + slope * (d + y)),  # north face rises to the south
+    ]
+    return _build_roof(vertices, faces, planes)
+
+
+def hip_roof(
+        width: float = 20.0,
+        depth: float = 10.0,
+        slope: float = 0.5,
+        eave_height: float = 3.0,
+        center: tuple[float, float] = (0.0, 0.0),
+) -> SyntheticRoof:
+    """
+    Hip roof with 4 faces of equal slope and a ridge along x (width >= depth)
+    """
+    x, y = center
+    w, d = width / 2, depth / 2
+    vertices = [(x - w, y - d), (x + w, y - d), (x + w, y + d), (x - w, y + d), (x - w + d, y), (x + w - d, y)]
+    faces = [[0, 1, 5, 4], [1, 2, 5], [2, 3, 4, 5], [3, 0, 4]]
+    planes = [
+        _slope_plane(0.0, slope, eave_height + slope * (d - y)),  # south
+        _slope_plane(-slope, 0.0, eave_height + slope * (w + x)),  # east
+        _slope_plane(0.0, -slope, eave_height + slope * (d + y)),  # north
+        _slope_plane(slope, 0.0, eave_height + slope * (w - x)),  # west
+    ]
+    return _build_roof(vertices, faces, planes)
+
+
+def complex_roof(
+        n_faces: int = 20,
+        module_width: float = 12.0,
+        module_depth: float = 8.0,
+        eave_height: float = 3.0,
+        seed: int = 0,
+) -> SyntheticRoof:
+    """
+    Complex roof made of a grid of gable modules with varying slopes; n_faces is rounded up to an even number
+    """
+    rng = np.random.default_rng(seed)
+    n_modules = (n_faces + 1) // 2
+    n_cols = int(np.ceil(np.sqrt(n_modules)))
+    n_rows = int(np.ceil(n_modules / n_cols))
+
+    vertices, faces, planes = [], [], []
+    for m in range(n_modules):
+        row, col = divmod(m, n_cols)
+        center = ((col - (n_cols - 1) / 2) * module_width, (row - (n_rows - 1) / 2) * module_depth)
+        module = gable_roof(module_width, module_depth, rng.uniform(0.2, 0.8), eave_height, center)
+        faces += [[len(vertices) + v for v in face] for face in module.faces]
+        vertices += [tuple(v) for v in module.vertices]
+        planes += list(module.planes)
+    return _build_roof(vertices, faces, planes)
+
+
+def sample_roof_points(
+        roof: SyntheticRoof,
+        n_points: int,
+        noise: float = 0.02,
+        outlier_rate: float = 0.0,
+        margin: float = 2.0,
+        seed: int = 0,
+) -> np.ndarray:
+    """
+    Sample a (N, 9) point cloud with columns x, y, z, nx, ny, nz, r, g, b over the roof and surrounding ground
+
+    Points are uniform in xy over the roof bounding box plus margin. Roof points lie on their face plane with
+    gaussian z noise; a fraction outlier_rate of roof points is lifted 0.5 to 5 meters (e.g. HVAC units and
+    chimneys) and given the normal of a flat top or vertical side. Ground points are at z = 0.
+    """
+    rng = np.random.default_rng(seed)
+    xy_min = roof.vertices.min(axis=0) - margin
+    xy_max = roof.vertices.max(axis=0) + margin
+    xy = rng.uniform(xy_min, xy_max, size=(n_points, 2))
+
+    labels, _ = assign_points_to_faces(xy, [roof.vertices[face, :] for face in roof.faces])
+    on_roof = labels >= 0
+
+    # z on the face planes: z = -(ax + by + d) / c
+    point_cloud = np.zeros((n_points, 9))
+    point_cloud[:, :2] = xy
+    a, b, c, d = roof.planes[labels[on_roof]].T
+    point_cloud[on_roof, 2] = -(a * xy[on_roof, 0] + b * xy[on_roof, 1] + d) / c
+    point_cloud[:, 2] += rng.normal(scale=noise, size=n_points)
+    outliers = on_roof & (rng.random(n_points) < outlier_rate)
+    point_cloud[outliers, 2] += rng.uniform(0.5, 5.0, size=np.count_nonzero(outliers))
+
+    # normals of the face planes or ground, with a little noise
+    normals = np.tile([0.0, 0.0, 1.0], (n_points, 1))
+    normals[on_roof] = roof.planes[labels[on_roof], :3]
+    normals += rng.normal(scale=0.05, size=(n_points, 3))
+    # outliers are on the flat tops or vertical sides of rooftop objects
+    outlier_normals = np.zeros((np.count_nonzero(outliers), 3))
+    on_side = rng.random(len(outlier_normals)) < 0.5
+    angles = rng.uniform(0.0, 2 * np.pi, size=np.count_nonzero(on_side))
+    outlier_normals[on_side, 0], outlier_normals[on_side, 1] = np.cos(angles), np.sin(angles)
+    outlier_normals[~on_side, 2] = 1.0
+    normals[outliers] = outlier_normals + rng.normal(scale=0.05, size=outlier_normals.shape)
+    point_cloud[:, 3:6] = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+    # gray ground and one color per face
+    face_colors = rng.integers(64, 256, size=(len(roof.faces), 3))
+    point_cloud[:, 6:9] = 128
+    point_cloud[on_roof, 6:9] = face_colors[labels[on_roof]]
+    return point_cloud
+
+
+def roof_metadata(roof: SyntheticRoof, ppm: float, image_shape: tuple[int, int]) -> dict:
+    """
+    Roof in the metadata.json format with vertices in pixels of an image of the given shape
+    """
+    return {
+        "pixels_per_meter": float(ppm),
+        "vertices": world_to_image(roof.vertices, ppm, image_shape).tolist(),
+        "edges": roof.edges.tolist(),
+        "faces": roof.faces,
+    }
+
+
+def write_synthetic_building(
+        data_path: Path,
+        uid: str,
+        roof: SyntheticRoof,
+        point_cloud: np.ndarray,
+        ppm: float = 10.0,
+) -> tuple[int, int]:
+    """
+    Write a building folder (ortho.png, dsm.ply, metadata.json) for a synthetic roof and point cloud
+
+    The blank ortho covers the point cloud, centered at the world origin. Returns the image shape.
+    """
+    building_path = Path(data_path) / uid
+    building_path.mkdir(parents=True, exist_ok=True)
+
+    # odd image dimensions so that the world origin is the center pixel
+    half_extent = np.abs(point_cloud[:, :2]).max(axis=0) if len(point_cloud) else np.zeros(2)
+    cols, rows = (2 * np.ceil(half_extent * ppm).astype(int) + 1).tolist()
+    Image.new("RGB", (cols, rows)).save(building_path / "ortho.png")
+
+    with open(building_path / "metadata.json", "w") as fp:
+        json.dump(roof_metadata(roof, ppm, (rows, cols)), fp)
+
+    dtype = [(name, "f4") for name in ("x", "y", "z", "nx", "ny", "nz")] + \
+            [(name, "u1") for name in ("red", "green", "blue")]
+    vertex = np.empty(len(point_cloud), dtype=dtype)
+    for i, name in enumerate(dtype):
+        vertex[name[0]] = point_cloud[:, i]
+    PlyData([PlyElement.describe(vertex, "vertex")]).write(str(building_path / "dsm.ply"))
+
+    return rows, cols
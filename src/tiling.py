@@ -0,0 +1,185 @@
+import json
+import numpy as np
+from pathlib import Path
+from typing import Iterable, Union
+
+from point_cloud_utils import PointCloud, point_xyz
+
+
+##############################
+# Large area point clouds are split once into square xy tiles so that a building is cropped by reading only the
+# tiles under its footprint. A tile folder is organized with the following structure
+#
+# <tiles>/index.json
+# <tiles>/<i>_<j>.xyz.bin
+# <tiles>/<i>_<j>.normals.bin
+# <tiles>/<i>_<j>.colors.bin
+#
+# where tile (i, j) covers x in [i, i + 1) * tile_size and y in [j, j + 1) * tile_size.
+##############################
+
+
+COLUMNS = ("xyz", "normals", "colors")
+
+
+class TileIndex:
+    """
+    Index of the tiles of a point cloud: the xyz bounds and point count of each tile and the column dtypes
+    """
+
+    def __init__(self, tiles_path: Path, tile_size: float, dtypes: dict, tiles: dict):
+        self.tiles_path = Path(tiles_path)
+        self.tile_size = tile_size
+        self.dtypes = dtypes  # column name -> dtype string
+        self.tiles = tiles  # (i, j) -> {"bounds": [[x, y, z], [x, y, z]], "count": n}
+
+    @classmethod
+    def build(
+            cls,
+            chunks: Iterable[Union[np.ndarray, PointCloud]],
+            tiles_path: Path,
+            tile_size: float = 100.0,
+    ) -> "TileIndex":
+        """
+        Split a point cloud read in chunks (e.g. iter_ply_chunks) into tiles in a single pass
+        """
+        tiles_path = Path(tiles_path)
+        tiles_path.mkdir(parents=True, exist_ok=True)
+        for tile_path in tiles_path.glob("*.bin"):
+            tile_path.unlink()  # tile files are appended to
+        dtypes, tiles = {}, {}
+
+        for chunk in chunks:
+            if not isinstance(chunk, PointCloud):
+                chunk = PointCloud(chunk[:, :3], chunk[:, 3:6], chunk[:, 6:9])
+            columns = {name: getattr(chunk, name) for name in COLUMNS if getattr(chunk, name) is not None}
+            dtypes = dtypes or {name: column.dtype.str for name, column in columns.items()}
+
+            # group the chunk's points by tile
+            keys = np.floor(chunk.xyz[:, :2] / tile_size).astype(np.int64)
+            unique_keys, tile_ids = np.unique(keys, axis=0, return_inverse=True)
+            order = np.argsort(tile_ids.ravel(), kind="stable")
+            starts = np.searchsorted(tile_ids.ravel()[order], np.arange(len(unique_keys) + 1))
+
+            for k, (i, j) in enumerate(unique_keys.tolist()):
+                idx = order[starts[k]:starts[k + 1]]
+                for name, column in columns.items():
+                    with open(tiles_path / f"{i}_{j}.{name}.bin", "ab") as fp:
+                        fp.write(np.ascontiguousarray(column[idx], dtype=dtypes[name]).tobytes())
+
+                xyz = chunk.xyz[idx]
+                lo, hi = xyz.min(axis=0).tolist(), xyz.max(axis=0).tolist()
+                tile = tiles.setdefault((i, j), {"bounds": [lo, hi], "count": 0})
+                tile["bounds"] = [
+                    np.minimum(tile["bounds"][0], lo).tolist(),
+                    np.maximum(tile["bounds"][1], hi).tolist(),
+                ]
+                tile["count"] += len(idx)
+
+        tile_index = cls(tiles_path, tile_size, dtypes, tiles)
+        tile_index.save()
+        return tile_index
+
+    def save(self):
+        with open(self.tiles_path / "index.json", "w") as fp:
+            json.dump({
+                "tile_size": self.tile_size,
+                "dtypes": self.dtypes,
+                "tiles": [{"key": list(key), **tile} for key, tile in sorted(self.tiles.items())],
+            }, fp)
+
+    @classmethod
+    def load(cls, tiles_path: Path) -> "TileIndex":
+        with open(Path(tiles_path) / "index.json", "r") as fp:
+            data = json.load(fp)
+        tiles = {tuple(tile.pop("key")): tile for tile in data["tiles"]}
+        return cls(tiles_path, data["tile_size"], data["dtypes"], tiles)
+
+    def tiles_in_bbox(self, xy_min: np.ndarray, xy_max: np.ndarray) -> list[tuple[int, int]]:
+        """
+        Keys of the tiles whose point bounds overlap the box [xy_min, xy_max]
+
+        Only the keys of the tiles the box covers are looked up, so the cost grows with the box rather than the
+        survey. The key range is padded by a tile, since points are keyed by their (possibly float32) coordinates.
+        """
+        (i_min, j_min), (i_max, j_max) = (np.floor(np.array([xy_min, xy_max], dtype=float) / self.tile_size)
+                                          .astype(np.int64).tolist())
+        i_range, j_range = range(i_min - 1, i_max + 2), range(j_min - 1, j_max + 2)
+        if len(i_range) * len(j_range) <= len(self.tiles):
+            candidates = [(i, j) for i in i_range for j in j_range if (i, j) in self.tiles]
+        else:
+            candidates = sorted(self.tiles)  # a box larger than the survey
+
+        keys = []
+        for key in candidates:
+            lo, hi = self.tiles[key]["bounds"]
+            if lo[0] <= xy_max[0] and hi[0] >= xy_min[0] and lo[1] <= xy_max[1] and hi[1] >= xy_min[1]:
+                keys.append(key)
+        return keys
+
+    def read_tile(self, key: tuple[int, int]) -> PointCloud:
+        """
+        Memory-map the columns of a tile
+        """
+        i, j = key
+        count = self.tiles[key]["count"]
+        columns = {
+            name: np.memmap(self.tiles_path / f"{i}_{j}.{name}.bin", dtype=dtype, mode="r", shape=(count, 3))
+            for name, dtype in self.dtypes.items()
+        }
+        return PointCloud(columns["xyz"], columns.get("normals"), columns.get("colors"))
+
+
+def crop_points(tile_index: TileIndex, xy_min: np.ndarray, xy_max: np.ndarray) -> PointCloud:
+    """
+    Points within the box [xy_min, xy_max], read only from the tiles that overlap the box
+    """
+    parts = []
+    for key in tile_index.tiles_in_bbox(xy_min, xy_max):
+        tile = tile_index.read_tile(key)
+        xy = tile.xyz[:, :2]
+        parts.append(tile.select(np.all((xy >= xy_min) & (xy <= xy_max), axis=1)))
+
+    def concatenate(name: str) -> np.ndarray:
+        if name not in tile_index.dtypes:
+            return None
+        if not parts:
+            return np.empty((0, 3), dtype=tile_index.dtypes[name])
+        return np.concatenate([getattr(part, name) for part in parts])
+
+    return PointCloud(concatenate("xyz"), concatenate("normals"), concatenate("colors"))
+
+
+def recenter(point_cloud: Union[np.ndarray, PointCloud], center_xy: np.ndarray) -> PointCloud:
+    """
+    Copy of a point cloud with xy translated so that center_xy is the origin, as image_to_world expects
+    """
+    xyz = np.array(point_xyz(point_cloud), dtype=float)
+    xyz[:, :2] -= center_xy
+    if isinstance(point_cloud, PointCloud):
+        return PointCloud(xyz, point_cloud.normals, point_cloud.colors)
+    return PointCloud(xyz, point_cloud[:, 3:6], point_cloud[:, 6:9])
+
+
+def extract_building(
+        tile_index: TileIndex,
+        footprint_xy: np.ndarray,
+        ppm: float,
+        margin: float = 5.0,
+) -> tuple[PointCloud, np.ndarray, tuple[int, int]]:
+    """
+    Crop a building's footprint plus margin (meters) from a tiled point cloud and re-center it
+
+    Returns (point_cloud, center_xy, image_shape): the re-centered points, the world xy of the new origin and the
+    shape of an ortho image at ppm pixels-per-meter covering the crop, whose center is the new origin (see
+    image_to_world and world_to_image).
+    """
+    xy_min = footprint_xy.min(axis=0) - margin
+    xy_max = footprint_xy.max(axis=0) + margin
+    center_xy = (xy_min + xy_max) / 2
+
+    # odd image dimensions so that the center pixel is the origin
+    cols, rows = (2 * np.ceil((xy_max - center_xy) * ppm).astype(int) + 1).tolist()
+
+    point_cloud = recenter(crop_points(tile_index, xy_min, xy_max), center_xy)
+    return point_cloud, center_xy, (rows, cols)
@@ -1,3 +1,8 @@
+import os
+import sys
+from pathlib import Path
+from typing import Iterable, Literal
+
 import matplotlib
 import matplotlib.colors as mp_colors
 import matplotlib.pyplot as plt
@@ -5,9 +10,12 @@ import numpy as np
 from PIL import Image, ImageDraw
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 
-from point_cloud_utils import lasso_points
+from point_cloud_utils import assign_points_to_faces
 
-matplotlib.use('MacOSX')
+# headless by default on machines without a display (e.g. batch workers); set MPLBACKEND to choose a backend
+if "MPLBACKEND" not in os.environ and sys.platform.startswith("linux") \
+        and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+    matplotlib.use("Agg")
 
 
 COLORS = [
@@ -30,6 +38,167 @@ def to_tuple(arr: np.ndarray) -> tuple:
     return tuple(arr.tolist())
 
 
+def decimate_points(
+        xyz: np.ndarray,
+        max_points: int,
+        method: Literal["voxel", "random"] = "voxel",
+        labels: np.ndarray = None,
+        seed: int = 0,
+) -> np.ndarray:
+    """
+    Indices (ascending) of at most max_points points to draw in place of all of them
+
+    method "voxel" keeps one point per cell of a square xy grid whose cell size is grown until at most max_points
+    cells are occupied, which preserves the footprint of sparse areas; "random" samples points uniformly. With face
+    labels, cells do not mix faces and random samples are stratified by face, so every face keeps its share of the
+    budget and at least one point; max_points must therefore be at least the number of distinct labels.
+    """
+    n_points = len(xyz)
+    if n_points <= max_points:
+        return np.arange(n_points)
+    labels = np.zeros(n_points, dtype=np.int64) if labels is None else np.asarray(labels, dtype=np.int64)
+    strata, strata_ids = np.unique(labels, return_inverse=True)
+    if max_points < len(strata):
+        raise ValueError(f"max_points {max_points} is less than the number of faces {len(strata)}")
+
+    if method == "random":
+        # one point per stratum, and the rest of the budget shared in proportion to the strata sizes
+        counts = np.bincount(strata_ids)
+        shares = np.floor((max_points - len(strata)) * counts / n_points).astype(np.int64)
+        quotas = np.minimum(counts, 1 + shares)
+        # rank the points of each stratum in a random order and keep the first quota of each
+        order = np.lexsort((np.random.default_rng(seed).random(n_points), strata_ids))
+        ranks = np.arange(n_points) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.sort(order[ranks < quotas[strata_ids[order]]])
+
+    xy = xyz[:, :2] - xyz[:, :2].min(axis=0)
+    extent = np.maximum(xy.max(axis=0), 1e-9)
+    cell_size = np.sqrt(extent[0] * extent[1] / max_points) if np.all(extent > 1e-9) else extent.max() / max_points
+    while True:
+        cells = np.floor(xy / cell_size).astype(np.int64)
+        n_cols = int(cells[:, 0].max()) + 1
+        n_rows = int(cells[:, 1].max()) + 1
+        keys = (strata_ids * n_rows + cells[:, 1]) * n_cols + cells[:, 0]
+        keys, first = np.unique(keys, return_index=True)
+        # a single cell per stratum is within the budget, so the cells stop growing at the extent of the points
+        if len(keys) <= max_points or (n_cols == 1 and n_rows == 1):
+            return np.sort(first)
+        cell_size = min(cell_size * max(np.sqrt(len(keys) / max_points), 1.05), 2.0 * extent.max())
+
+
+def decimate_faces(
+        point_cloud: np.ndarray,
+        face_indices: list[np.ndarray],
+        max_points: int,
+        method: Literal["voxel", "random"] = "voxel",
+        seed: int = 0,
+) -> list[np.ndarray]:
+    """
+    Per-face point indices decimated to at most max_points in total (see decimate_points)
+
+    All faces are decimated at once so that the budget is shared in proportion to the faces' points.
+    """
+    face_ids = np.repeat(np.arange(len(face_indices)), [len(face_idx) for face_idx in face_indices])
+    point_ids = np.concatenate(face_indices).astype(np.int64) if face_indices else np.empty(0, dtype=np.int64)
+    keep = decimate_points(point_cloud[point_ids, :3], max_points, method=method, labels=face_ids, seed=seed)
+    face_ids, point_ids = face_ids[keep], point_ids[keep]
+    return [point_ids[face_ids == f] for f in range(len(face_indices))]
+
+
+def render_roof(
+        point_cloud: np.ndarray,
+        polygons_2d: list[np.ndarray],
+        planes: list[tuple[float, float, float, float]] = None,
+        face_indices: list[np.ndarray] = None,
+        path: Path = None,
+        max_points: int = 20000,
+        method: Literal["voxel", "random"] = "voxel",
+        single_figure: bool = True,
+        title: str = "",
+        size: float = 6.0,
+        dpi: int = 100,
+        seed: int = 0,
+) -> list[Path]:
+    """
+    Render the points of the roof faces, decimated to max_points in total, and the face polygons on their planes
+
+    face_indices are the per-face point indices from assign_points_to_faces; computed here if not given. Points are
+    drawn with their colors (columns r, g, b) if any, or the color of their face. With single_figure, all faces
+    are drawn in one figure saved to path (a .png); otherwise each face in its own figure, saved to path with the
+    face index appended to its stem. Without path the figures are shown. Returns the paths of the written images.
+    """
+    if face_indices is None:
+        _, face_indices = assign_points_to_faces(point_cloud, polygons_2d)
+
+    face_indices = decimate_faces(point_cloud, face_indices, max_points, method=method, seed=seed)
+
+    def draw(ax, f: int):
+        face_points = point_cloud[face_indices[f], :]
+        if point_cloud.shape[1] >= 9:
+            colors = face_points[:, 6:9] / 255.0
+        else:
+            colors = [np.array(COLORS[f % len(COLORS)]) / 255.0]
+        ax.scatter3D(face_points[:, 0], face_points[:, 1], face_points[:, 2], c=colors, s=1.0, depthshade=False)
+
+        if planes is not None:
+            a, b, c, d = planes[f]  # 3D plane equation:  ax + by + cz + d = 0
+            x, y = polygons_2d[f][:, 0], polygons_2d[f][:, 1]
+            polygon = Poly3DCollection([np.column_stack((x, y, (a * x + b * y + d) / -c))], alpha=0.3)
+            polygon.set_color(mp_colors.rgb2hex(np.array(COLORS[f % len(COLORS)]) / 255.0))
+            ax.add_collection3d(polygon)
+
+    figure_faces = [list(range(len(polygons_2d)))] if single_figure else [[f] for f in range(len(polygons_2d))]
+    paths = []
+    for k, faces in enumerate(figure_faces):
+        fig = plt.figure(figsize=(size, size), dpi=dpi)
+        ax = fig.add_subplot(111, projection='3d')
+        for f in faces:
+            draw(ax, f)
+
+        # figure settings
+        ax.axis('equal')
+        ax.axis('off')
+        ax.set_title(title)
+        fig.tight_layout()
+        if path is None:
+            plt.show()
+        else:
+            path = Path(path)
+            face_path = path if single_figure else path.with_name(f"{path.stem}_{k}{path.suffix}")
+            fig.savefig(face_path)
+            paths.append(face_path)
+
+        # cleanup
+        plt.close(fig)
+    return paths
+
+
+def render_roof_thumbnails(
+        buildings: Iterable[tuple[str, np.ndarray, list[np.ndarray], list[tuple[float, float, float, float]],
+                                  list[np.ndarray]]],
+        output_path: Path,
+        max_points: int = 5000,
+        size: float = 3.0,
+        dpi: int = 80,
+        **kwargs,
+) -> list[Path]:
+    """
+    Render a PNG thumbnail <output_path>/<name>.png of each (name, point_cloud, polygons_2d, planes, face_indices)
+    building, e.g. for quality assurance of a batch
+
+    Buildings are rendered one at a time without a display (see render_roof for the options and for face_indices,
+    which may be None). Returns the paths of the thumbnails.
+    """
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, point_cloud, polygons_2d, planes, face_indices in buildings:
+        paths += render_roof(point_cloud, polygons_2d, planes, face_indices=face_indices,
+                             path=output_path / f"{name}.png", max_points=max_points, size=size, dpi=dpi,
+                             title=name, **kwargs)
+    return paths
+
+
 def visualize_image(img: np.ndarray):
     """
     Visualize an image with matplotlib
@@ -90,12 +259,15 @@ def visualize_point_cloud(
         point_cloud: np.ndarray,
         polygon_2d: np.ndarray = None,
         plane: tuple[float, float, float, float] = None,
+        max_points: int = None,
 ):
     """
     Visualize a 3D point cloud with matplotlib
 
-    Note: Can be very slow
+    Note: Can be very slow; max_points draws a decimated point cloud (see decimate_points)
     """
+    if max_points is not None:
+        point_cloud = point_cloud[decimate_points(point_cloud[:, :3], max_points), :]
     x = point_cloud[:, 0]
     y = point_cloud[:, 1]
     z = point_cloud[:, 2]
@@ -132,17 +304,22 @@ def visualize_point_cloud(
 def visualize_roof_points(
         point_cloud: np.ndarray,
         polygons_2d: list[np.ndarray],
+        face_indices: list[np.ndarray] = None,
 ):
     """
     Visualize roof points with original point cloud
+
+    face_indices are the per-face point indices from assign_points_to_faces; computed here if not given
     """
+    if face_indices is None:
+        _, face_indices = assign_points_to_faces(point_cloud, polygons_2d)
 
-    for polygon_2d in polygons_2d:
+    for face_idx in face_indices:
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
 
         # face points
-        face_points = lasso_points(polygon_2d, point_cloud)
+        face_points = point_cloud[face_idx, :]
 
         # points
         x = face_points[:, 0]
@@ -168,19 +345,25 @@ def visualize_roof_planes(
         polygons_2d: list[np.ndarray],
         planes: list[tuple[float, float, float, float]],
         title: str = "",
+        face_indices: list[np.ndarray] = None,
 ):
     """
     Visualize roof planes with original point cloud
+
+    face_indices are the per-face point indices from assign_points_to_faces; computed here if not given
     """
+    if face_indices is None:
+        _, face_indices = assign_points_to_faces(point_cloud, polygons_2d)
+
     # fig = plt.figure()
     # ax = fig.add_subplot(111, projection='3d')
 
-    for polygon_2d, plane in zip(polygons_2d, planes):
+    for polygon_2d, plane, face_idx in zip(polygons_2d, planes, face_indices):
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
 
         # face points
-        face_points = lasso_points(polygon_2d, point_cloud)
+        face_points = point_cloud[face_idx, :]
 
         # plane_1 as a 2D polygon
         a, b, c, d = plane  # 3D plane equation:  ax + by + cz + d = 0
@@ -217,15 +400,25 @@ def visualize_roof_model(
         polygons_2d: list[np.ndarray],
         planes: list[tuple[float, float, float, float]],
         title: str = "",
+        face_indices: list[np.ndarray] = None,
+        max_points: int = None,
 ):
     """
     Visualize a 3D roof model
+
+    face_indices are the per-face point indices from assign_points_to_faces; computed here if not given. max_points
+    draws a decimated point cloud (see decimate_faces).
     """
+    if face_indices is None:
+        _, face_indices = assign_points_to_faces(point_cloud, polygons_2d)
+    if max_points is not None:
+        face_indices = decimate_faces(point_cloud, face_indices, max_points)
+
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
 
-    for polygon_2d, plane in zip(polygons_2d, planes):
-        face_points = lasso_points(polygon_2d, point_cloud)
+    for plane, face_idx in zip(planes, face_indices):
+        face_points = point_cloud[face_idx, :]
         a, b, c, d = plane
         x = face_points[:, 0]
         y = face_points[:, 1]